@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""
+Web Portal Startup Benchmark
+
+Measures how long a fresh interpreter takes to boot the web portal, the
+cost every gunicorn worker and every test process pays. Each run starts a
+new Python process that:
+1. Imports the third-party frameworks the portal is built on
+2. Imports the portal's app module
+3. Calls create_app against an up-to-date database
+
+The framework imports are reported separately, since they do not depend
+on the portal; the portal's own startup is the last two steps.
+"""
+
+import os
+import sys
+import json
+import argparse
+import tempfile
+import statistics
+import subprocess
+from tabulate import tabulate
+
+PORTAL_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'web-portal')
+
+# Runs in the child process; prints one JSON line of timings in seconds
+CHILD_SCRIPT = """
+import sys, json, time
+started = time.perf_counter()
+import flask, flask_sqlalchemy, flask_wtf, flask_login, sqlalchemy.orm, requests
+import cryptography.fernet, cryptography.hazmat.primitives.ciphers.aead
+frameworks = time.perf_counter()
+import app
+imported = time.perf_counter()
+app.create_app()
+created = time.perf_counter()
+print(json.dumps({
+    'frameworks': frameworks - started,
+    'import': imported - frameworks,
+    'create_app': created - imported,
+    'pkcs11_loaded': 'pkcs11' in sys.modules,
+    'cryptodome_loaded': 'Cryptodome' in sys.modules,
+}))
+"""
+
+
+def run_once(env, workdir):
+    """Boot the portal in a fresh interpreter and return its timings"""
+    result = subprocess.run([sys.executable, '-c', CHILD_SCRIPT], cwd=workdir, env=env,
+                            capture_output=True, text=True, check=True)
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark web portal cold start')
+    parser.add_argument('--runs', type=int, default=10, help='Number of cold starts to time')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        env = dict(os.environ,
+                   PYTHONPATH=PORTAL_DIR,
+                   DATABASE_URL=f"sqlite:///{os.path.join(workdir, 'benchmark.db')}",
+                   LOG_LEVEL='WARNING')
+
+        # The first boot migrates the empty database and warms the bytecode cache
+        run_once(env, workdir)
+        runs = [run_once(env, workdir) for _ in range(args.runs)]
+
+    rows = []
+    for phase in ('frameworks', 'import', 'create_app'):
+        values = [run[phase] * 1000 for run in runs]
+        rows.append([phase, f"{min(values):.1f}", f"{statistics.median(values):.1f}", f"{max(values):.1f}"])
+    portal = [(run['import'] + run['create_app']) * 1000 for run in runs]
+    rows.append(['portal startup', f"{min(portal):.1f}", f"{statistics.median(portal):.1f}", f"{max(portal):.1f}"])
+
+    print(tabulate(rows, headers=['Phase', 'Min (ms)', 'Median (ms)', 'Max (ms)']))
+    print(f"\npkcs11 loaded: {any(run['pkcs11_loaded'] for run in runs)}, "
+          f"Cryptodome loaded: {any(run['cryptodome_loaded'] for run in runs)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,34 @@
+"""
+Gunicorn configuration for the SillyPostilion web portal.
+
+The application is created once in the master (preload_app) and forked,
+so workers start faster and share its read-only memory copy-on-write.
+post_fork then gives each worker its own log files, connections, HSM
+session and background threads. Preloading is off under --reload, which
+only reloads code in workers that import it themselves, and can be turned
+off with GUNICORN_PRELOAD=0.
+
+Every open dashboard holds one thread for its live update stream, so
+workers are threaded and sized for the number of operators: each worker
+accepts up to STREAM_MAX_SUBSCRIBERS streams (16 by default) and keeps
+its other threads for API requests. The defaults, 4 workers of 32
+threads, serve 64 streams; size WEB_CONCURRENCY for more.
+"""
+
+import os
+import sys
+
+preload_app = os.environ.get('GUNICORN_PRELOAD', '1') != '0' and '--reload' not in sys.argv
+
+worker_class = 'gthread'
+workers = int(os.environ.get('WEB_CONCURRENCY', '4'))
+threads = int(os.environ.get('GUNICORN_THREADS', '32'))
+
+
+def post_fork(server, worker):
+    """Reset per-process state inherited from the preloaded master"""
+    if not preload_app:
+        return
+
+    from app import init_worker
+    init_worker(worker.app.wsgi())
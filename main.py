@@ -4,8 +4,10 @@ import os
 # Add the web-portal directory to Python's module search path
 sys.path.append(os.path.join(os.path.dirname(__file__), 'web-portal'))
 
-# Import the app from the web-portal module
-from app import app
+# Create the app from the web-portal module
+from app import create_app
+
+app = create_app()
 
 # This is used by gunicorn to run the application
 if __name__ == "__main__":
@@ -13,7 +13,8 @@ def main():
     
     # Run the Flask application
     try:
-        from app import app
+        from app import create_app
+        app = create_app()
         app.run(host='0.0.0.0', port=5000, debug=True)
     except Exception as e:
         print(f"Error starting application: {e}")
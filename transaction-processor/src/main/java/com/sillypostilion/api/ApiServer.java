@@ -7,7 +7,15 @@ import com.sun.net.httpserver.HttpServer;
 
 import java.io.IOException;
 import java.io.OutputStream;
+import java.io.UnsupportedEncodingException;
 import java.net.InetSocketAddress;
+import java.net.URLDecoder;
+import java.nio.charset.StandardCharsets;
+import java.security.MessageDigest;
+import java.security.NoSuchAlgorithmException;
+import java.sql.Timestamp;
+import java.time.LocalDateTime;
+import java.time.format.DateTimeParseException;
 import java.util.HashMap;
 import java.util.List;
 import java.util.Map;
@@ -80,12 +88,8 @@ public class ApiServer {
                 JSONObject json = new JSONObject(status);
                 String response = json.toJSONString();
                 
-                // Send response
-                exchange.getResponseHeaders().set("Content-Type", "application/json");
-                exchange.sendResponseHeaders(200, response.getBytes().length);
-                try (OutputStream os = exchange.getResponseBody()) {
-                    os.write(response.getBytes());
-                }
+                // Send response, or 304 if the client already has it
+                sendConditionalResponse(exchange, response);
             } catch (Exception e) {
                 logger.error("Error handling status request", e);
                 String errorResponse = "{\"error\":\"" + e.getMessage() + "\"}";
@@ -126,8 +130,32 @@ public class ApiServer {
                     }
                 }
                 
-                // Get transactions from database
-                List<Map<String, Object>> transactions = dbLogger.getRecentTransactions(limit);
+                // Get transactions from database: everything after the caller's
+                // high-water mark if one is given, otherwise the most recent
+                List<Map<String, Object>> transactions;
+                if (params.containsKey("since")) {
+                    Timestamp since;
+                    try {
+                        // ISO-8601 local date-time; seconds and fractions are optional
+                        since = Timestamp.valueOf(LocalDateTime.parse(
+                                params.get("since").trim().replace(' ', 'T').replace("Z", "")));
+                    } catch (DateTimeParseException | IllegalArgumentException e) {
+                        String errorResponse = "{\"error\":\"Invalid since parameter\"}";
+                        exchange.sendResponseHeaders(400, errorResponse.getBytes().length);
+                        try (OutputStream os = exchange.getResponseBody()) {
+                            os.write(errorResponse.getBytes());
+                        }
+                        return;
+                    }
+                    // ID of the last row seen at the high-water timestamp, if the caller has one
+                    String sinceId = params.get("sinceId");
+                    if (sinceId != null && sinceId.isEmpty()) {
+                        sinceId = null;
+                    }
+                    transactions = dbLogger.getTransactionsSince(since, sinceId, limit);
+                } else {
+                    transactions = dbLogger.getRecentTransactions(limit);
+                }
                 
                 // Convert to JSON
                 JSONArray jsonArray = new JSONArray();
@@ -173,12 +201,8 @@ public class ApiServer {
                 JSONObject json = new JSONObject(countsByHour);
                 String response = json.toJSONString();
                 
-                // Send response
-                exchange.getResponseHeaders().set("Content-Type", "application/json");
-                exchange.sendResponseHeaders(200, response.getBytes().length);
-                try (OutputStream os = exchange.getResponseBody()) {
-                    os.write(response.getBytes());
-                }
+                // Send response, or 304 if the client already has it
+                sendConditionalResponse(exchange, response);
             } catch (Exception e) {
                 logger.error("Error handling stats request", e);
                 String errorResponse = "{\"error\":\"" + e.getMessage() + "\"}";
@@ -190,6 +214,47 @@ public class ApiServer {
         }
     }
 
+    /**
+     * Send a JSON response with an ETag, answering 304 Not Modified when the
+     * client's If-None-Match already matches the current representation
+     */
+    private void sendConditionalResponse(HttpExchange exchange, String response) throws IOException {
+        byte[] body = response.getBytes(StandardCharsets.UTF_8);
+        String etag = "\"" + computeEtag(body) + "\"";
+        exchange.getResponseHeaders().set("ETag", etag);
+        exchange.getResponseHeaders().set("Cache-Control", "no-cache");
+        
+        String ifNoneMatch = exchange.getRequestHeaders().getFirst("If-None-Match");
+        if (etag.equals(ifNoneMatch)) {
+            exchange.sendResponseHeaders(304, -1);
+            exchange.close();
+            return;
+        }
+        
+        exchange.getResponseHeaders().set("Content-Type", "application/json");
+        exchange.sendResponseHeaders(200, body.length);
+        try (OutputStream os = exchange.getResponseBody()) {
+            os.write(body);
+        }
+    }
+
+    /**
+     * Compute a hex SHA-256 digest of a response body for use as an ETag
+     */
+    private String computeEtag(byte[] body) {
+        try {
+            MessageDigest digest = MessageDigest.getInstance("SHA-256");
+            byte[] hash = digest.digest(body);
+            StringBuilder sb = new StringBuilder();
+            for (int i = 0; i < 16; i++) {
+                sb.append(String.format("%02x", hash[i]));
+            }
+            return sb.toString();
+        } catch (NoSuchAlgorithmException e) {
+            return Integer.toHexString(java.util.Arrays.hashCode(body));
+        }
+    }
+
     /**
      * Handle OPTIONS requests for CORS preflight
      */
@@ -209,7 +274,11 @@ public class ApiServer {
             for (String pair : pairs) {
                 String[] keyValue = pair.split("=");
                 if (keyValue.length == 2) {
-                    params.put(keyValue[0], keyValue[1]);
+                    try {
+                        params.put(keyValue[0], URLDecoder.decode(keyValue[1], "UTF-8"));
+                    } catch (UnsupportedEncodingException e) {
+                        params.put(keyValue[0], keyValue[1]);
+                    }
                 }
             }
         }
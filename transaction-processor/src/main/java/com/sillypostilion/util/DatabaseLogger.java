@@ -16,6 +16,7 @@ import java.sql.ResultSet;
 import java.sql.SQLException;
 import java.sql.Statement;
 import java.sql.Timestamp;
+import java.time.format.DateTimeFormatter;
 import java.util.ArrayList;
 import java.util.Date;
 import java.util.HashMap;
@@ -27,6 +28,9 @@ import java.util.Map;
  * Stores transaction details in a database for later retrieval by the web portal
  */
 public class DatabaseLogger {
+    private static final DateTimeFormatter TIMESTAMP_FORMAT =
+            DateTimeFormatter.ofPattern("yyyy-MM-dd'T'HH:mm:ss.SSSSSS");
+
     private String dbUrl;
     private String dbUser;
     private String dbPassword;
@@ -189,9 +193,9 @@ public class DatabaseLogger {
                      ResultSet rs = stmt.executeQuery(sql)) {
                     if (rs.next()) {
                         status.put("status", rs.getString("status"));
-                        status.put("startTime", rs.getTimestamp("start_time"));
+                        status.put("startTime", formatTimestamp(rs.getTimestamp("start_time")));
                         status.put("transactionsProcessed", rs.getLong("transactions_processed"));
-                        status.put("lastUpdated", rs.getTimestamp("last_updated"));
+                        status.put("lastUpdated", formatTimestamp(rs.getTimestamp("last_updated")));
                     }
                 }
             }
@@ -222,21 +226,7 @@ public class DatabaseLogger {
                     
                     try (ResultSet rs = pstmt.executeQuery()) {
                         while (rs.next()) {
-                            Map<String, Object> txn = new HashMap<>();
-                            txn.put("id", rs.getString("id"));
-                            txn.put("mti", rs.getString("mti"));
-                            txn.put("processingCode", rs.getString("processing_code"));
-                            txn.put("amount", rs.getString("amount"));
-                            txn.put("transmissionDateTime", rs.getString("transmission_datetime"));
-                            txn.put("stan", rs.getString("stan"));
-                            txn.put("rrn", rs.getString("rrn"));
-                            txn.put("responseCode", rs.getString("response_code"));
-                            txn.put("terminalId", rs.getString("terminal_id"));
-                            txn.put("merchantId", rs.getString("merchant_id"));
-                            txn.put("direction", rs.getString("direction"));
-                            txn.put("rawMessage", rs.getString("raw_message"));
-                            txn.put("timestamp", rs.getTimestamp("timestamp"));
-                            transactions.add(txn);
+                            transactions.add(mapTransaction(rs));
                         }
                     }
                 }
@@ -249,6 +239,84 @@ public class DatabaseLogger {
         return transactions;
     }
 
+    /**
+     * Get transactions logged after a high-water mark, oldest first.
+     * Used by the web portal to sync incrementally. Rows are ordered by
+     * timestamp and ID; with sinceId they start after the row
+     * (since, sinceId), so a run of rows sharing one timestamp is paged
+     * through. Without it rows at exactly the high-water timestamp are
+     * returned again and de-duplicated by the caller.
+     */
+    public List<Map<String, Object>> getTransactionsSince(Timestamp since, String sinceId, int limit) {
+        List<Map<String, Object>> transactions = new ArrayList<>();
+        try {
+            if (!initialized) {
+                initializeDatabase();
+            }
+            
+            try (Connection conn = getConnection()) {
+                String sql = 
+                    "SELECT * FROM transactions " +
+                    (sinceId != null
+                        ? "WHERE timestamp > ? OR (timestamp = ? AND id > ?) "
+                        : "WHERE timestamp >= ? ") +
+                    "ORDER BY timestamp ASC, id ASC " +
+                    "LIMIT ?";
+                
+                try (PreparedStatement pstmt = conn.prepareStatement(sql)) {
+                    int index = 1;
+                    pstmt.setTimestamp(index++, since);
+                    if (sinceId != null) {
+                        pstmt.setTimestamp(index++, since);
+                        pstmt.setString(index++, sinceId);
+                    }
+                    pstmt.setInt(index, limit);
+                    
+                    try (ResultSet rs = pstmt.executeQuery()) {
+                        while (rs.next()) {
+                            transactions.add(mapTransaction(rs));
+                        }
+                    }
+                }
+            }
+        } catch (SQLException e) {
+            Map<String, Object> error = new HashMap<>();
+            error.put("error", "Database error: " + e.getMessage());
+            transactions.add(error);
+        }
+        return transactions;
+    }
+
+    /**
+     * Map the current result set row to a transaction record
+     */
+    private Map<String, Object> mapTransaction(ResultSet rs) throws SQLException {
+        Map<String, Object> txn = new HashMap<>();
+        txn.put("id", rs.getString("id"));
+        txn.put("mti", rs.getString("mti"));
+        txn.put("processingCode", rs.getString("processing_code"));
+        txn.put("amount", rs.getString("amount"));
+        txn.put("transmissionDateTime", rs.getString("transmission_datetime"));
+        txn.put("stan", rs.getString("stan"));
+        txn.put("rrn", rs.getString("rrn"));
+        txn.put("responseCode", rs.getString("response_code"));
+        txn.put("terminalId", rs.getString("terminal_id"));
+        txn.put("merchantId", rs.getString("merchant_id"));
+        txn.put("direction", rs.getString("direction"));
+        txn.put("rawMessage", rs.getString("raw_message"));
+        txn.put("timestamp", formatTimestamp(rs.getTimestamp("timestamp")));
+        return txn;
+    }
+
+    /**
+     * Format a timestamp as an ISO-8601 local date-time string, the form the
+     * portal parses and echoes back as its high-water mark
+     */
+    private String formatTimestamp(Timestamp timestamp) {
+        // Always with seconds and microseconds; LocalDateTime.toString drops zero fields
+        return timestamp != null ? timestamp.toLocalDateTime().format(TIMESTAMP_FORMAT) : null;
+    }
+
     /**
      * Get the transaction counts for the last 24 hours, grouped by hour
      */
@@ -0,0 +1,222 @@
+"""
+Write-behind access statistics for SillyPostilion.
+
+Serializing a cached record used to bump its last_accessed/access_count
+columns and write an audit line on the spot, turning every read into a
+write. Accesses are now counted in memory and flushed periodically from a
+background thread as one batched UPDATE per model plus a single aggregated
+audit record.
+
+Only rows in the main database are updated. Sealed partitions and the
+archive are read-only history, so accesses to their rows are not kept.
+The buffer holds a bounded number of records; beyond it, the least
+recently added counts are dropped and the loss is logged.
+"""
+
+import atexit
+import logging
+import threading
+import datetime
+from typing import Optional, Dict, Tuple, Any
+
+from sqlalchemy import update, bindparam, func
+
+from audit import get_audit_log
+
+# Configure logger
+logger = logging.getLogger('access_stats')
+
+
+class AccessStatsBuffer:
+    """Buffers record accesses and flushes them to the database in batches"""
+
+    def __init__(self, app=None, flush_interval: int = 30, max_pending: int = 50000):
+        """Initialize the buffer
+
+        Args:
+            app: Flask application to bind to
+            flush_interval: Seconds between flushes
+            max_pending: Records buffered at most, for example while the
+                database is unavailable
+        """
+        self.app = None
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.dropped = 0
+        self._pending: Dict[Tuple[Any, Any], list] = {}
+        self._thread: Optional[threading.Thread] = None
+        self._stop_event = threading.Event()
+        self._lock = threading.Lock()
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Bind the buffer to the Flask app.
+
+        The flush thread is started lazily on the first request, and any
+        remaining counts are flushed when the process exits.
+        """
+        self.app = app
+        self.flush_interval = app.config.get('ACCESS_STATS_FLUSH_SECONDS', self.flush_interval)
+        self.max_pending = app.config.get('ACCESS_STATS_MAX_PENDING', self.max_pending)
+        app.extensions['access_stats'] = self
+
+        app.before_request(self.start)
+        atexit.register(self.stop)
+
+    @property
+    def running(self) -> bool:
+        """Whether the flush thread is alive"""
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self) -> None:
+        """Start the flush thread if it is not already running"""
+        if self.running:
+            return
+
+        with self._lock:
+            if self.running:
+                return
+
+            self._stop_event.clear()
+            self._thread = threading.Thread(target=self._run, name='access-stats', daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout: Optional[float] = 5) -> None:
+        """Stop the flush thread and flush what is left"""
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+        self._flush_in_context()
+
+    def after_fork(self) -> None:
+        """Reset the buffer in a forked worker; the parent flushes the counts it holds"""
+        self._pending = {}
+        self.dropped = 0
+        self._thread = None
+        self._stop_event = threading.Event()
+        self._lock = threading.Lock()
+
+    def _run(self) -> None:
+        """Flush loop"""
+        while not self._stop_event.wait(self.flush_interval):
+            self._flush_in_context()
+
+    def _flush_in_context(self) -> None:
+        """Flush inside an app context, logging rather than raising"""
+        if self.app is None:
+            return
+        try:
+            with self.app.app_context():
+                self.flush()
+        except Exception as e:
+            logger.error(f"Access statistics flush failed: {str(e)}")
+
+    def record(self, model, record_id) -> None:
+        """Count one access to a record
+
+        Args:
+            model: Model class of the record
+            record_id: Primary key of the record
+        """
+        now = datetime.datetime.utcnow()
+        key = (model, record_id)
+        with self._lock:
+            entry = self._pending.get(key)
+            if entry is None:
+                self._pending[key] = [1, now]
+                self._trim()
+            else:
+                entry[0] += 1
+                entry[1] = now
+
+    def _trim(self) -> int:
+        """Drop the least recently added records beyond the cap; the lock must be held
+
+        Returns:
+            Number of records dropped
+        """
+        excess = len(self._pending) - self.max_pending
+        if excess <= 0:
+            return 0
+        for key in list(self._pending)[:excess]:
+            del self._pending[key]
+        self.dropped += excess
+        return excess
+
+    def pending_count(self, model, record_id) -> int:
+        """Accesses to a record not yet written to the database"""
+        with self._lock:
+            entry = self._pending.get((model, record_id))
+            return entry[0] if entry else 0
+
+    def flush(self) -> int:
+        """Write buffered counts to the database
+
+        Must be called inside an application context. Counts are put back
+        into the buffer if the write fails, up to its cap. Records that are
+        not in the main database are not updated.
+
+        Returns:
+            Number of records updated
+        """
+        from models import db
+
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            dropped, self.dropped = self.dropped, 0
+
+        if dropped:
+            logger.warning(f"Dropped access counts for {dropped} records; the buffer was full")
+        if not pending:
+            return 0
+
+        by_model: Dict[Any, list] = {}
+        for (model, record_id), (count, last_accessed) in pending.items():
+            by_model.setdefault(model, []).append({
+                'b_id': record_id,
+                'b_count': count,
+                'b_last_accessed': last_accessed
+            })
+
+        try:
+            for model, rows in by_model.items():
+                statement = update(model.__table__) \
+                    .where(model.__table__.c.id == bindparam('b_id')) \
+                    .values(
+                        access_count=func.coalesce(model.__table__.c.access_count, 0) + bindparam('b_count'),
+                        last_accessed=bindparam('b_last_accessed')
+                    )
+                db.session.execute(statement, rows)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            with self._lock:
+                # The returned counts are older than those recorded since
+                newer, self._pending = self._pending, pending
+                for key, (count, last_accessed) in newer.items():
+                    entry = self._pending.setdefault(key, [0, last_accessed])
+                    entry[0] += count
+                    entry[1] = max(entry[1], last_accessed)
+                dropped = self._trim()
+                self.dropped -= dropped
+            if dropped:
+                logger.warning(f"Dropped access counts for {dropped} records after a failed flush")
+            raise
+
+        get_audit_log().emit('ACCESS:FLUSH', models={
+            model.__name__: {'records': len(rows), 'reads': sum(row['b_count'] for row in rows)}
+            for model, rows in by_model.items()
+        })
+        return len(pending)
+
+
+# Create an instance of the access statistics buffer
+access_stats = AccessStatsBuffer()
+
+
+def get_access_stats() -> AccessStatsBuffer:
+    """Return the access statistics buffer instance"""
+    return access_stats
@@ -12,6 +12,7 @@ import os
 import json
 import logging
 import datetime
+import threading
 from typing import Dict, List, Optional, Any, Union
 from dataclasses import dataclass, asdict, field
 from enum import Enum
@@ -21,7 +22,7 @@ from hsm import HSMKeyType, get_hsm_manager
 
 # Configure logger
 logger = logging.getLogger('admin')
-handler = logging.FileHandler('admin.log')
+handler = logging.FileHandler('admin.log', delay=True)
 handler.setFormatter(logging.Formatter('%(asctime)s [%(levelname)s] %(message)s'))
 logger.addHandler(handler)
 logger.setLevel(logging.INFO)
@@ -32,9 +33,6 @@ ENDPOINTS_FILE = os.path.join(CONFIG_DIR, 'endpoints.json')
 HSM_KEYS_FILE = os.path.join(CONFIG_DIR, 'hsm_keys.json')
 SETTINGS_FILE = os.path.join(CONFIG_DIR, 'settings.json')
 
-# Ensure config directory exists
-os.makedirs(CONFIG_DIR, exist_ok=True)
-
 class EndpointType(str, Enum):
     """Types of connection endpoints"""
     ACQUIRER = "acquirer"        # Connection to an acquirer
@@ -132,15 +130,35 @@ class HSMKeyEntry:
 class Settings:
     """System settings"""
     transaction_processor_url: str = "http://localhost:8000"
+    processor_timeout: int = 5  # seconds
+    processor_pool_size: int = 10
+    circuit_failure_threshold: int = 5
+    circuit_reset_seconds: int = 30
     log_level: str = "INFO"
     session_timeout: int = 30  # minutes
     max_failed_logins: int = 5
     password_expiry_days: int = 90
     audit_retention_days: int = 365
+    audit_rotate_mb: int = 50
+    audit_rotate_hours: int = 24
     enable_pin_verification: bool = True
     enable_mac_verification: bool = True
     offline_mode: bool = False
     maintenance_mode: bool = False
+    sync_interval_seconds: int = 10
+    decrypt_cache_enabled: bool = False
+    decrypt_cache_ttl_seconds: int = 60
+    decrypt_cache_max_mb: int = 16
+    reencryption_rows_per_second: int = 500
+    transaction_retention_days: int = 365
+    archive_after_days: int = 90
+    query_profiler_enabled: bool = False
+    query_repeat_threshold: int = 10
+    slow_query_ms: int = 200
+    sampling_profiler_enabled: bool = False
+    profile_sample_percent: int = 1
+    profile_slow_ms: int = 0
+    profile_max_files: int = 200
     updated_at: str = field(default_factory=lambda: datetime.datetime.now().isoformat())
     
     def to_dict(self) -> Dict[str, Any]:
@@ -161,9 +179,13 @@ class AdminModule:
     
     def __init__(self):
         """Initialize the admin module"""
+        # Ensure config directory exists
+        os.makedirs(CONFIG_DIR, exist_ok=True)
+        
         self.endpoints = self._load_endpoints()
         self.hsm_keys = self._load_hsm_keys()
         self.settings = self._load_settings()
+        self._settings_mtime = self._get_settings_mtime()
     
     def _load_endpoints(self) -> List[Endpoint]:
         """Load endpoints from configuration file"""
@@ -225,6 +247,13 @@ class AdminModule:
             logger.error(f"Error loading settings: {str(e)}")
             return Settings()
     
+    def _get_settings_mtime(self) -> Optional[float]:
+        """Return the modification time of the settings file, if present"""
+        try:
+            return os.path.getmtime(SETTINGS_FILE)
+        except OSError:
+            return None
+    
     def _save_settings(self) -> bool:
         """Save settings to configuration file"""
         try:
@@ -232,6 +261,7 @@ class AdminModule:
             os.makedirs(os.path.dirname(SETTINGS_FILE), exist_ok=True)
             with open(SETTINGS_FILE, 'w') as f:
                 json.dump(data, f, indent=2)
+            self._settings_mtime = self._get_settings_mtime()
             return True
         except Exception as e:
             logger.error(f"Error saving settings: {str(e)}")
@@ -509,10 +539,31 @@ class AdminModule:
     def get_settings(self) -> Settings:
         """Get current system settings"""
         return self.settings
+    
+    def refresh_settings(self) -> bool:
+        """Reload settings if the file was changed by another process
+        
+        Returns:
+            True if the settings were reloaded
+        """
+        mtime = self._get_settings_mtime()
+        if mtime is None or mtime == self._settings_mtime:
+            return False
+        
+        self.settings = self._load_settings()
+        self._settings_mtime = mtime
+        logger.info("Reloaded settings from disk")
+        return True
 
-# Create an instance of the admin module
-admin_module = AdminModule()
+# The admin module instance, loaded from disk on first use
+admin_module: Optional[AdminModule] = None
+_admin_module_lock = threading.Lock()
 
 def get_admin_module() -> AdminModule:
-    """Return the admin module instance"""
+    """Return the admin module instance, creating it on first use"""
+    global admin_module
+    if admin_module is None:
+        with _admin_module_lock:
+            if admin_module is None:
+                admin_module = AdminModule()
     return admin_module
@@ -1,136 +1,215 @@
 import os
 import logging
-from flask import Flask, render_template, jsonify, request, redirect, url_for, g
-from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy.orm import DeclarativeBase
-from flask_wtf.csrf import CSRFProtect
-from flask_login import LoginManager
 import datetime
+from typing import Any, Dict, Optional
+
+from flask import Flask
+
+from extensions import db, csrf, login_manager
+from json_provider import FastJSONProvider
+
+
+def configure_logging():
+    """Configure root logging once, unless the host (e.g. gunicorn) already did"""
+    if not logging.getLogger().handlers:
+        logging.basicConfig(level=os.environ.get('LOG_LEVEL', 'DEBUG').upper())
+
+    # Set up loggers for various modules
+    logging.getLogger('hsm').setLevel(logging.INFO)
+    logging.getLogger('admin').setLevel(logging.INFO)
+    logging.getLogger('audit').setLevel(logging.INFO)
 
-# Configure logging
-logging.basicConfig(level=logging.DEBUG)
-
-# Set up loggers for various modules
-logging.getLogger('hsm').setLevel(logging.INFO)
-logging.getLogger('admin').setLevel(logging.INFO)
-logging.getLogger('audit').setLevel(logging.INFO)
-
-# Create a Base class for SQLAlchemy models
-class Base(DeclarativeBase):
-    pass
-
-# Initialize SQLAlchemy
-db = SQLAlchemy(model_class=Base)
-
-# Initialize CSRF protection
-csrf = CSRFProtect()
-
-# Create the Flask application
-app = Flask(__name__)
-
-# Configure the application
-app.secret_key = os.environ.get("SESSION_SECRET", "dev_secret_key_change_in_production")
-
-# Security configuration
-app.config["SESSION_COOKIE_SECURE"] = False  # Set to True in HTTPS environment
-app.config["SESSION_COOKIE_HTTPONLY"] = True
-app.config["SESSION_COOKIE_SAMESITE"] = "Lax"
-app.config["PERMANENT_SESSION_LIFETIME"] = datetime.timedelta(hours=24)
-
-# Database configuration
-app.config["SQLALCHEMY_DATABASE_URI"] = os.environ.get("DATABASE_URL", "sqlite:///sillypostilion.db")
-app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
-    "pool_recycle": 300,
-    "pool_pre_ping": True,
-}
-app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
-
-# Initialize login manager
-login_manager = LoginManager()
-login_manager.login_view = 'auth.login'
-login_manager.login_message = 'Please log in to access this page.'
-login_manager.login_message_category = 'warning'
-
-# Initialize the app with extensions
-db.init_app(app)
-csrf.init_app(app)
-login_manager.init_app(app)
-
-# Import routes
-from routes import register_routes
-
-# Import security manager
-from security import security_manager
-
-# Import HSM manager for initialization
-from hsm import get_hsm_manager
-
-# Import admin module for initialization
-from admin import get_admin_module
-
-# Import admin routes
-from routes_admin import admin_bp
-
-# Import auth routes
-from routes_auth import auth_bp
-
-# Register regular routes with the app
-register_routes(app)
-
-# Register admin blueprint
-app.register_blueprint(admin_bp)
-
-# Register auth blueprint
-app.register_blueprint(auth_bp)
-
-# Initialize security manager with app
-security_manager.init_app(app)
-
-# Add security headers to all responses
-@app.after_request
-def add_security_headers(response):
-    """Add security headers to all responses."""
-    headers = security_manager.secure_headers()
-    for header, value in headers.items():
-        response.headers[header] = value
-    return response
-
-# Configure user loader for Flask-Login
-@login_manager.user_loader
-def load_user(user_id):
-    """Load user by ID for Flask-Login"""
-    from models import User
-    return User.query.get(user_id)
-
-# Create database tables
-with app.app_context():
-    # First check if we need to recreate tables
-    try:
-        # Import models
-        import models
-        
-        # Try a simple query to see if our schema is up to date
-        from models import Transaction, SystemStatus, User
-        try:
-            Transaction.query.first()
-            SystemStatus.query.first()
-            User.query.first()
-            app.logger.info("Database schema appears to be up to date")
-        except Exception as e:
-            app.logger.warning(f"Database schema needs to be updated: {str(e)}")
-            # Drop all tables
-            app.logger.info("Dropping all tables to recreate schema")
-            db.drop_all()
-            
-            # Create all tables with new schema
-            app.logger.info("Creating tables with updated schema")
-            db.create_all()
-    except Exception as e:
-        app.logger.error(f"Error initializing database: {str(e)}")
-        # Create all tables if they don't exist
-        db.create_all()
-    
-    app.logger.info("Database initialization complete")
-
-if __name__ == "__main__":
-    app.run(host="0.0.0.0", port=5000, debug=True)
+
+def reopen_log_handlers():
+    """Close every file handler so the next record reopens its file in this process"""
+    loggers = [logging.getLogger()] + [logger for logger in logging.root.manager.loggerDict.values()
+                                       if isinstance(logger, logging.Logger)]
+    for logger in loggers:
+        for handler in logger.handlers:
+            if isinstance(handler, logging.FileHandler):
+                handler.close()
+
+
+def create_app(config: Optional[Dict[str, Any]] = None) -> Flask:
+    """Create and configure the portal application
+
+    Importing this module has no side effects; the application, its
+    background workers and the schema migrations are set up here.
+
+    Args:
+        config: Configuration values overriding the defaults
+
+    Returns:
+        The Flask application
+    """
+    configure_logging()
+
+    # Create the Flask application
+    app = Flask(__name__)
+    app.json = FastJSONProvider(app)
+
+    # Configure the application
+    app.secret_key = os.environ.get("SESSION_SECRET", "dev_secret_key_change_in_production")
+
+    # Security configuration
+    app.config["SESSION_COOKIE_SECURE"] = False  # Set to True in HTTPS environment
+    app.config["SESSION_COOKIE_HTTPONLY"] = True
+    app.config["SESSION_COOKIE_SAMESITE"] = "Lax"
+    app.config["PERMANENT_SESSION_LIFETIME"] = datetime.timedelta(hours=24)
+
+    # Database configuration
+    app.config["SQLALCHEMY_DATABASE_URI"] = os.environ.get("DATABASE_URL", "sqlite:///sillypostilion.db")
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
+        "pool_recycle": 300,
+        "pool_pre_ping": True,
+    }
+    app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+
+    # Apply pending schema migrations on startup; turn off to run them
+    # explicitly with `flask --app main upgrade-db`
+    app.config["AUTO_MIGRATE"] = os.environ.get("AUTO_MIGRATE", "1") != "0"
+
+    if config:
+        app.config.update(config)
+
+    # Initialize the app with extensions
+    db.init_app(app)
+    csrf.init_app(app)
+    login_manager.init_app(app)
+
+    # Import models so their tables are registered
+    import models  # noqa: F401
+
+    from metrics import request_metrics
+    from routes import register_routes
+    from routes_admin import admin_bp
+    from routes_auth import auth_bp
+    from security import security_manager
+    from sync import processor_sync
+    from access_stats import access_stats
+    from field_migration import field_migrator
+    from integrity import integrity_tree
+    from partitions import transaction_partitions
+    from archive import transaction_archive
+    from compression import response_compressor
+    from query_profiler import query_profiler
+    from sampling_profiler import sampling_profiler
+    from stream import update_broadcaster
+    from migrations import upgrade, upgrade_command
+
+    # Time requests first, so the timer covers the other extensions' handlers
+    request_metrics.init_app(app)
+
+    # Compress API responses after every other handler has run
+    response_compressor.init_app(app)
+
+    # Opt-in SQL profiling, grouped per request
+    query_profiler.init_app(app)
+
+    # Opt-in stack sampling of selected requests
+    sampling_profiler.init_app(app)
+
+    # Limit live update streams per process
+    update_broadcaster.init_app(app)
+
+    # Register regular routes with the app
+    register_routes(app)
+
+    # Register admin blueprint
+    app.register_blueprint(admin_bp)
+
+    # Register auth blueprint
+    app.register_blueprint(auth_bp)
+
+    # Initialize security manager with app
+    security_manager.init_app(app)
+
+    # Initialize the background processor sync worker
+    processor_sync.init_app(app)
+
+    # Initialize batched access statistics
+    access_stats.init_app(app)
+
+    # Re-encrypt fields not sealed with the primary key in the background
+    field_migrator.init_app(app)
+
+    # Maintain per-day Merkle trees over the transaction cache
+    integrity_tree.init_app(app)
+
+    # Seal closed months into partition files and apply retention
+    transaction_partitions.init_app(app)
+
+    # Archive aged partitions into compressed segments (after partitions, which enable it)
+    transaction_archive.init_app(app)
+
+    # Add security headers to all responses
+    @app.after_request
+    def add_security_headers(response):
+        """Add security headers to all responses."""
+        headers = security_manager.secure_headers()
+        for header, value in headers.items():
+            response.headers[header] = value
+        return response
+
+    # Schema migrations
+    app.cli.add_command(upgrade_command)
+    if app.config["AUTO_MIGRATE"]:
+        with app.app_context():
+            try:
+                applied = upgrade()
+                if applied:
+                    app.logger.info(f"Applied schema migrations {applied}")
+            except Exception as e:
+                app.logger.error(f"Error migrating database schema: {str(e)}")
+
+    return app
+
+
+def init_worker(app: Flask) -> None:
+    """Per-process setup of a worker forked from a master that ran create_app
+
+    create_app is safe to run once before forking (gunicorn --preload), so
+    workers share the imported code and read-only state copy-on-write. What
+    cannot be shared is replaced here: log files, pooled database and HTTP
+    connections, the HSM session, and background threads and their locks,
+    which are started again lazily on the worker's first request.
+
+    Args:
+        app: Application created in the master
+    """
+    from hsm import get_hsm_manager
+    from security import security_manager
+    from audit import get_audit_log
+    from sync import processor_sync
+    from access_stats import access_stats
+    from field_migration import field_migrator
+    from partitions import transaction_partitions
+    from archive import transaction_archive
+    from stream import get_update_broadcaster
+    from processor_client import get_processor_client
+    from metrics import get_request_metrics
+    from query_profiler import get_query_profiler
+    from sampling_profiler import get_sampling_profiler
+    from compression import get_response_compressor
+
+    reopen_log_handlers()
+
+    # Connections inherited from the master stay open for it
+    with app.app_context():
+        for engine in db.engines.values():
+            engine.dispose(close=False)
+
+    get_hsm_manager().after_fork()
+    security_manager.after_fork()
+    get_audit_log().after_fork()
+    processor_sync.after_fork()
+    access_stats.after_fork()
+    field_migrator.after_fork()
+    transaction_partitions.after_fork()
+    transaction_archive.after_fork()
+    get_update_broadcaster().after_fork()
+    get_processor_client().after_fork()
+    get_request_metrics().after_fork()
+    get_query_profiler().after_fork()
+    get_sampling_profiler().after_fork()
+    get_response_compressor().after_fork()
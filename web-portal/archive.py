@@ -0,0 +1,644 @@
+"""
+Compressed columnar archive of old SillyPostilion transactions.
+
+Monthly partitions older than the archive age are rewritten into segment
+files and removed. A segment holds up to SEGMENT_ROWS transactions stored
+column by column, each column a zlib-compressed JSON array; encrypted
+columns are stored as their ciphertexts. The segment header carries the
+row count, per-day counts, min/max values of the plaintext columns and
+Bloom filters over the lookup keys (ID, STAN, RRN and the blind indexes),
+so a lookup reads only the headers of segments that cannot contain its
+key and skips them.
+
+Each archived month is described by a manifest naming its segments. A
+month is rewritten as a new generation of segments and the manifest is
+replaced last, so an interrupted archive run leaves the previous state
+readable and is simply repeated. Rewrites and purges hold a lock file, as
+the archiver and the re-encryption job may run in different gunicorn
+workers.
+"""
+
+import os
+import re
+import json
+import fcntl
+import math
+import zlib
+import struct
+import hashlib
+import logging
+import datetime
+import threading
+from base64 import b64encode, b64decode
+from contextlib import contextmanager
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from sqlalchemy import select
+
+from admin import CONFIG_DIR
+from audit import get_audit_log
+from partitions import get_transaction_partitions, month_range
+
+# Configure logger
+logger = logging.getLogger('archive')
+
+SEGMENT_MAGIC = b'SPSEG1'
+SEGMENT_ROWS = 50000
+
+# Columns with a Bloom filter in every segment header
+BLOOM_COLUMNS = ('id', 'stan', 'rrn', 'terminal_id_bidx', 'merchant_id_bidx')
+
+# Target false positive rate of the Bloom filters
+BLOOM_FALSE_POSITIVE_RATE = 0.01
+
+MANIFEST_PATTERN = re.compile(r'^manifest-(\d{4}-\d{2})\.json$')
+
+# Held while a month is rewritten or purged
+LOCK_FILE = os.path.join(CONFIG_DIR, 'archive.lock')
+
+
+class BloomFilter:
+    """Fixed-size Bloom filter using double hashing over SHA-256"""
+
+    def __init__(self, size: int, hashes: int, bits: Optional[bytearray] = None):
+        self.size = size
+        self.hashes = hashes
+        self.bits = bits if bits is not None else bytearray((size + 7) // 8)
+
+    @classmethod
+    def for_capacity(cls, count: int, rate: float = BLOOM_FALSE_POSITIVE_RATE) -> 'BloomFilter':
+        """Create a filter sized for count values at the given false positive rate"""
+        count = max(count, 1)
+        size = max(64, int(math.ceil(-count * math.log(rate) / math.log(2) ** 2)))
+        hashes = max(1, int(round(size / count * math.log(2))))
+        return cls(size, hashes)
+
+    def _positions(self, value: str):
+        digest = hashlib.sha256(value.encode('utf-8')).digest()
+        first, second = struct.unpack('>QQ', digest[:16])
+        return ((first + i * second) % self.size for i in range(self.hashes))
+
+    def add(self, value: str) -> None:
+        for position in self._positions(value):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def might_contain(self, value: str) -> bool:
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(value))
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {'size': self.size, 'hashes': self.hashes, 'bits': b64encode(bytes(self.bits)).decode('ascii')}
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> 'BloomFilter':
+        return cls(data['size'], data['hashes'], bytearray(b64decode(data['bits'])))
+
+
+def _table():
+    from models import Transaction
+    return Transaction.__table__
+
+
+def _datetime_columns() -> set:
+    from sqlalchemy import DateTime
+    return {column.name for column in _table().columns if isinstance(column.type, DateTime)}
+
+
+def _plaintext_columns() -> List[str]:
+    """Columns whose min/max go into the segment header"""
+    from models import Transaction
+    return [column.name for column in _table().columns if column.name not in Transaction.ENCRYPTED_FIELDS]
+
+
+class Segment:
+    """One immutable archive segment file"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._header: Optional[Dict[str, Any]] = None
+        self._blooms: Dict[str, BloomFilter] = {}
+
+    @classmethod
+    def write(cls, path: str, rows: List[Dict[str, Any]], month: str) -> 'Segment':
+        """Write rows, already sorted by (timestamp, id), into a new segment file"""
+        datetime_columns = _datetime_columns()
+        columns = [column.name for column in _table().columns]
+
+        blobs = []
+        offsets = {}
+        offset = 0
+        for name in columns:
+            values = [row.get(name) for row in rows]
+            if name in datetime_columns:
+                values = [value.isoformat() if value else None for value in values]
+            blob = zlib.compress(json.dumps(values, separators=(',', ':')).encode('utf-8'), 6)
+            offsets[name] = {'offset': offset, 'length': len(blob)}
+            blobs.append(blob)
+            offset += len(blob)
+
+        stats = {}
+        for name in _plaintext_columns():
+            values = [row.get(name) for row in rows if row.get(name) is not None]
+            if values:
+                low, high = min(values), max(values)
+                if name in datetime_columns:
+                    low, high = low.isoformat(), high.isoformat()
+                stats[name] = {'min': low, 'max': high}
+
+        blooms = {}
+        for name in BLOOM_COLUMNS:
+            bloom = BloomFilter.for_capacity(len(rows))
+            for row in rows:
+                if row.get(name):
+                    bloom.add(str(row[name]))
+            blooms[name] = bloom.to_dict()
+
+        days: Dict[str, int] = {}
+        for row in rows:
+            if row.get('timestamp'):
+                day = row['timestamp'].strftime('%Y-%m-%d')
+                days[day] = days.get(day, 0) + 1
+
+        header = json.dumps({
+            'month': month,
+            'rows': len(rows),
+            'columns': offsets,
+            'stats': stats,
+            'blooms': blooms,
+            'days': days
+        }, separators=(',', ':')).encode('utf-8')
+
+        temp_path = f"{path}.tmp"
+        with open(temp_path, 'wb') as f:
+            f.write(SEGMENT_MAGIC + struct.pack('>I', len(header)) + header)
+            for blob in blobs:
+                f.write(blob)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, path)
+        return cls(path)
+
+    @property
+    def header(self) -> Dict[str, Any]:
+        """Segment metadata, read once"""
+        if self._header is None:
+            with open(self.path, 'rb') as f:
+                if f.read(len(SEGMENT_MAGIC)) != SEGMENT_MAGIC:
+                    raise ValueError(f"Not an archive segment: {self.path}")
+                length, = struct.unpack('>I', f.read(4))
+                self._header = json.loads(f.read(length))
+                self._header['dataOffset'] = len(SEGMENT_MAGIC) + 4 + length
+        return self._header
+
+    @property
+    def rows(self) -> int:
+        return self.header['rows']
+
+    def bounds(self, column: str) -> Tuple[Any, Any]:
+        """Min and max of a plaintext column, or (None, None) if all null"""
+        stats = self.header['stats'].get(column)
+        return (stats['min'], stats['max']) if stats else (None, None)
+
+    @property
+    def max_timestamp(self) -> Optional[datetime.datetime]:
+        _, high = self.bounds('timestamp')
+        return datetime.datetime.fromisoformat(high) if high else None
+
+    @property
+    def min_timestamp(self) -> Optional[datetime.datetime]:
+        low, _ = self.bounds('timestamp')
+        return datetime.datetime.fromisoformat(low) if low else None
+
+    def might_contain(self, column: str, values: Iterable[str]) -> bool:
+        """Whether the Bloom filter of a column admits any of the values"""
+        bloom = self._blooms.get(column)
+        if bloom is None:
+            bloom = self._blooms[column] = BloomFilter.from_dict(self.header['blooms'][column])
+        return any(bloom.might_contain(str(value)) for value in values if value)
+
+    def column(self, name: str) -> List[Any]:
+        """Decompress one column"""
+        location = self.header['columns'][name]
+        with open(self.path, 'rb') as f:
+            f.seek(self.header['dataOffset'] + location['offset'])
+            values = json.loads(zlib.decompress(f.read(location['length'])))
+        if name in _datetime_columns():
+            values = [datetime.datetime.fromisoformat(value) if value else None for value in values]
+        return values
+
+    def read_rows(self, indexes: Optional[List[int]] = None) -> List[Dict[str, Any]]:
+        """Reassemble rows, all of them or only those at the given indexes"""
+        columns = {name: self.column(name) for name in self.header['columns']}
+        indexes = range(self.rows) if indexes is None else indexes
+        return [{name: values[index] for name, values in columns.items()} for index in indexes]
+
+
+def to_transaction(row: Dict[str, Any]):
+    """Build a detached Transaction from an archived row without re-encrypting it"""
+    from models import Transaction
+
+    mapper = Transaction.__mapper__
+    txn = mapper.class_manager.new_instance()
+    for column in _table().columns:
+        setattr(txn, mapper.get_property_by_column(column).key, row.get(column.name))
+    return txn
+
+
+def from_transaction(txn) -> Dict[str, Any]:
+    """Inverse of to_transaction"""
+    from models import Transaction
+
+    mapper = Transaction.__mapper__
+    return {column.name: getattr(txn, mapper.get_property_by_column(column).key) for column in _table().columns}
+
+
+class TransactionArchive:
+    """Moves aged partitions into columnar segments and answers lookups over them"""
+
+    def __init__(self, app=None):
+        """Initialize the archive
+
+        Args:
+            app: Flask application to bind to
+        """
+        self.app = None
+        self.directory: Optional[str] = None
+        self.enabled = False
+        self._segments: Dict[str, Segment] = {}
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Bind the archive to the Flask app.
+
+        Archiving runs from the partition maintenance worker.
+        """
+        self.app = app
+        self.directory = app.config.get('ARCHIVE_DIR', os.path.join(app.instance_path, 'archive'))
+        self.enabled = get_transaction_partitions().enabled and app.config.get('ARCHIVE_ENABLED', True)
+        app.extensions['archive'] = self
+
+        if self.enabled:
+            os.makedirs(self.directory, exist_ok=True)
+
+    def after_fork(self) -> None:
+        """Replace locks that a forked worker may have inherited in a held state"""
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+
+    @contextmanager
+    def writing(self) -> Iterator[None]:
+        """Hold the archive write lock for the block
+
+        Serializes rewrites and purges of months by the archiver and the
+        re-encryption job, which may run in different processes. Blocks
+        until no other thread or process is writing.
+        """
+        os.makedirs(CONFIG_DIR, exist_ok=True)
+        with self._write_lock, open(LOCK_FILE, 'w') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _manifest_path(self, month: str) -> str:
+        return os.path.join(self.directory, f"manifest-{month}.json")
+
+    def _load_manifest(self, month: str) -> Optional[Dict[str, Any]]:
+        try:
+            with open(self._manifest_path(month), 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def months(self) -> List[str]:
+        """Archived months, newest first"""
+        if not self.enabled or not os.path.isdir(self.directory):
+            return []
+        months = [match.group(1) for match in map(MANIFEST_PATTERN.match, os.listdir(self.directory)) if match]
+        return sorted(months, reverse=True)
+
+    def segments(self, months: Optional[Iterable[str]] = None) -> List[Segment]:
+        """Segments of the given months, or of all months, newest first"""
+        segments = []
+        for month in (self.months() if months is None else months):
+            manifest = self._load_manifest(month)
+            if manifest is None:
+                continue
+            for name in reversed(manifest['segments']):
+                path = os.path.join(self.directory, name)
+                with self._lock:
+                    segment = self._segments.get(path)
+                    if segment is None:
+                        segment = self._segments[path] = Segment(path)
+                segments.append(segment)
+        return segments
+
+    def archive_aged(self, archive_after_days: int) -> List[str]:
+        """Archive every partition whose whole month is older than archive_after_days
+
+        Returns:
+            Months archived
+        """
+        if not self.enabled:
+            return []
+
+        partitions = get_transaction_partitions()
+        cutoff = datetime.datetime.utcnow() - datetime.timedelta(days=max(archive_after_days, partitions.hot_days))
+        archived = []
+        for month in sorted(partitions.months()):
+            if month_range(month)[1] > cutoff:
+                continue
+            self.archive_month(month)
+            archived.append(month)
+        return archived
+
+    def archive_month(self, month: str) -> int:
+        """Rewrite one month, its partition and any earlier segments, as a new segment generation
+
+        The partition file is removed only after the new manifest is in
+        place.
+
+        Returns:
+            Number of rows in the month's archive
+        """
+        partitions = get_transaction_partitions()
+        table = _table()
+
+        with self.writing():
+            rows: Dict[str, Dict[str, Any]] = {}
+            for segment in reversed(self.segments([month])):
+                for row in segment.read_rows():
+                    rows[row['id']] = row
+            if month in partitions.months():
+                with partitions.sessions([month]) as sessions:
+                    for _, session in sessions:
+                        for row in session.execute(select(table)).mappings():
+                            rows[row['id']] = dict(row)
+
+            self._write_generation(month, list(rows.values()))
+
+            if month in partitions.months():
+                partitions.remove(month)
+
+        logger.info(f"Archived {len(rows)} transactions for {month}")
+        get_audit_log().emit('ARCHIVE:MONTH', month=month, transactions=len(rows))
+        return len(rows)
+
+    def _write_generation(self, month: str, rows: List[Dict[str, Any]]) -> None:
+        """Write rows as the next segment generation of a month and switch the manifest to it"""
+        previous = self._load_manifest(month)
+        generation = previous['generation'] + 1 if previous else 1
+        rows.sort(key=lambda row: (row['timestamp'] or datetime.datetime.min, row['id']))
+
+        names = []
+        for index, first in enumerate(range(0, len(rows), SEGMENT_ROWS)):
+            name = f"segment-{month}-g{generation}-{index:03d}.seg"
+            Segment.write(os.path.join(self.directory, name), rows[first:first + SEGMENT_ROWS], month)
+            names.append(name)
+
+        manifest = {
+            'month': month,
+            'generation': generation,
+            'segments': names,
+            'rows': len(rows),
+            'updatedAt': datetime.datetime.utcnow().isoformat() + 'Z'
+        }
+        temp_path = f"{self._manifest_path(month)}.tmp"
+        with open(temp_path, 'w') as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(temp_path, self._manifest_path(month))
+
+        if previous:
+            self._remove_segments(previous['segments'])
+
+    def _remove_segments(self, names: Iterable[str]) -> None:
+        for name in names:
+            path = os.path.join(self.directory, name)
+            with self._lock:
+                self._segments.pop(path, None)
+            try:
+                os.remove(path)
+            except OSError as e:
+                logger.warning(f"Could not remove archive segment {name}: {str(e)}")
+
+    def purge_expired(self, retention_days: int) -> List[str]:
+        """Delete archived months whose whole month is older than the retention period
+
+        Must be called inside an application context.
+
+        Returns:
+            Months purged
+        """
+        from integrity import get_integrity_tree
+
+        cutoff = datetime.datetime.utcnow() - datetime.timedelta(days=retention_days)
+        purged = []
+        for month in self.months():
+            start, end = month_range(month)
+            if end > cutoff:
+                continue
+
+            with self.writing():
+                manifest = self._load_manifest(month)
+                try:
+                    os.remove(self._manifest_path(month))
+                except FileNotFoundError:
+                    # Purged by another process since the months were listed
+                    continue
+                if manifest:
+                    self._remove_segments(manifest['segments'])
+            get_integrity_tree().drop_buckets(start, end)
+
+            purged.append(month)
+            logger.info(f"Purged archived transactions for {month}")
+            get_audit_log().emit('ARCHIVE:PURGE', month=month, retention_days=retention_days)
+        return purged
+
+    def find(self, segment: Segment, criteria: Dict[str, Any], limit: int,
+             position: Optional[Tuple[datetime.datetime, str]] = None) -> list:
+        """Find matching transactions in one segment, newest first
+
+        Returns:
+            Detached Transaction instances, see find_rows
+        """
+        return [to_transaction(row) for row in self.find_rows(segment, criteria, limit, position)]
+
+    def find_rows(self, segment: Segment, criteria: Dict[str, Any], limit: int,
+                  position: Optional[Tuple[datetime.datetime, str]] = None) -> List[Dict[str, Any]]:
+        """Find matching rows in one segment, newest first
+
+        Args:
+            segment: Segment to search
+            criteria: Lookup criteria, see matches_segment
+            limit: Maximum number of rows returned
+            position: Keyset cursor; only rows before it are returned
+
+        Returns:
+            Rows as column name to stored value dicts
+        """
+        timestamps = segment.column('timestamp')
+        ids = segment.column('id')
+        candidates = range(segment.rows)
+
+        start, end = criteria.get('start'), criteria.get('end')
+        if start is not None or end is not None or position is not None:
+            candidates = [
+                index for index in candidates
+                if timestamps[index] is not None
+                and (start is None or timestamps[index] >= start)
+                and (end is None or timestamps[index] < end)
+                and (position is None or (timestamps[index], ids[index]) < position)
+            ]
+
+        mti = criteria.get('mti')
+        if mti:
+            values = segment.column('mti')
+            if len(mti) == 2 and mti.isdigit():
+                candidates = [index for index in candidates if (values[index] or '').startswith(mti)]
+            else:
+                candidates = [index for index in candidates if values[index] == mti]
+
+        response = criteria.get('response')
+        if response:
+            values = segment.column('response_code')
+            if response == 'declined':
+                candidates = [index for index in candidates if values[index] != '00']
+            else:
+                candidates = [index for index in candidates if values[index] == response]
+
+        search = criteria.get('search')
+        if search:
+            columns = {name: segment.column(name) for name in search}
+            candidates = [
+                index for index in candidates
+                if any(columns[name][index] in values for name, values in search.items())
+            ]
+
+        candidates = sorted(candidates, key=lambda index: (timestamps[index], ids[index]), reverse=True)[:limit]
+        return segment.read_rows(candidates) if candidates else []
+
+    @staticmethod
+    def matches_segment(segment: Segment, criteria: Dict[str, Any],
+                        position: Optional[Tuple[datetime.datetime, str]] = None) -> bool:
+        """Whether a segment's metadata admits the criteria
+
+        Criteria keys:
+        - start, end: timestamp range
+        - mti: two-digit message class or full MTI
+        - response: response code, or "declined"
+        - search: column name mapped to the set of values any of which matches
+        """
+        low, high = segment.min_timestamp, segment.max_timestamp
+        if low is None:
+            return False
+        if criteria.get('start') is not None and high < criteria['start']:
+            return False
+        if criteria.get('end') is not None and low >= criteria['end']:
+            return False
+        if position is not None and low > position[0]:
+            return False
+
+        mti = criteria.get('mti')
+        if mti:
+            low, high = segment.bounds('mti')
+            if low is None or high[:len(mti)] < mti or low[:len(mti)] > mti:
+                return False
+
+        response = criteria.get('response')
+        if response and response != 'declined':
+            low, high = segment.bounds('response_code')
+            if low is None or not low <= response <= high:
+                return False
+
+        search = criteria.get('search')
+        if search and not any(segment.might_contain(name, values) for name, values in search.items()):
+            return False
+        return True
+
+    def get(self, transaction_id: str):
+        """Look up one archived transaction by ID
+
+        Returns:
+            Detached Transaction instance, or None
+        """
+        criteria = {'search': {'id': {transaction_id}}}
+        for segment in self.segments():
+            if self.matches_segment(segment, criteria):
+                found = self.find(segment, criteria, 1)
+                if found:
+                    return found[0]
+        return None
+
+    def rows_between(self, start: datetime.datetime, end: datetime.datetime) -> list:
+        """Archived transactions with a timestamp in [start, end)"""
+        criteria = {'start': start, 'end': end}
+        transactions = []
+        for segment in self.segments():
+            if self.matches_segment(segment, criteria):
+                transactions.extend(self.find(segment, criteria, segment.rows))
+        return transactions
+
+    def day_counts(self) -> Dict[str, int]:
+        """Archived transactions per day, from the segment headers"""
+        counts: Dict[str, int] = {}
+        for segment in self.segments():
+            for day, rows in segment.header['days'].items():
+                counts[day] = counts.get(day, 0) + rows
+        return counts
+
+    def existing_ids(self, ids: Iterable[str]) -> set:
+        """IDs among the given ones that are already archived"""
+        ids = set(ids)
+        found = set()
+        for segment in self.segments():
+            if ids and segment.might_contain('id', ids):
+                found.update(ids.intersection(segment.column('id')))
+        return found
+
+    def newest_timestamp(self) -> Optional[datetime.datetime]:
+        """Timestamp of the newest archived transaction"""
+        segments = self.segments(self.months()[:1])
+        return max((segment.max_timestamp for segment in segments if segment.max_timestamp), default=None)
+
+    def reencrypt_month(self, month: str) -> Tuple[int, int]:
+        """Rewrite a month whose segments hold fields not sealed with the primary key
+
+        Must be called inside an application context.
+
+        Returns:
+            Tuple of (rows re-encrypted, rows in the month); nothing is
+            written when no row needed it
+        """
+        from models import Transaction
+
+        with self.writing():
+            transactions = [to_transaction(row) for segment in reversed(self.segments([month]))
+                            for row in segment.read_rows()]
+            Transaction.decrypt_many(transactions)
+            changed = sum(1 for txn in transactions if txn.reencrypt_fields())
+            if changed:
+                self._write_generation(month, [from_transaction(txn) for txn in transactions])
+            return changed, len(transactions)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Return the size of the archive"""
+        segments = self.segments()
+        return {
+            'months': len(self.months()),
+            'segments': len(segments),
+            'rows': sum(segment.rows for segment in segments),
+            'bytes': sum(os.path.getsize(segment.path) for segment in segments)
+        }
+
+
+# Create an instance of the transaction archive
+transaction_archive = TransactionArchive()
+
+
+def get_transaction_archive() -> TransactionArchive:
+    """Return the transaction archive instance"""
+    return transaction_archive
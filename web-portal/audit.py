@@ -0,0 +1,309 @@
+"""
+Audit log pipeline for SillyPostilion.
+
+Audit events are queued as structured records and written by a single
+background thread as newline-delimited JSON. The writer batches records,
+fsyncs on a size or time boundary, and rotates the file by size and age,
+so request threads normally never touch the disk. Every gunicorn worker
+appends to the same file: writes hold a shared lock on a lock file and
+rotation an exclusive one, and a writer reopens the file once another
+process has rotated it. When the queue is full
+the caller waits briefly for room and then writes its record itself, so
+records are only lost if the file cannot be written at all.
+"""
+
+import os
+import json
+import glob
+import time
+import fcntl
+import queue
+import atexit
+import logging
+import datetime
+import threading
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional
+
+from admin import CONFIG_DIR
+
+# Configure logger
+logger = logging.getLogger('audit_pipeline')
+
+# Held shared by writers and exclusively while the file is rotated
+LOCK_FILE = os.path.join(CONFIG_DIR, 'audit.lock')
+
+
+class AuditLog:
+    """Queued, batched NDJSON audit log writer"""
+
+    def __init__(self, path: str = 'audit.log', max_queue: int = 10000,
+                 batch_size: int = 200, flush_interval: float = 1.0, put_timeout: float = 0.25):
+        """Initialize the audit log
+
+        Args:
+            path: Active audit log file; rotated files get a timestamp suffix
+            max_queue: Records buffered before callers write synchronously
+            batch_size: Records written and fsynced together
+            flush_interval: Longest time in seconds a record waits in a batch
+            put_timeout: Seconds a caller waits for room in a full queue
+        """
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.put_timeout = put_timeout
+        self.dropped = 0
+        self.written_directly = 0
+        self._queue: queue.Queue = queue.Queue(maxsize=max_queue)
+        self._file = None
+        self._opened_at = 0.0
+        self._opened_inode: Optional[int] = None
+        self._rotations = 0
+        self._thread: Optional[threading.Thread] = None
+        self._stop_event = threading.Event()
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        atexit.register(self.stop)
+
+    def emit(self, event: str, level: str = 'INFO', **fields: Any) -> None:
+        """Queue an audit record
+
+        Args:
+            event: Event name, e.g. "USER:LOGIN"
+            level: Severity of the event
+            **fields: Event details; values must be JSON serializable or
+                are converted with str()
+        """
+        record = {
+            'timestamp': datetime.datetime.utcnow().isoformat() + 'Z',
+            'level': level,
+            'event': event
+        }
+        record.update(fields)
+
+        if not self.running:
+            self.start()
+
+        try:
+            self._queue.put(record, timeout=self.put_timeout)
+        except queue.Full:
+            self._write_directly(record)
+
+    def _write_directly(self, record: Dict[str, Any]) -> None:
+        """Write one record from the calling thread when the queue stays full"""
+        try:
+            self._write([record])
+            self.written_directly += 1
+        except Exception as e:
+            self.dropped += 1
+            logger.error(f"Dropped audit record {record['event']}: {str(e)}")
+
+    @property
+    def running(self) -> bool:
+        """Whether the writer thread is alive"""
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self) -> None:
+        """Start the writer thread if it is not already running"""
+        with self._lock:
+            if self.running:
+                return
+
+            self._stop_event.clear()
+            self._thread = threading.Thread(target=self._run, name='audit-writer', daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout: Optional[float] = 5) -> None:
+        """Stop the writer after draining everything queued so far"""
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def after_fork(self) -> None:
+        """Start over in a forked worker
+
+        Records queued before the fork belong to the parent, which writes
+        them; the child drops its copy and opens its own file handle.
+        """
+        self._queue = queue.Queue(maxsize=self._queue.maxsize)
+        self._close()
+        self._thread = None
+        self._stop_event = threading.Event()
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+
+    def _run(self) -> None:
+        """Writer loop: collect a batch, write it, repeat"""
+        while True:
+            batch = self._collect_batch()
+            if batch:
+                try:
+                    self._write(batch)
+                except Exception as e:
+                    logger.error(f"Failed to write {len(batch)} audit records: {str(e)}")
+
+            if self._stop_event.is_set() and self._queue.empty():
+                break
+
+        with self._write_lock:
+            self._close()
+
+    def _collect_batch(self) -> List[Dict[str, Any]]:
+        """Wait for records until the batch is full or the interval passes"""
+        batch: List[Dict[str, Any]] = []
+        deadline = time.monotonic() + self.flush_interval
+
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+
+        return batch
+
+    def _write(self, batch: List[Dict[str, Any]]) -> None:
+        """Append a batch to the active file and fsync it"""
+        lines = ''.join(json.dumps(record, default=str, separators=(',', ':')) + '\n' for record in batch)
+        with self._write_lock:
+            self._rotate_if_needed()
+
+            with self._file_lock(fcntl.LOCK_SH):
+                self._reopen_if_rotated()
+                if self._file is None:
+                    # Unbuffered, so each batch is one append and cannot interleave with another process's
+                    self._file = open(self.path, 'ab', buffering=0)
+
+                self._file.write(lines.encode('utf-8'))
+                os.fsync(self._file.fileno())
+
+    @staticmethod
+    @contextmanager
+    def _file_lock(operation: int) -> Iterator[None]:
+        """Hold the cross-process audit file lock for the block"""
+        os.makedirs(CONFIG_DIR, exist_ok=True)
+        with open(LOCK_FILE, 'w') as lock_file:
+            fcntl.flock(lock_file, operation)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _reopen_if_rotated(self) -> None:
+        """Close the handle if the file behind the path is no longer the open one"""
+        if self._file is None:
+            return
+        try:
+            replaced = os.stat(self.path).st_ino != os.fstat(self._file.fileno()).st_ino
+        except FileNotFoundError:
+            replaced = True
+        if replaced:
+            self._close()
+
+    def _rotate_if_needed(self) -> None:
+        """Rotate the active file once it is too large or too old
+
+        The cheap check runs unlocked; it is repeated under the exclusive
+        lock, against the file then on disk, since another process may have
+        rotated it in the meantime.
+        """
+        from admin import get_admin_module
+
+        settings = get_admin_module().get_settings()
+        max_bytes = settings.audit_rotate_mb * 1024 * 1024
+        max_age = settings.audit_rotate_hours * 3600
+
+        if not self._rotation_due(max_bytes, max_age):
+            return
+
+        with self._file_lock(fcntl.LOCK_EX):
+            self._reopen_if_rotated()
+            if not self._rotation_due(max_bytes, max_age):
+                return
+
+            self._close()
+            self._rotations += 1
+            suffix = datetime.datetime.utcnow().strftime('%Y%m%dT%H%M%S')
+            os.replace(self.path, f"{self.path}.{suffix}.{os.getpid()}.{self._rotations}")
+            self._purge_expired(settings.audit_retention_days)
+
+    def _rotation_due(self, max_bytes: int, max_age: float) -> bool:
+        """Whether the file at the path is too large or too old"""
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return False
+        if stat.st_size == 0:
+            return False
+
+        if stat.st_ino != self._opened_inode:
+            # Age the file from its first record, whichever process created it
+            self._opened_at = self._first_record_time()
+            self._opened_inode = stat.st_ino
+
+        return stat.st_size >= max_bytes or time.time() - self._opened_at >= max_age
+
+    def _first_record_time(self) -> float:
+        """Epoch time of the first record in the active file"""
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                first = json.loads(f.readline())
+            timestamp = datetime.datetime.fromisoformat(first['timestamp'].rstrip('Z'))
+            return timestamp.replace(tzinfo=datetime.timezone.utc).timestamp()
+        except (OSError, ValueError, KeyError, TypeError):
+            return time.time()
+
+    def _purge_expired(self, retention_days: int) -> None:
+        """Delete rotated files older than the retention period"""
+        cutoff = time.time() - retention_days * 86400
+        for rotated in glob.glob(f"{self.path}.*"):
+            try:
+                if os.path.getmtime(rotated) < cutoff:
+                    os.remove(rotated)
+            except OSError as e:
+                logger.warning(f"Could not remove expired audit file {rotated}: {str(e)}")
+
+    def _close(self) -> None:
+        """Close the active file"""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Return queue statistics"""
+        return {
+            'queued': self._queue.qsize(),
+            'dropped': self.dropped,
+            'writtenDirectly': self.written_directly,
+            'running': self.running
+        }
+
+
+class AuditLogHandler(logging.Handler):
+    """Routes records sent to the 'audit' logger into the audit pipeline"""
+
+    def __init__(self, audit_log: AuditLog):
+        super().__init__()
+        self.audit_log = audit_log
+
+    def emit(self, record: logging.LogRecord) -> None:
+        self.audit_log.emit('LOG', level=record.levelname, logger=record.name, message=record.getMessage())
+
+
+# Create an instance of the audit log
+audit_log = AuditLog()
+
+# Legacy callers of logging.getLogger('audit') feed the same pipeline;
+# propagation is off so nothing is written synchronously by other handlers
+_audit_logger = logging.getLogger('audit')
+_audit_logger.handlers = [AuditLogHandler(audit_log)]
+_audit_logger.setLevel(logging.INFO)
+_audit_logger.propagate = False
+
+
+def get_audit_log() -> AuditLog:
+    """Return the audit log instance"""
+    return audit_log
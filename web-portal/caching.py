@@ -0,0 +1,196 @@
+"""
+In-process caches for SillyPostilion.
+
+Provides a small thread-safe LRU cache whose entries expire after a fixed
+time-to-live, used to keep recently decoded payloads out of the database
+and away from repeated decryption, and a byte-capped cache of decrypted
+field values that zeroes what it evicts.
+"""
+
+import time
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional
+
+
+class TTLCache:
+    """Least-recently-used cache with per-entry expiry"""
+
+    def __init__(self, maxsize: int = 256, ttl: float = 60):
+        """Initialize the cache
+
+        Args:
+            maxsize: Maximum number of entries kept before the least
+                recently used one is evicted
+            ttl: Seconds an entry stays valid after it is stored
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        """Return the cached value for a key, or None if missing or expired"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            expires_at, value = entry
+            if time.monotonic() >= expires_at:
+                del self._entries[key]
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: Hashable, value: Any) -> None:
+        """Store a value, evicting the least recently used entry if full"""
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, key: Hashable) -> None:
+        """Remove a single entry"""
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        """Remove every entry"""
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Return size and hit-rate statistics"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'maxsize': self.maxsize,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hitRate': round(self.hits / lookups, 3) if lookups else None
+            }
+
+
+class PlaintextCache:
+    """Bounded cache of decrypted field values keyed by ciphertext digest
+
+    Values are held as bytearrays so they can be zeroed when evicted,
+    expired or wiped. Copies already handed to callers are ordinary Python
+    objects and are not covered.
+    """
+
+    def __init__(self, enabled: bool = False, ttl: float = 60, max_bytes: int = 16 * 1024 * 1024):
+        """Initialize the cache
+
+        Args:
+            enabled: Whether lookups and stores do anything
+            ttl: Seconds a value stays valid after it is stored
+            max_bytes: Total plaintext bytes kept before the least recently
+                used values are evicted
+        """
+        self.enabled = enabled
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._size = 0
+        self._entries: "OrderedDict[bytes, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def configure(self, enabled: bool, ttl: float, max_bytes: int) -> None:
+        """Apply new settings, wiping the cache when it is disabled"""
+        with self._lock:
+            self.enabled = enabled
+            self.ttl = ttl
+            self.max_bytes = max_bytes
+            if not enabled:
+                self._wipe_locked()
+            else:
+                self._evict_locked()
+
+    def get(self, digest: bytes) -> Optional[bytes]:
+        """Return a copy of the cached plaintext, or None"""
+        if not self.enabled:
+            return None
+
+        with self._lock:
+            entry = self._entries.get(digest)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            expires_at, value = entry
+            if time.monotonic() >= expires_at:
+                self._remove_locked(digest)
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(digest)
+            self.hits += 1
+            return bytes(value)
+
+    def set(self, digest: bytes, plaintext: bytes) -> None:
+        """Store a plaintext, evicting least recently used values over the cap"""
+        if not self.enabled or len(plaintext) > self.max_bytes:
+            return
+
+        with self._lock:
+            if digest in self._entries:
+                self._remove_locked(digest)
+            self._entries[digest] = (time.monotonic() + self.ttl, bytearray(plaintext))
+            self._size += len(plaintext)
+            self._evict_locked()
+
+    def wipe(self) -> None:
+        """Zero and drop every cached value"""
+        with self._lock:
+            self._wipe_locked()
+
+    def _remove_locked(self, digest: bytes) -> None:
+        """Zero and drop one value; the lock must be held"""
+        _, value = self._entries.pop(digest)
+        self._size -= len(value)
+        value[:] = b'\0' * len(value)
+
+    def _evict_locked(self) -> None:
+        """Evict least recently used values until under the cap"""
+        while self._entries and self._size > self.max_bytes:
+            self._remove_locked(next(iter(self._entries)))
+            self.evictions += 1
+
+    def _wipe_locked(self) -> None:
+        """Zero and drop every value; the lock must be held"""
+        for digest in list(self._entries):
+            self._remove_locked(digest)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Return size and hit-rate statistics"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'enabled': self.enabled,
+                'entries': len(self._entries),
+                'bytes': self._size,
+                'maxBytes': self.max_bytes,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hitRate': round(self.hits / lookups, 3) if lookups else None
+            }
@@ -0,0 +1,127 @@
+"""
+Response compression for the SillyPostilion API.
+
+JSON responses under /api/ above a size threshold are gzip-compressed
+for clients that accept it. Compressed bodies are cached by a digest of
+the uncompressed body, so payloads that do not change between polls,
+such as transaction details and unchanged pages, status and statistics,
+are compressed once. Hashing a body costs a small fraction of
+compressing it.
+
+Streamed responses, such as the Server-Sent Events stream, are never
+compressed, as buffering would hold back live updates.
+"""
+
+import gzip
+import hashlib
+import logging
+from typing import Any, Dict
+
+from flask import request
+
+from caching import TTLCache
+
+# Configure logger
+logger = logging.getLogger('compression')
+
+COMPRESSIBLE_MIMETYPES = ('application/json',)
+
+
+class ResponseCompressor:
+    """Gzip-compresses API responses and caches the compressed bodies"""
+
+    def __init__(self, app=None, min_bytes: int = 1024, level: int = 6,
+                 cache_size: int = 128, cache_ttl: float = 300):
+        """Initialize the compressor
+
+        Args:
+            app: Flask application to bind to
+            min_bytes: Smallest body that is compressed
+            level: gzip compression level, 1 (fastest) to 9 (smallest)
+            cache_size: Compressed bodies kept
+            cache_ttl: Seconds a compressed body is kept
+        """
+        self.app = None
+        self.enabled = True
+        self.min_bytes = min_bytes
+        self.level = level
+        self.cache = TTLCache(maxsize=cache_size, ttl=cache_ttl)
+        self.compressed = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Bind the compressor to the Flask app.
+
+        Register it right after the request metrics, so it runs after the
+        other after_request handlers have finished with the body.
+        """
+        self.app = app
+        self.enabled = app.config.get('COMPRESS_ENABLED', True)
+        self.min_bytes = app.config.get('COMPRESS_MIN_BYTES', self.min_bytes)
+        self.level = app.config.get('COMPRESS_LEVEL', self.level)
+        app.extensions['compression'] = self
+
+        app.after_request(self.compress)
+
+    def after_fork(self) -> None:
+        """Start a worker with its own cache and lock"""
+        self.cache = TTLCache(maxsize=self.cache.maxsize, ttl=self.cache.ttl)
+
+    def _should_compress(self, response) -> bool:
+        return (
+            self.enabled
+            and request.path.startswith('/api/')
+            and response.status_code == 200
+            and response.mimetype in COMPRESSIBLE_MIMETYPES
+            and not response.is_streamed
+            and 'Content-Encoding' not in response.headers
+        )
+
+    def compress(self, response):
+        """Gzip the response body if the client accepts it and it is large enough"""
+        if not self._should_compress(response):
+            return response
+
+        # Caches must keep the encodings apart even when this one is not compressed
+        response.vary.add('Accept-Encoding')
+
+        body = response.get_data()
+        if len(body) < self.min_bytes or not request.accept_encodings['gzip']:
+            return response
+
+        key = hashlib.blake2b(body, digest_size=16).digest()
+        compressed = self.cache.get(key)
+        if compressed is None:
+            compressed = gzip.compress(body, compresslevel=self.level, mtime=0)
+            self.cache.set(key, compressed)
+
+        response.set_data(compressed)
+        response.headers['Content-Encoding'] = 'gzip'
+        self.compressed += 1
+        self.bytes_in += len(body)
+        self.bytes_out += len(compressed)
+        return response
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Return compression and cache statistics"""
+        return {
+            'enabled': self.enabled,
+            'compressed': self.compressed,
+            'bytesIn': self.bytes_in,
+            'bytesOut': self.bytes_out,
+            'ratio': round(self.bytes_out / self.bytes_in, 3) if self.bytes_in else None,
+            'cache': self.cache.get_stats()
+        }
+
+
+# Create an instance of the response compressor
+response_compressor = ResponseCompressor()
+
+
+def get_response_compressor() -> ResponseCompressor:
+    """Return the response compressor instance"""
+    return response_compressor
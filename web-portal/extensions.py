@@ -0,0 +1,37 @@
+"""
+Flask extensions for the SillyPostilion web portal.
+
+The extensions are created unbound and attached to an application in
+create_app, so models and blueprints can import them without building an
+application.
+"""
+
+from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy.orm import DeclarativeBase
+from flask_wtf.csrf import CSRFProtect
+from flask_login import LoginManager
+
+
+# Create a Base class for SQLAlchemy models
+class Base(DeclarativeBase):
+    pass
+
+
+# Initialize SQLAlchemy
+db = SQLAlchemy(model_class=Base)
+
+# Initialize CSRF protection
+csrf = CSRFProtect()
+
+# Initialize login manager
+login_manager = LoginManager()
+login_manager.login_view = 'auth.login'
+login_manager.login_message = 'Please log in to access this page.'
+login_manager.login_message_category = 'warning'
+
+
+@login_manager.user_loader
+def load_user(user_id):
+    """Load user by ID for Flask-Login"""
+    from models import User
+    return User.query.get(user_id)
@@ -0,0 +1,371 @@
+"""
+Background re-encryption of transaction fields for SillyPostilion.
+
+Stored fields are sealed with whichever key was primary when they were
+written: legacy rows hold double base64 Fernet ciphertexts, and after an
+ENCRYPTION_KEYS rotation older rows are still sealed with a retired key.
+Those rows stay readable through the keyring, and this worker walks the
+transaction table and then each monthly partition in primary-key order,
+re-encrypting them under the primary key and filling in blind indexes in
+small, throttled batches until none are left. Archived months are
+immutable segment files and are rewritten one month at a time. Progress is checkpointed to disk so the job resumes where it
+stopped after a restart, and a lock file keeps it to one process at a time.
+"""
+
+import os
+import json
+import time
+import fcntl
+import logging
+import datetime
+import threading
+from typing import Optional, Dict, Any
+
+from sqlalchemy import or_, and_, func
+from sqlalchemy.orm import undefer
+
+from admin import CONFIG_DIR
+from security import get_security_manager
+from archive import get_transaction_archive
+from partitions import get_transaction_partitions
+
+# Configure logger
+logger = logging.getLogger('field_migration')
+
+CHECKPOINT_FILE = os.path.join(CONFIG_DIR, 'reencryption_checkpoint.json')
+LOCK_FILE = os.path.join(CONFIG_DIR, 'reencryption.lock')
+
+# Checkpoint source name of the main transaction table; partitions are named by month
+MAIN_SOURCE = 'main'
+
+# Prefix of the checkpoint source names of archived months
+ARCHIVE_SOURCE_PREFIX = 'archive:'
+
+# Longest wait in seconds before retrying a failed batch
+MAX_RETRY_SECONDS = 300
+
+
+class FieldEncryptionMigrator:
+    """Re-encrypts fields under the primary key and backfills blind indexes"""
+
+    def __init__(self, app=None, batch_size: int = 200, lock_retry_seconds: float = 30,
+                 retry_seconds: float = 5):
+        """Initialize the migrator
+
+        Args:
+            app: Flask application to bind to
+            batch_size: Rows re-encrypted per transaction
+            lock_retry_seconds: How often a process waiting for another one's
+                lock tries to take over
+            retry_seconds: Wait before retrying a failed batch, doubled on
+                each consecutive failure up to MAX_RETRY_SECONDS
+        """
+        self.app = None
+        self.batch_size = batch_size
+        self.lock_retry_seconds = lock_retry_seconds
+        self.retry_seconds = retry_seconds
+        self.migrated = 0
+        self.skipped = 0
+        self.source = MAIN_SOURCE
+        self.last_id = ''
+        self.key_id: Optional[str] = None
+        self._finished_key_id: Optional[str] = None
+        self._waiting_for_lock = False
+        self._thread: Optional[threading.Thread] = None
+        self._stop_event = threading.Event()
+        self._lock = threading.Lock()
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Bind the migrator to the Flask app.
+
+        The worker is started lazily on the first request and exits once
+        every row is sealed with the primary key. It starts again when the
+        primary key changes.
+        """
+        self.app = app
+        self.batch_size = app.config.get('FIELD_MIGRATION_BATCH_SIZE', self.batch_size)
+        app.extensions['field_migration'] = self
+
+        if app.config.get('FIELD_MIGRATION_ENABLED', True):
+            app.before_request(self.start)
+
+    @property
+    def running(self) -> bool:
+        """Whether the worker thread is alive"""
+        return self._thread is not None and self._thread.is_alive()
+
+    @property
+    def finished(self) -> bool:
+        """Whether every row is sealed with the current primary key"""
+        return self._finished_key_id is not None and self._finished_key_id == self._primary_key_id()
+
+    def start(self) -> None:
+        """Start the worker thread unless it is running or already done"""
+        if self.running or self.finished:
+            return
+
+        with self._lock:
+            if self.running or self.finished:
+                return
+
+            self._stop_event.clear()
+            self._thread = threading.Thread(target=self._run, name='field-migration', daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout: Optional[float] = None) -> None:
+        """Signal the worker thread to stop and wait for it"""
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def after_fork(self) -> None:
+        """Forget the parent's worker thread so a forked worker starts its own"""
+        self._thread = None
+        self._waiting_for_lock = False
+        self._stop_event = threading.Event()
+        self._lock = threading.Lock()
+
+    def _primary_key_id(self) -> str:
+        """Hex id of the key new values are encrypted with"""
+        security_manager = self.app.extensions.get('security_manager') or get_security_manager()
+        return security_manager.key_ids()[0]
+
+    def _run(self) -> None:
+        """Worker loop: take the lock, then migrate batches until none are left"""
+        os.makedirs(CONFIG_DIR, exist_ok=True)
+        lock_file = open(LOCK_FILE, 'w')
+        try:
+            while not self._try_lock(lock_file):
+                self._waiting_for_lock = True
+                if self._stop_event.wait(self.lock_retry_seconds):
+                    return
+            self._waiting_for_lock = False
+
+            key_id = self._primary_key_id()
+            checkpoint = self._load_checkpoint()
+            if checkpoint.get('key_id') == key_id:
+                if checkpoint.get('complete'):
+                    self._finished_key_id = key_id
+                    return
+                self.source = checkpoint.get('source', MAIN_SOURCE)
+                self.last_id = checkpoint.get('last_id', '')
+                self.migrated = checkpoint.get('migrated', 0)
+                self.skipped = checkpoint.get('skipped', 0)
+                logger.info(f"Resuming field re-encryption for key {key_id} in {self.source} after {self.last_id!r}")
+            else:
+                self.source = MAIN_SOURCE
+                self.last_id = ''
+                self.migrated = 0
+                self.skipped = 0
+            self.key_id = key_id
+            failures = 0
+
+            while not self._stop_event.is_set():
+                if self._primary_key_id() != key_id:
+                    # The keyring changed under us; start over for the new key
+                    logger.info("Primary encryption key changed, restarting field re-encryption")
+                    break
+
+                started = time.monotonic()
+                try:
+                    with self.app.app_context():
+                        last_id, rows = self._migrate_source_batch(self.source, self.last_id)
+                except Exception as e:
+                    # e.g. a locked database; retry the same batch after a growing pause
+                    failures += 1
+                    delay = min(self.retry_seconds * 2 ** (failures - 1), MAX_RETRY_SECONDS)
+                    logger.error(f"Field re-encryption batch in {self.source} after {self.last_id!r} failed, "
+                                 f"retrying in {delay:.0f}s: {str(e)}")
+                    self._stop_event.wait(delay)
+                    continue
+                failures = 0
+
+                if last_id is None:
+                    next_source = self._next_source(self.source)
+                    if next_source is not None:
+                        self.source, self.last_id = next_source, ''
+                        self._save_checkpoint(key_id, complete=False)
+                        continue
+
+                    self._finished_key_id = key_id
+                    self._save_checkpoint(key_id, complete=True)
+                    logger.info(f"Field re-encryption complete for key {key_id}: "
+                                f"{self.migrated} rows re-encrypted, {self.skipped} skipped")
+                    break
+
+                self.last_id = last_id
+                self._save_checkpoint(key_id, complete=False)
+                self._stop_event.wait(self._throttle_delay(rows, time.monotonic() - started))
+        except Exception as e:
+            logger.error(f"Field re-encryption failed: {str(e)}")
+        finally:
+            self._waiting_for_lock = False
+            lock_file.close()
+
+    @staticmethod
+    def _next_source(source: str) -> Optional[str]:
+        """Source walked after the given one: the main table, then partitions and archived months oldest first
+
+        Rows sealed into a partition or archived while an earlier source is
+        being walked are still picked up, since those sources come after it.
+        """
+        sources = [MAIN_SOURCE] + sorted(get_transaction_partitions().months()) \
+            + [f"{ARCHIVE_SOURCE_PREFIX}{month}" for month in sorted(get_transaction_archive().months())]
+        if source not in sources:
+            # Purged or archived since the checkpoint was written
+            later = [name for name in sources[1:] if name > source]
+        else:
+            later = sources[sources.index(source) + 1:]
+        return later[0] if later else None
+
+    def _migrate_source_batch(self, source: str, after_id: str):
+        """Migrate one batch from the main table, a partition file or an archived month"""
+        if source == MAIN_SOURCE:
+            return self.migrate_batch(after_id)
+
+        if source.startswith(ARCHIVE_SOURCE_PREFIX):
+            archive = get_transaction_archive()
+            month = source[len(ARCHIVE_SOURCE_PREFIX):]
+            if month in archive.months():
+                changed, _ = archive.reencrypt_month(month)
+                self.migrated += changed
+            return None, 0
+
+        partitions = get_transaction_partitions()
+        if source not in partitions.months():
+            # Purged since the checkpoint was written
+            return None, 0
+        with partitions.sessions([source], write=True) as sessions:
+            for _, session in sessions:
+                return self.migrate_batch(after_id, session=session)
+        return None, 0
+
+    @staticmethod
+    def _try_lock(lock_file) -> bool:
+        """Take the cross-process job lock without blocking"""
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return True
+        except OSError:
+            return False
+
+    @staticmethod
+    def _throttle_delay(rows: int, elapsed: float) -> float:
+        """Seconds to sleep so throughput stays under the configured rate"""
+        from admin import get_admin_module
+
+        rows_per_second = get_admin_module().get_settings().reencryption_rows_per_second
+        if rows_per_second <= 0:
+            return 0
+        return max(rows / rows_per_second - elapsed, 0)
+
+    def migrate_batch(self, after_id: str = '', session=None):
+        """Re-encrypt the next batch of rows not sealed with the primary key
+
+        Must be called inside an application context. Rows are selected by
+        primary key after after_id, so each batch is a short index range
+        scan and its transaction holds no lock on the rest of the table.
+
+        Args:
+            after_id: Only rows with a greater primary key are considered
+            session: Session of a partition file; defaults to the main table
+
+        Returns:
+            Tuple of the primary key of the last row visited, or None when
+            none are left, and the number of rows visited
+        """
+        from models import Transaction, db
+
+        session = session or db.session
+        table = Transaction.__table__
+        prefix = get_security_manager().envelope_prefix()
+        # substr rather than LIKE: base64 is case sensitive and SQLite's LIKE is not
+        pending = [
+            and_(table.c[field].isnot(None), func.substr(table.c[field], 1, len(prefix)) != prefix)
+            for field in Transaction.ENCRYPTED_FIELDS
+        ]
+        pending += [
+            and_(table.c[field].isnot(None), table.c[f'{field}_bidx'].is_(None))
+            for field in Transaction.BLIND_INDEXED_FIELDS
+        ]
+        transactions = session.query(Transaction) \
+            .options(undefer(Transaction._raw_message)) \
+            .filter(Transaction.id > after_id) \
+            .filter(or_(*pending)) \
+            .order_by(Transaction.id) \
+            .limit(self.batch_size) \
+            .all()
+
+        if not transactions:
+            return None, 0
+
+        try:
+            for txn in transactions:
+                try:
+                    changed = txn.reencrypt_fields()
+                except Exception as e:
+                    # Leave the row as it was and move on; it is counted as skipped
+                    logger.error(f"Could not re-encrypt transaction {txn.id}: {str(e)}")
+                    session.expire(txn)
+                    changed = False
+                if changed:
+                    self.migrated += 1
+                else:
+                    self.skipped += 1
+            session.commit()
+        except Exception:
+            session.rollback()
+            raise
+
+        return transactions[-1].id, len(transactions)
+
+    @staticmethod
+    def _load_checkpoint() -> Dict[str, Any]:
+        """Read the saved progress, or an empty dict"""
+        try:
+            with open(CHECKPOINT_FILE, 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _save_checkpoint(self, key_id: str, complete: bool) -> None:
+        """Atomically write the current progress"""
+        data = {
+            'key_id': key_id,
+            'source': self.source,
+            'last_id': self.last_id,
+            'migrated': self.migrated,
+            'skipped': self.skipped,
+            'complete': complete,
+            'updated_at': datetime.datetime.now().isoformat()
+        }
+        temp_file = f"{CHECKPOINT_FILE}.tmp"
+        with open(temp_file, 'w') as f:
+            json.dump(data, f, indent=2)
+        os.replace(temp_file, CHECKPOINT_FILE)
+
+    def get_status(self) -> Dict[str, Any]:
+        """Return re-encryption progress"""
+        return {
+            'running': self.running,
+            'waitingForLock': self._waiting_for_lock,
+            'finished': self.finished,
+            'keyId': self.key_id,
+            'source': self.source,
+            'lastId': self.last_id,
+            'migrated': self.migrated,
+            'skipped': self.skipped
+        }
+
+
+# Create an instance of the field encryption migrator
+field_migrator = FieldEncryptionMigrator()
+
+
+def get_field_migrator() -> FieldEncryptionMigrator:
+    """Return the field encryption migrator instance"""
+    return field_migrator
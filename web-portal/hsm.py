@@ -19,13 +19,13 @@ import binascii
 from typing import Optional, Dict, List, Tuple, Union, Any
 from enum import Enum
 
-# PKCS#11 library for HSM interaction
-import pkcs11
-from pkcs11 import Mechanism, KeyType, ObjectClass, Attribute
+# PKCS#11 library for HSM interaction; imported on the first connection to
+# a real HSM, so software emulation never loads it
+pkcs11 = Mechanism = KeyType = ObjectClass = Attribute = None
 
 # Configure logger
 logger = logging.getLogger('hsm')
-handler = logging.FileHandler('hsm.log')
+handler = logging.FileHandler('hsm.log', delay=True)
 handler.setFormatter(logging.Formatter('%(asctime)s [%(levelname)s] %(message)s'))
 logger.addHandler(handler)
 logger.setLevel(logging.INFO)
@@ -65,6 +65,15 @@ class HSMOperationError(HSMError):
     """Raised when a cryptographic operation fails"""
     pass
 
+def _load_pkcs11() -> None:
+    """Import the PKCS#11 bindings into this module's namespace"""
+    global pkcs11, Mechanism, KeyType, ObjectClass, Attribute
+    if pkcs11 is None:
+        import pkcs11 as _pkcs11
+        Mechanism, KeyType = _pkcs11.Mechanism, _pkcs11.KeyType
+        ObjectClass, Attribute = _pkcs11.ObjectClass, _pkcs11.Attribute
+        pkcs11 = _pkcs11
+
 class HSMManager:
     """Manages connections and operations with Hardware Security Modules"""
     
@@ -99,6 +108,7 @@ class HSMManager:
                 return True
             
             # Load the PKCS#11 library
+            _load_pkcs11()
             self.lib = pkcs11.lib(self.hsm_lib_path)
             
             # Get the slot and token
@@ -129,6 +139,25 @@ class HSMManager:
                 self.session = None
                 self.connected = False
     
+    def after_fork(self) -> None:
+        """Reconnect in a forked worker
+
+        A PKCS#11 session cannot be shared with the parent process, so the
+        inherited one is abandoned and the library reinitialized before a
+        new session is opened.
+        """
+        was_connected = self.connected
+        self.session = None
+        self.slot = None
+        self.connected = False
+        if self.lib is not None and hasattr(self.lib, 'reinitialize'):
+            try:
+                self.lib.reinitialize()
+            except Exception as e:
+                logger.error(f"Error reinitializing HSM library: {str(e)}")
+        if was_connected:
+            self.connect()
+    
     def _ensure_connection(self) -> None:
         """Ensure there's an active connection to the HSM"""
         if not self.connected:
@@ -0,0 +1,499 @@
+"""
+Merkle-tree integrity verification for the SillyPostilion transaction cache.
+
+Every cached transaction becomes a leaf of a Merkle tree for its time
+bucket (the transaction date). Leaves are appended in arrival order and
+tree nodes are persisted, so adding a transaction rewrites only the nodes
+on its path to the bucket root. The roots of all buckets are combined into
+a single root hash that an auditor can record; an inclusion proof shows
+that a transaction is part of that root without revealing other rows.
+
+Verification recomputes leaves from the stored rows, in the main table, a
+sealed monthly partition or the archive, which also detects deleted rows,
+and only revisits buckets whose root or row count changed since they were
+last verified. Buckets are verified in parallel.
+
+Appends from different processes are serialised with a lock file held
+until the caller commits, as two writers extending the same bucket would
+otherwise both write its next leaf position.
+"""
+
+import os
+import fcntl
+import hashlib
+import logging
+import datetime
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterator, List, Optional
+
+from sqlalchemy import func, and_
+from sqlalchemy.orm import undefer
+
+from admin import CONFIG_DIR
+from audit import get_audit_log
+from archive import get_transaction_archive
+from partitions import get_transaction_partitions
+
+# Configure logger
+logger = logging.getLogger('integrity')
+
+LOCK_FILE = os.path.join(CONFIG_DIR, 'integrity.lock')
+
+# Transactions are grouped into one tree per day
+BUCKET_FORMAT = '%Y-%m-%d'
+
+# Transaction IDs listed per problem in a bucket report
+REPORT_ID_LIMIT = 100
+
+# Domain separation keeps a leaf from being passed off as an inner node
+LEAF_PREFIX = b'\x00'
+NODE_PREFIX = b'\x01'
+
+
+def leaf_hash(record: str) -> str:
+    """Hash a transaction's canonical record into a leaf"""
+    return hashlib.sha256(LEAF_PREFIX + record.encode('utf-8')).hexdigest()
+
+
+def node_hash(left: str, right: Optional[str]) -> str:
+    """Hash two children into their parent; a lone left child is carried up"""
+    if right is None:
+        return left
+    return hashlib.sha256(NODE_PREFIX + bytes.fromhex(left) + bytes.fromhex(right)).hexdigest()
+
+
+def tree_height(count: int) -> int:
+    """Number of levels above the leaves in a tree of count leaves"""
+    return (count - 1).bit_length() if count > 1 else 0
+
+
+def level_width(count: int, level: int) -> int:
+    """Number of nodes on a level of a tree of count leaves"""
+    return ((count - 1) >> level) + 1 if count else 0
+
+
+def build_levels(leaves: List[str]) -> List[List[str]]:
+    """Build every level of a tree in memory, leaves first"""
+    levels = [list(leaves)]
+    while len(levels[-1]) > 1:
+        below = levels[-1]
+        levels.append([
+            node_hash(below[i], below[i + 1] if i + 1 < len(below) else None)
+            for i in range(0, len(below), 2)
+        ])
+    return levels
+
+
+def audit_path(levels: List[List[str]], position: int) -> List[Dict[str, str]]:
+    """Sibling hashes from a leaf up to the root of an in-memory tree"""
+    path = []
+    for nodes in levels[:-1]:
+        sibling = position ^ 1
+        if sibling < len(nodes):
+            path.append({'hash': nodes[sibling], 'side': 'left' if sibling < position else 'right'})
+        position >>= 1
+    return path
+
+
+def verify_proof(leaf: str, path: List[Dict[str, str]], root: str) -> bool:
+    """Check that a leaf hashes up to a root along an audit path
+
+    Args:
+        leaf: Leaf hash, or a bucket root when checking a bucket path
+        path: Sibling hashes as returned in an inclusion proof
+        root: Expected root hash
+    """
+    current = leaf
+    for step in path:
+        if step['side'] == 'left':
+            current = node_hash(step['hash'], current)
+        else:
+            current = node_hash(current, step['hash'])
+    return current == root
+
+
+class MerkleIntegrity:
+    """Maintains and verifies the per-bucket transaction Merkle trees"""
+
+    def __init__(self, app=None, workers: Optional[int] = None):
+        """Initialize the integrity tree
+
+        Args:
+            app: Flask application to bind to
+            workers: Buckets verified concurrently; defaults to the CPU count
+                capped at 4
+        """
+        self.app = None
+        self.workers = workers or min(4, os.cpu_count() or 1)
+        self.last_report: Optional[Dict[str, Any]] = None
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Bind the integrity tree to the Flask app"""
+        self.app = app
+        self.workers = app.config.get('INTEGRITY_VERIFY_WORKERS', self.workers)
+        app.extensions['integrity'] = self
+
+    @staticmethod
+    def bucket_for(timestamp: datetime.datetime) -> str:
+        """Time bucket a transaction belongs to"""
+        return timestamp.strftime(BUCKET_FORMAT)
+
+    @contextmanager
+    def appending(self) -> Iterator[None]:
+        """Hold the append lock for the block, across the caller's commit
+
+        Blocks until no other thread or process is appending. Call append
+        and commit inside the block.
+        """
+        os.makedirs(CONFIG_DIR, exist_ok=True)
+        with open(LOCK_FILE, 'w') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def append(self, transactions) -> None:
+        """Add new transactions to the trees of their buckets
+
+        Runs in the caller's session and does not commit, so the leaves are
+        written in the same database transaction as the rows. Only nodes on
+        the path from the new leaves to each bucket root are read or written.
+        The caller must hold the lock from appending until it has committed.
+
+        Args:
+            transactions: New Transaction instances, not yet in any tree
+        """
+        from models import db, MerkleBucket, MerkleNode
+
+        by_bucket: Dict[str, list] = {}
+        for txn in transactions:
+            if txn.timestamp is None:
+                txn.timestamp = datetime.datetime.utcnow()
+            by_bucket.setdefault(self.bucket_for(txn.timestamp), []).append(txn)
+
+        for bucket, txns in sorted(by_bucket.items()):
+            txns.sort(key=lambda txn: (txn.timestamp, txn.id))
+            summary = db.session.get(MerkleBucket, bucket)
+            if summary is None:
+                summary = MerkleBucket(bucket=bucket, leaf_count=0)
+                db.session.add(summary)
+
+            start = summary.leaf_count
+            count = start + len(txns)
+            hashes: Dict[tuple, str] = {}
+            for offset, txn in enumerate(txns):
+                leaf = leaf_hash(txn.canonical_record())
+                hashes[(0, start + offset)] = leaf
+                db.session.add(MerkleNode(bucket=bucket, level=0, position=start + offset,
+                                          hash=leaf, transaction_id=txn.id))
+
+            for level in range(1, tree_height(count) + 1):
+                first, last = start >> level, (count - 1) >> level
+                below_width = level_width(count, level - 1)
+                children = [position for position in range(2 * first, min(2 * last + 2, below_width))
+                            if (level - 1, position) not in hashes]
+                if children:
+                    for node in self._load_nodes(bucket, level - 1, children):
+                        hashes.setdefault((level - 1, node.position), node.hash)
+                existing = {node.position: node for node in self._load_nodes(bucket, level, range(first, last + 1))}
+
+                for position in range(first, last + 1):
+                    right = 2 * position + 1
+                    value = node_hash(hashes[(level - 1, 2 * position)],
+                                      hashes[(level - 1, right)] if right < below_width else None)
+                    hashes[(level, position)] = value
+                    if position in existing:
+                        existing[position].hash = value
+                    else:
+                        db.session.add(MerkleNode(bucket=bucket, level=level, position=position, hash=value))
+
+            summary.leaf_count = count
+            summary.root = hashes[(tree_height(count), 0)]
+
+    @staticmethod
+    def _load_nodes(bucket: str, level: int, positions) -> list:
+        """Load the stored nodes at the given positions of one level"""
+        from models import MerkleNode
+
+        positions = list(positions)
+        return MerkleNode.query.filter(
+            MerkleNode.bucket == bucket,
+            MerkleNode.level == level,
+            MerkleNode.position.between(positions[0], positions[-1])
+        ).all()
+
+    def untracked_query(self):
+        """Query for cached transactions that are not yet leaves of any tree"""
+        from models import Transaction, MerkleNode
+
+        return Transaction.query \
+            .outerjoin(MerkleNode, and_(MerkleNode.level == 0, MerkleNode.transaction_id == Transaction.id)) \
+            .filter(MerkleNode.transaction_id.is_(None))
+
+    def add_untracked(self, batch_size: int = 500) -> int:
+        """Append transactions cached before the tree existed
+
+        Must be called inside an application context. Rows are added in
+        timestamp order, one committed batch at a time.
+
+        Returns:
+            Number of transactions added
+        """
+        from models import db, Transaction
+
+        added = 0
+        while True:
+            transactions = self.untracked_query() \
+                .options(undefer(Transaction._raw_message)) \
+                .order_by(Transaction.timestamp, Transaction.id) \
+                .limit(batch_size) \
+                .all()
+            if not transactions:
+                break
+
+            Transaction.decrypt_many(transactions)
+            try:
+                with self.appending():
+                    self.append(transactions)
+                    db.session.commit()
+            except Exception:
+                db.session.rollback()
+                raise
+            added += len(transactions)
+
+        if added:
+            get_audit_log().emit('INTEGRITY:BACKFILL', transactions=added)
+        return added
+
+    @staticmethod
+    def drop_buckets(start: datetime.datetime, end: datetime.datetime) -> None:
+        """Delete the trees of every bucket in [start, end), after their rows were purged"""
+        from models import db, MerkleBucket, MerkleNode
+
+        first_bucket, last_bucket = start.strftime(BUCKET_FORMAT), end.strftime(BUCKET_FORMAT)
+        try:
+            MerkleNode.query.filter(MerkleNode.bucket >= first_bucket, MerkleNode.bucket < last_bucket) \
+                .delete(synchronize_session=False)
+            MerkleBucket.query.filter(MerkleBucket.bucket >= first_bucket, MerkleBucket.bucket < last_bucket) \
+                .delete(synchronize_session=False)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+
+    def root(self) -> Dict[str, Any]:
+        """Return the root hash over all bucket roots, in bucket order"""
+        from models import MerkleBucket
+
+        buckets = MerkleBucket.query.order_by(MerkleBucket.bucket).all()
+        levels = build_levels([bucket.root for bucket in buckets])
+        return {
+            'root': levels[-1][0] if buckets else None,
+            'buckets': len(buckets),
+            'transactions': sum(bucket.leaf_count for bucket in buckets),
+            'computedAt': datetime.datetime.utcnow().isoformat() + 'Z'
+        }
+
+    def proof(self, transaction_id: str) -> Optional[Dict[str, Any]]:
+        """Build an inclusion proof for a transaction
+
+        The leaf is checked against its bucket root with path, and the
+        bucket root against the overall root with bucketPath; both use
+        verify_proof.
+
+        Returns:
+            Proof dict, or None if the transaction is not in any tree
+        """
+        from models import db, MerkleBucket, MerkleNode
+
+        leaf = MerkleNode.query.filter_by(level=0, transaction_id=transaction_id).first()
+        if leaf is None:
+            return None
+
+        summary = db.session.get(MerkleBucket, leaf.bucket)
+        path = []
+        position = leaf.position
+        for level in range(tree_height(summary.leaf_count)):
+            sibling = position ^ 1
+            if sibling < level_width(summary.leaf_count, level):
+                node = db.session.get(MerkleNode, (leaf.bucket, level, sibling))
+                path.append({'hash': node.hash, 'side': 'left' if sibling < position else 'right'})
+            position >>= 1
+
+        buckets = [bucket for bucket, in MerkleBucket.query.with_entities(MerkleBucket.bucket)
+                   .order_by(MerkleBucket.bucket)]
+        roots = [root for root, in MerkleBucket.query.with_entities(MerkleBucket.root)
+                 .order_by(MerkleBucket.bucket)]
+        levels = build_levels(roots)
+
+        return {
+            'transactionId': transaction_id,
+            'bucket': leaf.bucket,
+            'position': leaf.position,
+            'leaf': leaf.hash,
+            'path': path,
+            'bucketRoot': summary.root,
+            'bucketPath': audit_path(levels, buckets.index(leaf.bucket)),
+            'root': levels[-1][0]
+        }
+
+    def verify(self, full: bool = False) -> Dict[str, Any]:
+        """Verify the stored trees against the transaction rows
+
+        Must be called inside an application context. Buckets whose root
+        and row count are unchanged since their last successful verification
+        are skipped unless full is set.
+
+        Args:
+            full: Verify every bucket
+
+        Returns:
+            Report with the overall root and per-bucket results
+        """
+        from models import db, Transaction, MerkleBucket
+
+        started = datetime.datetime.utcnow()
+        partitions = get_transaction_partitions()
+        row_counts: Dict[str, int] = {}
+        with partitions.sessions(partitions.months()) as sessions:
+            for session in [db.session] + [session for _, session in sessions]:
+                for day, rows in session.query(func.date(Transaction.timestamp), func.count(Transaction.id)) \
+                        .group_by(func.date(Transaction.timestamp)):
+                    if day is not None:
+                        row_counts[str(day)] = row_counts.get(str(day), 0) + rows
+        for day, rows in get_transaction_archive().day_counts().items():
+            row_counts[day] = row_counts.get(day, 0) + rows
+        summaries = {bucket.bucket: bucket for bucket in MerkleBucket.query.all()}
+
+        # Rows in a bucket without a tree were added behind the tree's back
+        buckets = sorted(set(summaries) | set(row_counts))
+        pending = [
+            bucket for bucket in buckets
+            if full or bucket not in summaries
+            or not summaries[bucket].verified_ok
+            or summaries[bucket].root != summaries[bucket].verified_root
+            or row_counts.get(bucket, 0) != summaries[bucket].leaf_count
+        ]
+
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='integrity') as executor:
+            results = list(executor.map(self._verify_bucket_in_context, pending))
+
+        now = datetime.datetime.utcnow()
+        for result in results:
+            summary = summaries.get(result['bucket'])
+            if summary is not None:
+                summary.verified_root = summary.root
+                summary.verified_at = now
+                summary.verified_ok = result['ok']
+        db.session.commit()
+
+        failed = [result for result in results if not result['ok']]
+        report = {
+            'root': self.root()['root'],
+            'full': full,
+            'buckets': len(buckets),
+            'verified': len(results),
+            'skipped': len(buckets) - len(results),
+            'failed': failed,
+            'ok': not failed,
+            'startedAt': started.isoformat() + 'Z',
+            'seconds': round((now - started).total_seconds(), 3)
+        }
+        self.last_report = report
+
+        get_audit_log().emit('INTEGRITY:VERIFY', level='INFO' if report['ok'] else 'WARNING',
+                             root=report['root'], verified=report['verified'],
+                             failed=[result['bucket'] for result in failed])
+        if failed:
+            logger.warning(f"Integrity verification failed for {len(failed)} buckets")
+        return report
+
+    def _verify_bucket_in_context(self, bucket: str) -> Dict[str, Any]:
+        """Verify one bucket from a worker thread"""
+        with self.app.app_context():
+            return self.verify_bucket(bucket)
+
+    def verify_bucket(self, bucket: str) -> Dict[str, Any]:
+        """Recompute one bucket's tree from its rows and compare it with the stored one
+
+        Returns:
+            Dict with the bucket, whether it is intact, and the transactions
+            that were modified, deleted or added without a leaf
+        """
+        from models import db, Transaction, MerkleBucket, MerkleNode
+
+        start = datetime.datetime.strptime(bucket, BUCKET_FORMAT)
+        end = start + datetime.timedelta(days=1)
+        partitions = get_transaction_partitions()
+        with partitions.sessions(partitions.months_overlapping(start, end)) as sessions:
+            transactions = {}
+            for query in [Transaction.query] + [session.query(Transaction) for _, session in sessions]:
+                for txn in query.options(undefer(Transaction._raw_message)) \
+                        .filter(Transaction.timestamp >= start, Transaction.timestamp < end):
+                    transactions[txn.id] = txn
+            for txn in get_transaction_archive().rows_between(start, end):
+                transactions[txn.id] = txn
+            Transaction.decrypt_many(list(transactions.values()))
+            records = {txn_id: txn.canonical_record() for txn_id, txn in transactions.items()}
+
+        nodes = MerkleNode.query.filter_by(bucket=bucket).all()
+        stored = {(node.level, node.position): node for node in nodes}
+        leaves = sorted((node for node in nodes if node.level == 0), key=lambda node: node.position)
+
+        modified, missing = [], []
+        recomputed = []
+        for node in leaves:
+            record = records.pop(node.transaction_id, None)
+            if record is None:
+                missing.append(node.transaction_id)
+                recomputed.append(node.hash)
+                continue
+            value = leaf_hash(record)
+            if value != node.hash:
+                modified.append(node.transaction_id)
+            recomputed.append(value)
+        untracked = sorted(records)
+
+        # Stored inner nodes must match the tree rebuilt from the stored leaves
+        corrupt_nodes = 0
+        levels = build_levels([node.hash for node in leaves]) if leaves else [[]]
+        for level, hashes in enumerate(levels):
+            for position, value in enumerate(hashes):
+                node = stored.get((level, position))
+                if node is None or node.hash != value:
+                    corrupt_nodes += 1
+
+        summary = db.session.get(MerkleBucket, bucket)
+        expected_root = summary.root if summary is not None else None
+        recomputed_root = build_levels(recomputed)[-1][0] if recomputed else None
+        ok = (not modified and not missing and not untracked and not corrupt_nodes
+              and recomputed_root == expected_root)
+
+        return {
+            'bucket': bucket,
+            'ok': ok,
+            'leaves': len(leaves),
+            'root': expected_root,
+            'recomputedRoot': recomputed_root,
+            'modified': modified[:REPORT_ID_LIMIT],
+            'modifiedCount': len(modified),
+            'missing': missing[:REPORT_ID_LIMIT],
+            'missingCount': len(missing),
+            'untracked': untracked[:REPORT_ID_LIMIT],
+            'untrackedCount': len(untracked),
+            'corruptNodes': corrupt_nodes
+        }
+
+
+# Create an instance of the integrity tree
+integrity_tree = MerkleIntegrity()
+
+
+def get_integrity_tree() -> MerkleIntegrity:
+    """Return the integrity tree instance"""
+    return integrity_tree
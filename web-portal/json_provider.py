@@ -0,0 +1,69 @@
+"""
+JSON provider for the SillyPostilion web portal.
+
+Serializes jsonify and API responses with orjson when it is installed,
+several times faster than the standard library for large transaction
+pages, and falls back to Flask's standard library provider when it is
+not. Output is compact with sorted keys either way, and types orjson
+does not handle itself, including datetimes, are converted by Flask's
+usual rules so responses do not change with the encoder.
+"""
+
+import logging
+from typing import Any
+
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:  # Optional accelerator; the standard library is used without it
+    orjson = None
+
+# Configure logger
+logger = logging.getLogger('json_provider')
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    """Flask JSON provider that encodes with orjson when available"""
+
+    def __init__(self, app):
+        super().__init__(app)
+        self.accelerated = orjson is not None
+        if self.accelerated:
+            self._options = (orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+                             | (orjson.OPT_SORT_KEYS if self.sort_keys else 0))
+
+    def _pretty(self) -> bool:
+        return (self.compact is None and self._app.debug) or self.compact is False
+
+    def dumps_bytes(self, obj: Any, **kwargs: Any) -> bytes:
+        """Serialize to UTF-8 JSON bytes
+
+        Keyword arguments, such as indent, are only honoured by the
+        standard library encoder, which is used whenever any are given.
+        """
+        if self.accelerated and not kwargs:
+            try:
+                return orjson.dumps(obj, default=self.default, option=self._options)
+            except orjson.JSONEncodeError:
+                # e.g. integers beyond 64 bits; the standard library handles them
+                pass
+        return super().dumps(obj, **kwargs).encode('utf-8')
+
+    def dumps(self, obj: Any, **kwargs: Any) -> str:
+        if self.accelerated and not kwargs:
+            return self.dumps_bytes(obj).decode('utf-8')
+        return super().dumps(obj, **kwargs)
+
+    def loads(self, s, **kwargs: Any) -> Any:
+        if self.accelerated and not kwargs:
+            return orjson.loads(s)
+        return super().loads(s, **kwargs)
+
+    def response(self, *args: Any, **kwargs: Any):
+        """Serialize the arguments to a JSON response, as jsonify"""
+        if not self.accelerated or self._pretty():
+            return super().response(*args, **kwargs)
+
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(self.dumps_bytes(obj) + b"\n", mimetype=self.mimetype)
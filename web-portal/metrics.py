@@ -0,0 +1,268 @@
+"""
+Request metrics for the SillyPostilion web portal.
+
+Every request is timed into a latency histogram per endpoint, method and
+status code. Time spent in the database, in calls to the transaction
+processor and in field encryption is added up per request through
+timed() and record_phase(), accumulated per endpoint, and reported to the
+browser of a logged-in administrator in a Server-Timing header so
+devtools show where a dashboard request spent its time. /metrics exposes
+everything in the Prometheus text format to scrapers holding the
+METRICS_TOKEN.
+
+Metrics are kept per process: each gunicorn worker records and serves
+its own.
+"""
+
+import hmac
+import time
+import logging
+import threading
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Tuple
+
+from flask import Response, g, request, has_request_context, abort
+from flask_login import current_user
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# Configure logger
+logger = logging.getLogger('metrics')
+
+# Upper bounds in seconds of the latency histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Per-request phases and their Server-Timing descriptions
+PHASES = {
+    'db': 'Database',
+    'processor': 'Transaction processor',
+    'crypto': 'Field encryption'
+}
+
+METRIC_PREFIX = 'sillypostilion'
+
+
+class Histogram:
+    """Latency histogram with cumulative Prometheus-style buckets"""
+
+    def __init__(self, buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # The last bucket is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def render(self, name: str, labels: Dict[str, str]) -> List[str]:
+        """Prometheus text lines for this histogram"""
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            cumulative += count
+            le = '+Inf' if bound == float('inf') else repr(bound)
+            lines.append(f"{name}_bucket{_labels(dict(labels, le=le))} {cumulative}")
+        lines.append(f"{name}_sum{_labels(labels)} {self.sum:.6f}")
+        lines.append(f"{name}_count{_labels(labels)} {self.count}")
+        return lines
+
+
+def _escape(value: str) -> str:
+    """Escape a Prometheus label value"""
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(labels: Dict[str, str]) -> str:
+    """Format a Prometheus label set"""
+    return '{' + ','.join(f'{key}="{_escape(value)}"' for key, value in labels.items()) + '}'
+
+
+# Phases being timed on this thread, so nested blocks count once
+_active_phases = threading.local()
+
+
+def record_phase(phase: str, seconds: float) -> None:
+    """Add time to a phase of the current request; ignored outside a request"""
+    if not has_request_context():
+        return
+    timings = g.get('phase_timings')
+    if timings is not None:
+        timings[phase] = timings.get(phase, 0.0) + seconds
+
+
+@contextmanager
+def timed(phase: str):
+    """Time a block as part of a phase of the current request
+
+    Also usable as a decorator, e.g. @timed('crypto'). Blocks nested in another block of the same phase are not counted
+    again. Work on threads without a request context, such as background
+    workers and the crypto pool, is not attributed to any request.
+    """
+    if getattr(_active_phases, phase, False) or not has_request_context():
+        yield
+        return
+
+    setattr(_active_phases, phase, True)
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        setattr(_active_phases, phase, False)
+        record_phase(phase, time.perf_counter() - started)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    context._metrics_started = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = getattr(context, '_metrics_started', None)
+    if started is not None:
+        record_phase('db', time.perf_counter() - started)
+
+
+class RequestMetrics:
+    """Collects request latency histograms and per-phase timings"""
+
+    def __init__(self, app=None):
+        """Initialize the metrics registry
+
+        Args:
+            app: Flask application to bind to
+        """
+        self.app = None
+        self.server_timing = True
+        self.token: Optional[str] = None
+        self._requests: Dict[Tuple[str, str, str], Histogram] = {}
+        self._phases: Dict[Tuple[str, str], float] = {}
+        self._upstream: Dict[str, Histogram] = {}
+        self._lock = threading.Lock()
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Bind the metrics registry to the Flask app.
+
+        Register it before other extensions so the request timer covers
+        their before_request and after_request handlers. /metrics answers
+        404 unless METRICS_TOKEN is set, and scrapers must send the token
+        as a bearer token.
+        """
+        self.app = app
+        self.server_timing = app.config.get('SERVER_TIMING_ENABLED', True)
+        self.token = app.config.get('METRICS_TOKEN')
+        app.extensions['metrics'] = self
+
+        app.before_request(self._start_request)
+        app.after_request(self._finish_request)
+        app.add_url_rule('/metrics', 'metrics', self.metrics_view)
+
+        # Every engine, including the partition files, reports query time
+        if not event.contains(Engine, 'before_cursor_execute', _before_cursor_execute):
+            event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+            event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+
+    def after_fork(self) -> None:
+        """Replace the lock in a forked worker"""
+        self._lock = threading.Lock()
+
+    def _start_request(self) -> None:
+        g.request_started = time.perf_counter()
+        g.phase_timings = {}
+
+    def _finish_request(self, response):
+        """Record the request and add its Server-Timing header"""
+        started = g.pop('request_started', None)
+        if started is None:
+            return response
+
+        elapsed = time.perf_counter() - started
+        timings = g.pop('phase_timings', {})
+        endpoint = request.endpoint or 'unmatched'
+        key = (endpoint, request.method, str(response.status_code))
+
+        with self._lock:
+            histogram = self._requests.get(key)
+            if histogram is None:
+                histogram = self._requests[key] = Histogram()
+            histogram.observe(elapsed)
+            for phase, seconds in timings.items():
+                self._phases[(endpoint, phase)] = self._phases.get((endpoint, phase), 0.0) + seconds
+
+        # Timings reveal internals, so only administrators get them
+        if self.server_timing and current_user.is_authenticated and current_user.is_admin:
+            response.headers['Server-Timing'] = server_timing_header(timings, elapsed)
+        return response
+
+    def observe_upstream(self, path: str, seconds: float) -> None:
+        """Record one call to the transaction processor
+
+        Args:
+            path: API path relative to the processor's API root
+            seconds: Time until the response or error
+        """
+        record_phase('processor', seconds)
+        with self._lock:
+            histogram = self._upstream.get(path)
+            if histogram is None:
+                histogram = self._upstream[path] = Histogram()
+            histogram.observe(seconds)
+
+    def render(self) -> str:
+        """Return all metrics in the Prometheus text exposition format"""
+        with self._lock:
+            requests = sorted(self._requests.items())
+            phases = sorted(self._phases.items())
+            upstream = sorted(self._upstream.items())
+
+            name = f"{METRIC_PREFIX}_http_request_duration_seconds"
+            lines = [f"# HELP {name} Request latency by endpoint, method and status code.",
+                     f"# TYPE {name} histogram"]
+            for (endpoint, method, status), histogram in requests:
+                lines += histogram.render(name, {'endpoint': endpoint, 'method': method, 'status': status})
+
+            name = f"{METRIC_PREFIX}_http_request_phase_seconds_total"
+            lines += [f"# HELP {name} Time requests spent in the database, the processor and field encryption.",
+                      f"# TYPE {name} counter"]
+            for (endpoint, phase), seconds in phases:
+                lines.append(f"{name}{_labels({'endpoint': endpoint, 'phase': phase})} {seconds:.6f}")
+
+            name = f"{METRIC_PREFIX}_processor_request_duration_seconds"
+            lines += [f"# HELP {name} Latency of transaction processor API calls by path.",
+                      f"# TYPE {name} histogram"]
+            for path, histogram in upstream:
+                lines += histogram.render(name, {'path': path})
+
+        return '\n'.join(lines) + '\n'
+
+    def metrics_view(self):
+        """Serve the metrics to a Prometheus scraper"""
+        if not self.token:
+            abort(404)
+        supplied = request.headers.get('Authorization', '')
+        if not hmac.compare_digest(supplied.encode('utf-8'), f"Bearer {self.token}".encode('utf-8')):
+            abort(401)
+        return Response(self.render(), mimetype='text/plain; version=0.0.4')
+
+
+def server_timing_header(timings: Dict[str, float], total: float) -> str:
+    """Format phase timings in seconds as a Server-Timing header value"""
+    entries = [
+        f'{phase};dur={timings[phase] * 1000:.1f};desc="{description}"'
+        for phase, description in PHASES.items() if phase in timings
+    ]
+    entries.append(f'total;dur={total * 1000:.1f};desc="Total"')
+    return ', '.join(entries)
+
+
+# Create an instance of the metrics registry
+request_metrics = RequestMetrics()
+
+
+def get_request_metrics() -> RequestMetrics:
+    """Return the metrics registry instance"""
+    return request_metrics
@@ -0,0 +1,129 @@
+"""
+Versioned schema migrations for the SillyPostilion database.
+
+Each migration has a version number, a name and a function that changes
+the schema over a connection. Applied versions are recorded in the
+schema_migration table, and upgrade applies the pending ones in order,
+each in its own database transaction. Migrations only add what is
+missing, so a database created before versioning is brought up to date
+in place instead of being dropped and recreated.
+
+Run them with ``flask --app main upgrade-db``. create_app also applies
+them on startup unless AUTO_MIGRATE is off.
+"""
+
+import logging
+import datetime
+from typing import Callable, List, Tuple
+
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import inspect, insert, func, text
+
+from extensions import db
+
+# Configure logger
+logger = logging.getLogger('migrations')
+
+
+def _create_tables(connection, *names: str) -> None:
+    """Create the named model tables that do not exist yet"""
+    db.metadata.create_all(connection, tables=[db.metadata.tables[name] for name in names])
+
+
+def _add_missing_columns(connection, table_name: str, *column_names: str) -> None:
+    """Add the named model columns that a table does not have yet"""
+    table = db.metadata.tables[table_name]
+    existing = {column['name'] for column in inspect(connection).get_columns(table_name)}
+    preparer = connection.dialect.identifier_preparer
+    for name in column_names:
+        if name in existing:
+            continue
+        column = table.c[name]
+        connection.execute(text(
+            f"ALTER TABLE {preparer.format_table(table)} "
+            f"ADD COLUMN {preparer.format_column(column)} {column.type.compile(connection.dialect)}"
+        ))
+
+
+def _baseline(connection) -> None:
+    _create_tables(connection, 'transaction', 'system_status', 'user')
+
+
+def _blind_indexes(connection) -> None:
+    _add_missing_columns(connection, 'transaction', 'terminal_id_bidx', 'merchant_id_bidx')
+
+
+def _transaction_indexes(connection) -> None:
+    for index in db.metadata.tables['transaction'].indexes:
+        index.create(connection, checkfirst=True)
+
+
+def _integrity_tree(connection) -> None:
+    _create_tables(connection, 'merkle_bucket', 'merkle_node')
+
+
+# Applied in order; append new migrations, never edit applied ones
+MIGRATIONS: List[Tuple[int, str, Callable]] = [
+    (1, 'baseline tables', _baseline),
+    (2, 'transaction blind index columns', _blind_indexes),
+    (3, 'transaction lookup indexes', _transaction_indexes),
+    (4, 'integrity tree tables', _integrity_tree),
+]
+
+
+def current_version() -> int:
+    """Highest applied migration, 0 for an empty or unversioned database
+
+    Must be called inside an application context.
+    """
+    from models import SchemaMigration
+
+    if not inspect(db.engine).has_table(SchemaMigration.__tablename__):
+        return 0
+    return db.session.query(func.max(SchemaMigration.version)).scalar() or 0
+
+
+def pending_migrations() -> List[Tuple[int, str, Callable]]:
+    """Migrations not applied to the database yet, in order"""
+    version = current_version()
+    return [migration for migration in MIGRATIONS if migration[0] > version]
+
+
+def upgrade() -> List[int]:
+    """Apply every pending migration
+
+    Must be called inside an application context.
+
+    Returns:
+        Versions applied
+    """
+    from models import SchemaMigration
+
+    pending = pending_migrations()
+    if not pending:
+        return []
+
+    with db.engine.begin() as connection:
+        _create_tables(connection, SchemaMigration.__tablename__)
+
+    applied = []
+    for version, name, migrate in pending:
+        with db.engine.begin() as connection:
+            migrate(connection)
+            connection.execute(insert(SchemaMigration.__table__).values(
+                version=version, name=name, applied_at=datetime.datetime.utcnow()))
+        logger.info(f"Applied schema migration {version}: {name}")
+        applied.append(version)
+    return applied
+
+
+@click.command('upgrade-db')
+@with_appcontext
+def upgrade_command():
+    """Apply pending schema migrations."""
+    applied = upgrade()
+    if applied:
+        click.echo(f"Applied migrations {', '.join(map(str, applied))}; schema is at version {applied[-1]}")
+    else:
+        click.echo(f"Schema is up to date at version {current_version()}")
@@ -1,18 +1,23 @@
 from datetime import datetime
-import logging
+import json
 import uuid
 from werkzeug.security import generate_password_hash, check_password_hash
 from flask_login import UserMixin
-from app import db
+from extensions import db
 from flask import current_app
+from sqlalchemy.orm import deferred
+from access_stats import get_access_stats
+from audit import get_audit_log
+
+# Audit records for database operations go through the queued audit pipeline
+audit_log = get_audit_log()
+
+def _get_security_manager():
+    """Return the app's security manager, or None outside a configured app."""
+    if hasattr(current_app, 'extensions') and 'security_manager' in current_app.extensions:
+        return current_app.extensions['security_manager']
+    return None
 
-# Add audit logger for database operations
-audit_logger = logging.getLogger('audit')
-if not audit_logger.handlers:
-    audit_handler = logging.FileHandler('audit.log')
-    audit_handler.setFormatter(logging.Formatter('%(asctime)s [AUDIT] %(message)s'))
-    audit_logger.addHandler(audit_handler)
-    audit_logger.setLevel(logging.INFO)
 
 class Transaction(db.Model):
     """
@@ -25,19 +30,27 @@ class Transaction(db.Model):
     - merchant_id: Merchant identifier (encrypted)
     - raw_message: Complete transaction message (encrypted)
     """
+    __table_args__ = (
+        # Keyset pagination orders by (timestamp, id)
+        db.Index('ix_transaction_timestamp_id', 'timestamp', 'id'),
+    )
+    
     id = db.Column(db.String(50), primary_key=True)
-    mti = db.Column(db.String(4))
+    mti = db.Column(db.String(4), index=True)
     processing_code = db.Column(db.String(6))
     # Encrypted fields
     _amount = db.Column(db.Text, name="amount")  # Encrypted
     transmission_datetime = db.Column(db.String(10))
-    stan = db.Column(db.String(6))
-    rrn = db.Column(db.String(12))
-    response_code = db.Column(db.String(2))
+    stan = db.Column(db.String(6), index=True)
+    rrn = db.Column(db.String(12), index=True)
+    response_code = db.Column(db.String(2), index=True)
     _terminal_id = db.Column(db.Text, name="terminal_id")  # Encrypted
     _merchant_id = db.Column(db.Text, name="merchant_id")  # Encrypted
+    # Blind indexes (truncated keyed HMACs) for equality search on encrypted fields
+    terminal_id_bidx = db.Column(db.String(32), index=True)
+    merchant_id_bidx = db.Column(db.String(32), index=True)
     direction = db.Column(db.String(10))
-    _raw_message = db.Column(db.Text, name="raw_message")  # Encrypted
+    _raw_message = deferred(db.Column(db.Text, name="raw_message"))  # Encrypted, loaded on access
     timestamp = db.Column(db.DateTime, default=datetime.utcnow)
     # Audit fields
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
@@ -57,102 +70,223 @@ class Transaction(db.Model):
         super(Transaction, self).__init__(**kwargs)
         
         # Log creation
-        audit_logger.info(f"TRANSACTION:CREATE | ID: {self.id} | MTI: {self.mti}")
+        audit_log.emit('TRANSACTION:CREATE', id=self.id, mti=self.mti)
+    
+    # Encrypted attributes and the columns that store their ciphertext
+    ENCRYPTED_FIELDS = ('amount', 'terminal_id', 'merchant_id', 'raw_message')
+    
+    # Encrypted attributes with a searchable blind index column
+    BLIND_INDEXED_FIELDS = ('terminal_id', 'merchant_id')
+    
+    # API field names mapped to attributes, in serialization order
+    API_FIELDS = {
+        'id': 'id',
+        'mti': 'mti',
+        'processingCode': 'processing_code',
+        'amount': 'amount',
+        'transmissionDatetime': 'transmission_datetime',
+        'stan': 'stan',
+        'rrn': 'rrn',
+        'responseCode': 'response_code',
+        'terminalId': 'terminal_id',
+        'merchantId': 'merchant_id',
+        'direction': 'direction',
+        'rawMessage': 'raw_message',
+        'timestamp': 'timestamp',
+        'last_accessed': 'last_accessed',
+        'access_count': 'access_count'
+    }
+    
+    # Fields returned by list views; the raw message is only shown in detail
+    LIST_FIELDS = tuple(name for name in API_FIELDS if name != 'rawMessage')
+    
+    def _get_plaintext(self, field):
+        """Decrypt an encrypted field, caching the plaintext on the instance."""
+        cache = self.__dict__.setdefault('_plaintext', {})
+        if field not in cache:
+            security_manager = _get_security_manager()
+            ciphertext = getattr(self, f'_{field}')
+            if security_manager is None or not ciphertext:
+                return ciphertext
+            cache[field] = security_manager.decrypt_data(ciphertext, codec='str')
+        return cache[field]
+    
+    def _set_plaintext(self, field, value):
+        """Encrypt and store an encrypted field, maintaining its blind index."""
+        security_manager = _get_security_manager()
+        if value and security_manager is not None:
+            setattr(self, f'_{field}', security_manager.encrypt_data(value, codec='str'))
+            if field in self.BLIND_INDEXED_FIELDS:
+                setattr(self, f'{field}_bidx', security_manager.blind_index(value, field))
+        else:
+            setattr(self, f'_{field}', value)
+            if field in self.BLIND_INDEXED_FIELDS:
+                setattr(self, f'{field}_bidx', None)
+        self.__dict__.setdefault('_plaintext', {}).pop(field, None)
     
     @property
     def amount(self):
         """Decrypt amount field."""
-        if hasattr(current_app, 'extensions') and 'security_manager' in current_app.extensions:
-            security_manager = current_app.extensions['security_manager']
-            if self._amount:
-                return security_manager.decrypt_data(self._amount)
-        return self._amount
+        return self._get_plaintext('amount')
     
     @amount.setter
     def amount(self, value):
         """Encrypt amount field."""
-        if value and hasattr(current_app, 'extensions') and 'security_manager' in current_app.extensions:
-            security_manager = current_app.extensions['security_manager']
-            self._amount = security_manager.encrypt_data(value)
-        else:
-            self._amount = value
+        self._set_plaintext('amount', value)
     
     @property
     def terminal_id(self):
         """Decrypt terminal_id field."""
-        if hasattr(current_app, 'extensions') and 'security_manager' in current_app.extensions:
-            security_manager = current_app.extensions['security_manager']
-            if self._terminal_id:
-                return security_manager.decrypt_data(self._terminal_id)
-        return self._terminal_id
+        return self._get_plaintext('terminal_id')
     
     @terminal_id.setter
     def terminal_id(self, value):
         """Encrypt terminal_id field."""
-        if value and hasattr(current_app, 'extensions') and 'security_manager' in current_app.extensions:
-            security_manager = current_app.extensions['security_manager']
-            self._terminal_id = security_manager.encrypt_data(value)
-        else:
-            self._terminal_id = value
+        self._set_plaintext('terminal_id', value)
     
     @property
     def merchant_id(self):
         """Decrypt merchant_id field."""
-        if hasattr(current_app, 'extensions') and 'security_manager' in current_app.extensions:
-            security_manager = current_app.extensions['security_manager']
-            if self._merchant_id:
-                return security_manager.decrypt_data(self._merchant_id)
-        return self._merchant_id
+        return self._get_plaintext('merchant_id')
     
     @merchant_id.setter
     def merchant_id(self, value):
         """Encrypt merchant_id field."""
-        if value and hasattr(current_app, 'extensions') and 'security_manager' in current_app.extensions:
-            security_manager = current_app.extensions['security_manager']
-            self._merchant_id = security_manager.encrypt_data(value)
-        else:
-            self._merchant_id = value
+        self._set_plaintext('merchant_id', value)
     
     @property
     def raw_message(self):
         """Decrypt raw_message field."""
-        if hasattr(current_app, 'extensions') and 'security_manager' in current_app.extensions:
-            security_manager = current_app.extensions['security_manager']
-            if self._raw_message:
-                return security_manager.decrypt_data(self._raw_message)
-        return self._raw_message
+        return self._get_plaintext('raw_message')
     
     @raw_message.setter
     def raw_message(self, value):
         """Encrypt raw_message field."""
-        if value and hasattr(current_app, 'extensions') and 'security_manager' in current_app.extensions:
-            security_manager = current_app.extensions['security_manager']
-            self._raw_message = security_manager.encrypt_data(value)
-        else:
-            self._raw_message = value
+        self._set_plaintext('raw_message', value)
+    
+    @classmethod
+    def build_many(cls, records):
+        """Create transactions in bulk, encrypting each sensitive column in one batch.
+        
+        Args:
+            records: List of keyword-argument dicts, as accepted by the constructor
+        
+        Returns:
+            List of new Transaction instances
+        """
+        security_manager = _get_security_manager()
+        records = [dict(record) for record in records]
+        
+        if security_manager is not None:
+            for field in cls.ENCRYPTED_FIELDS:
+                plaintexts = [record.pop(field, None) for record in records]
+                ciphertexts = security_manager.encrypt_many(plaintexts, codec='str')
+                for record, plaintext, ciphertext in zip(records, plaintexts, ciphertexts):
+                    record[f'_{field}'] = ciphertext
+                    record.setdefault('_plaintext', {})[field] = plaintext
+                    if field in cls.BLIND_INDEXED_FIELDS:
+                        record[f'{field}_bidx'] = security_manager.blind_index(plaintext, field)
+        
+        transactions = []
+        for record in records:
+            # Keep the plaintexts on the instance; the integrity tree hashes them
+            plaintext = record.pop('_plaintext', {})
+            transaction = cls(**record)
+            transaction.__dict__.setdefault('_plaintext', {}).update(plaintext)
+            transactions.append(transaction)
+        return transactions
+    
+    @classmethod
+    def decrypt_many(cls, transactions, fields=ENCRYPTED_FIELDS):
+        """Decrypt fields of many loaded transactions in one batch per field.
+        
+        The plaintext is cached on each instance so that the properties and
+        to_dict do not decrypt again.
+        """
+        security_manager = _get_security_manager()
+        if security_manager is None:
+            return
+        
+        for field in fields:
+            pending = [txn for txn in transactions
+                       if field not in txn.__dict__.get('_plaintext', {}) and getattr(txn, f'_{field}')]
+            plaintexts = security_manager.decrypt_many(
+                [getattr(txn, f'_{field}') for txn in pending], codec='str')
+            for txn, plaintext in zip(pending, plaintexts):
+                txn.__dict__.setdefault('_plaintext', {})[field] = plaintext
+    
+    def reencrypt_fields(self):
+        """Re-encrypt fields not yet sealed with the primary key.
+        
+        Covers legacy Fernet values and envelopes made with an older key of
+        the keyring. Blind indexes of re-encrypted fields are recomputed and
+        missing ones filled in. The integrity hash covers the ciphertexts, so
+        it is recomputed when one was set.
+        
+        Returns:
+            True if anything was changed
+        """
+        security_manager = _get_security_manager()
+        if security_manager is None:
+            return False
+        
+        changed = False
+        for field in self.ENCRYPTED_FIELDS:
+            if security_manager.needs_reencryption(getattr(self, f'_{field}')):
+                plaintext = self._get_plaintext(field)
+                if plaintext is not None:
+                    self._set_plaintext(field, plaintext)
+                    changed = True
+        
+        for field in self.BLIND_INDEXED_FIELDS:
+            if getattr(self, f'_{field}') and not getattr(self, f'{field}_bidx'):
+                plaintext = self._get_plaintext(field)
+                if plaintext is not None:
+                    setattr(self, f'{field}_bidx', security_manager.blind_index(plaintext, field))
+                    changed = True
+        
+        if changed and self.hash_value:
+            self.calculate_hash()
+        return changed
     
     def update_access_stats(self):
-        """Update access statistics and log the access."""
-        self.last_accessed = datetime.utcnow()
-        self.access_count += 1
-        audit_logger.info(f"TRANSACTION:ACCESS | ID: {self.id} | MTI: {self.mti} | Count: {self.access_count}")
+        """Record an access; counts are written and audited in batches."""
+        get_access_stats().record(Transaction, self.id)
     
     def calculate_hash(self):
         """Calculate a hash of critical transaction fields for integrity verification."""
-        if hasattr(current_app, 'extensions') and 'security_manager' in current_app.extensions:
-            security_manager = current_app.extensions['security_manager']
+        security_manager = _get_security_manager()
+        if security_manager is not None:
             hash_data = f"{self.id}:{self.mti}:{self._amount}:{self.stan}:{self.rrn}:{self._terminal_id}:{self._merchant_id}"
             self.hash_value = security_manager.hash_data(hash_data)
             return self.hash_value
         return None
     
+    def canonical_record(self):
+        """Serialize the transaction's content for the integrity tree.
+        
+        Encrypted fields are included as plaintext, so the form does not
+        change when a row is re-encrypted under a new key. They are
+        normalised as they read back after storage, where an empty value
+        is stored as NULL and every value is decrypted as a string.
+        """
+        encrypted = {field: getattr(self, field) for field in self.ENCRYPTED_FIELDS}
+        encrypted = {field: str(value) if value not in (None, '') else None
+                     for field, value in encrypted.items()}
+        values = [
+            self.id, self.mti, self.processing_code, encrypted['amount'], self.transmission_datetime,
+            self.stan, self.rrn, self.response_code, encrypted['terminal_id'], encrypted['merchant_id'],
+            self.direction, encrypted['raw_message'], self.timestamp.isoformat() if self.timestamp else None
+        ]
+        return json.dumps(values, separators=(',', ':'))
+    
     def verify_integrity(self):
         """Verify the transaction has not been tampered with."""
         if not self.hash_value:
             return False
             
-        if hasattr(current_app, 'extensions') and 'security_manager' in current_app.extensions:
-            security_manager = current_app.extensions['security_manager']
+        security_manager = _get_security_manager()
+        if security_manager is not None:
             hash_data = f"{self.id}:{self.mti}:{self._amount}:{self.stan}:{self.rrn}:{self._terminal_id}:{self._merchant_id}"
             return security_manager.verify_hash(hash_data, self.hash_value)
         return False
@@ -160,28 +294,80 @@ class Transaction(db.Model):
     def __repr__(self):
         return f"<Transaction {self.id}>"
     
-    def to_dict(self):
-        """Convert transaction to dictionary for JSON serialization"""
+    def to_dict(self, fields=None):
+        """Convert transaction to dictionary for JSON serialization
+        
+        Args:
+            fields: API field names to include, in order. Defaults to every
+                field; only the encrypted fields requested are decrypted.
+        """
         # Update access stats when data is accessed
         self.update_access_stats()
         
-        return {
-            'id': self.id,
-            'mti': self.mti,
-            'processingCode': self.processing_code,
-            'amount': self.amount,
-            'transmissionDatetime': self.transmission_datetime,
-            'stan': self.stan,
-            'rrn': self.rrn,
-            'responseCode': self.response_code,
-            'terminalId': self.terminal_id,
-            'merchantId': self.merchant_id,
-            'direction': self.direction,
-            'rawMessage': self.raw_message,
-            'timestamp': self.timestamp.isoformat() if self.timestamp else None,
-            'last_accessed': self.last_accessed.isoformat() if self.last_accessed else None,
-            'access_count': self.access_count
-        }
+        data = {}
+        for name in fields or self.API_FIELDS:
+            value = getattr(self, self.API_FIELDS[name])
+            data[name] = value.isoformat() if isinstance(value, datetime) else value
+        return data
+    
+    @classmethod
+    def select_columns(cls, fields):
+        """Table columns needed to serialize the given API fields.
+        
+        The primary key and timestamp are always included, since keyset
+        cursors are built from them. API attributes are named after their
+        columns, so the column names double as TransactionRow slots.
+        """
+        names = {'id', 'timestamp'} | {cls.API_FIELDS[name] for name in fields}
+        return [cls.__table__.c[name] for name in sorted(names)]
+
+
+class TransactionRow:
+    """Read-only transaction from a Core select, for list views
+    
+    Holds the selected columns in slots, named after the columns, with
+    encrypted ones replaced by their plaintext by decrypt_many. Unlike a
+    Transaction it is not tracked by a session, so thousands can be
+    loaded without identity map, change tracking or descriptor overhead.
+    Columns that were not selected are unset.
+    """
+    __slots__ = tuple(column.name for column in Transaction.__table__.columns)
+    
+    def __init__(self, values):
+        """Args:
+            values: Mapping of column names to values
+        """
+        for name, value in values.items():
+            setattr(self, name, value)
+    
+    @classmethod
+    def from_rows(cls, result):
+        """Build rows from a Core result"""
+        names = list(result.keys())
+        return [cls(dict(zip(names, row))) for row in result]
+    
+    @staticmethod
+    def decrypt_many(rows, fields=Transaction.ENCRYPTED_FIELDS):
+        """Replace the ciphertext of encrypted fields with the plaintext, one batch per field"""
+        security_manager = _get_security_manager()
+        if security_manager is None:
+            return
+        
+        for field in fields:
+            pending = [row for row in rows if getattr(row, field, None)]
+            plaintexts = security_manager.decrypt_many([getattr(row, field) for row in pending], codec='str')
+            for row, plaintext in zip(pending, plaintexts):
+                setattr(row, field, plaintext)
+    
+    def to_dict(self, fields=Transaction.LIST_FIELDS):
+        """Convert the row to a dictionary for JSON serialization, as Transaction.to_dict"""
+        get_access_stats().record(Transaction, self.id)
+        
+        data = {}
+        for name in fields:
+            value = getattr(self, Transaction.API_FIELDS[name])
+            data[name] = value.isoformat() if isinstance(value, datetime) else value
+        return data
 
 
 class SystemStatus(db.Model):
@@ -204,13 +390,11 @@ class SystemStatus(db.Model):
         """Initialize system status with audit logging."""
         super(SystemStatus, self).__init__(**kwargs)
         # Log creation
-        audit_logger.info(f"SYSTEM_STATUS:CREATE | ID: {self.id} | Status: {self.status}")
+        audit_log.emit('SYSTEM_STATUS:CREATE', id=self.id, status=self.status)
     
     def update_access_stats(self):
-        """Update access statistics and log the access."""
-        self.last_accessed = datetime.utcnow()
-        self.access_count += 1
-        audit_logger.info(f"SYSTEM_STATUS:ACCESS | ID: {self.id} | Status: {self.status} | Count: {self.access_count}")
+        """Record an access; counts are written and audited in batches."""
+        get_access_stats().record(SystemStatus, self.id)
     
     def __repr__(self):
         return f"<SystemStatus {self.status}>"
@@ -230,6 +414,49 @@ class SystemStatus(db.Model):
         }
 
 
+class MerkleBucket(db.Model):
+    """
+    Summary of one time bucket of the transaction integrity tree
+    """
+    __tablename__ = 'merkle_bucket'
+    
+    bucket = db.Column(db.String(10), primary_key=True)  # Transaction date, YYYY-MM-DD
+    leaf_count = db.Column(db.Integer, default=0, nullable=False)
+    root = db.Column(db.String(64))
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    # Result of the last verification; a bucket whose root moved since is re-verified
+    verified_root = db.Column(db.String(64), nullable=True)
+    verified_at = db.Column(db.DateTime, nullable=True)
+    verified_ok = db.Column(db.Boolean, nullable=True)
+
+
+class MerkleNode(db.Model):
+    """
+    One node of a bucket's integrity tree
+    
+    Level 0 holds a leaf per transaction in append order; each node above
+    hashes its two children, or carries a lone left child up unchanged.
+    """
+    __tablename__ = 'merkle_node'
+    
+    bucket = db.Column(db.String(10), primary_key=True)
+    level = db.Column(db.Integer, primary_key=True)
+    position = db.Column(db.Integer, primary_key=True)
+    hash = db.Column(db.String(64), nullable=False)
+    transaction_id = db.Column(db.String(50), nullable=True, index=True)  # Leaves only
+
+
+class SchemaMigration(db.Model):
+    """
+    One applied schema migration, see migrations.py
+    """
+    __tablename__ = 'schema_migration'
+    
+    version = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    name = db.Column(db.String(100), nullable=False)
+    applied_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+
 class User(UserMixin, db.Model):
     """
     User model for authentication and access control
@@ -258,14 +485,14 @@ class User(UserMixin, db.Model):
         super(User, self).__init__(**kwargs)
         
         # Log creation
-        audit_logger.info(f"USER:CREATE | ID: {self.id} | Username: {self.username}")
+        audit_log.emit('USER:CREATE', id=self.id, username=self.username)
     
     def set_password(self, password):
         """Generate password hash and update the password_changed_at timestamp"""
         self.password_hash = generate_password_hash(password)
         self.password_changed_at = datetime.utcnow()
         self.failed_login_count = 0  # Reset failed logins when password changes
-        audit_logger.info(f"USER:PASSWORD_CHANGE | ID: {self.id} | Username: {self.username}")
+        audit_log.emit('USER:PASSWORD_CHANGE', id=self.id, username=self.username)
     
     def check_password(self, password):
         """Check password against stored hash"""
@@ -278,7 +505,7 @@ class User(UserMixin, db.Model):
             # Increment failed login count
             self.failed_login_count += 1
             self.last_failed_login = datetime.utcnow()
-            audit_logger.warning(f"USER:FAILED_LOGIN | ID: {self.id} | Username: {self.username} | Count: {self.failed_login_count}")
+            audit_log.emit('USER:FAILED_LOGIN', level='WARNING', id=self.id, username=self.username, count=self.failed_login_count)
         
         return result
     
@@ -286,18 +513,18 @@ class User(UserMixin, db.Model):
         """Update login statistics"""
         self.last_login = datetime.utcnow()
         self.login_count += 1
-        audit_logger.info(f"USER:LOGIN | ID: {self.id} | Username: {self.username} | Count: {self.login_count}")
+        audit_log.emit('USER:LOGIN', id=self.id, username=self.username, count=self.login_count)
     
     def lock_account(self):
         """Lock user account"""
         self.is_active = False
-        audit_logger.warning(f"USER:ACCOUNT_LOCKED | ID: {self.id} | Username: {self.username}")
+        audit_log.emit('USER:ACCOUNT_LOCKED', level='WARNING', id=self.id, username=self.username)
     
     def unlock_account(self):
         """Unlock user account"""
         self.is_active = True
         self.failed_login_count = 0
-        audit_logger.info(f"USER:ACCOUNT_UNLOCKED | ID: {self.id} | Username: {self.username}")
+        audit_log.emit('USER:ACCOUNT_UNLOCKED', id=self.id, username=self.username)
     
     def __repr__(self):
         return f"<User {self.username}>"
@@ -0,0 +1,402 @@
+"""
+Monthly partitions of the SillyPostilion transaction cache.
+
+Recent transactions live in the main database's transaction table. Once a
+month has been over for longer than the hot window, a background worker
+seals it: its rows are copied in batches into a SQLite file of their own,
+with the same schema, and removed from the main table, whose free pages
+are then reused by new months. Queries are routed to the main table and to
+the partition files whose month overlaps the requested range.
+
+Retention works on whole partitions, so purging a month is a file unlink
+rather than a DELETE per row. Older partitions are handed on to the
+compressed archive (see archive.py). Partitioning is only available when the cache
+itself is SQLite; on other databases every row stays in the main table.
+
+Partition files are opened read-only except while being sealed or
+re-encrypted, so a month purged under a reader is not recreated as an
+empty file. Sealing, archiving and retention run in one gunicorn worker
+only, the one holding the partitions lock file; if it exits, another
+worker takes the lock over on its next pass.
+"""
+
+import os
+import re
+import fcntl
+import logging
+import datetime
+import threading
+from contextlib import contextmanager
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from sqlalchemy import create_engine, select, insert, delete, func
+from sqlalchemy.orm import Session
+
+from admin import CONFIG_DIR
+from audit import get_audit_log
+
+# Configure logger
+logger = logging.getLogger('partitions')
+
+# Held by the one process that seals, archives and purges
+LOCK_FILE = os.path.join(CONFIG_DIR, 'partitions.lock')
+
+PARTITION_FILE_PATTERN = re.compile(r'^transactions-(\d{4}-\d{2})\.db$')
+
+
+def month_of(timestamp: datetime.datetime) -> str:
+    """Partition month a timestamp belongs to, as YYYY-MM"""
+    return timestamp.strftime('%Y-%m')
+
+
+def month_range(month: str) -> Tuple[datetime.datetime, datetime.datetime]:
+    """First instant of a month and of the month after it"""
+    start = datetime.datetime.strptime(month, '%Y-%m')
+    end = (start + datetime.timedelta(days=32)).replace(day=1)
+    return start, end
+
+
+class TransactionPartitions:
+    """Seals closed months into partition files and routes queries to them"""
+
+    def __init__(self, app=None, hot_days: int = 8, batch_size: int = 1000,
+                 check_interval: int = 3600):
+        """Initialize the partition manager
+
+        Args:
+            app: Flask application to bind to
+            hot_days: Days after its end that a month stays in the main
+                table; longer than the metrics window, so metrics never
+                need a partition
+            batch_size: Rows moved per transaction while sealing
+            check_interval: Seconds between seal and retention passes
+        """
+        self.app = None
+        self.directory: Optional[str] = None
+        self.enabled = False
+        self.hot_days = hot_days
+        self.batch_size = batch_size
+        self.check_interval = check_interval
+        self.maintainer = False
+        self._engines: Dict[str, object] = {}
+        self._thread: Optional[threading.Thread] = None
+        self._stop_event = threading.Event()
+        self._lock = threading.Lock()
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Bind the partition manager to the Flask app.
+
+        The seal and retention worker is started lazily on the first
+        request.
+        """
+        self.app = app
+        self.directory = app.config.get('PARTITION_DIR', os.path.join(app.instance_path, 'partitions'))
+        self.hot_days = app.config.get('PARTITION_HOT_DAYS', self.hot_days)
+        self.enabled = app.config.get('PARTITIONS_ENABLED', True) \
+            and app.config['SQLALCHEMY_DATABASE_URI'].startswith('sqlite')
+        app.extensions['partitions'] = self
+
+        if app.config.get('PARTITIONS_ENABLED', True) and not self.enabled:
+            logger.info("Transaction partitioning is disabled: the cache database is not SQLite")
+        if self.enabled:
+            os.makedirs(self.directory, exist_ok=True)
+            app.before_request(self.start)
+
+    @property
+    def running(self) -> bool:
+        """Whether the worker thread is alive"""
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self) -> None:
+        """Start the worker thread if it is not already running"""
+        if self.running:
+            return
+
+        with self._lock:
+            if self.running:
+                return
+
+            self._stop_event.clear()
+            self._thread = threading.Thread(target=self._run, name='partitions', daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout: Optional[float] = None) -> None:
+        """Signal the worker thread to stop and wait for it"""
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def after_fork(self) -> None:
+        """Drop the parent's partition engines and worker thread in a forked worker
+
+        Pooled connections are left open for the parent rather than closed.
+        """
+        for engine in self._engines.values():
+            engine.dispose(close=False)
+        self._engines = {}
+        self.maintainer = False
+        self._thread = None
+        self._stop_event = threading.Event()
+        self._lock = threading.Lock()
+
+    def _run(self) -> None:
+        """Worker loop: while holding the lock, seal closed months, archive aged ones and apply retention"""
+        from admin import get_admin_module
+        from archive import get_transaction_archive
+
+        os.makedirs(CONFIG_DIR, exist_ok=True)
+        lock_file = open(LOCK_FILE, 'w')
+        try:
+            while not self._stop_event.is_set():
+                if not self.maintainer and self._try_lock(lock_file):
+                    self.maintainer = True
+                    logger.info(f"Partition maintenance running in process {os.getpid()}")
+
+                if self.maintainer:
+                    try:
+                        with self.app.app_context():
+                            settings = get_admin_module().get_settings()
+                            self.seal_closed_months()
+                            self.purge_expired(settings.transaction_retention_days)
+                            get_transaction_archive().archive_aged(settings.archive_after_days)
+                            get_transaction_archive().purge_expired(settings.transaction_retention_days)
+                    except Exception as e:
+                        logger.error(f"Partition maintenance failed: {str(e)}")
+                self._stop_event.wait(self.check_interval)
+        finally:
+            # Closing the file releases the lock for another worker
+            lock_file.close()
+            self.maintainer = False
+
+    @staticmethod
+    def _try_lock(lock_file) -> bool:
+        """Take the cross-process maintenance lock without blocking"""
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return True
+        except OSError:
+            return False
+
+    def path_for(self, month: str) -> str:
+        """File holding one month's partition"""
+        return os.path.join(self.directory, f"transactions-{month}.db")
+
+    def months(self) -> List[str]:
+        """Sealed months, newest first"""
+        if not self.enabled or not os.path.isdir(self.directory):
+            return []
+        months = [match.group(1) for match in map(PARTITION_FILE_PATTERN.match, os.listdir(self.directory)) if match]
+        return sorted(months, reverse=True)
+
+    def months_overlapping(self, start: Optional[datetime.datetime] = None,
+                           end: Optional[datetime.datetime] = None) -> List[str]:
+        """Sealed months with any instant in [start, end), newest first"""
+        overlapping = []
+        for month in self.months():
+            month_start, month_end = month_range(month)
+            if (start is None or month_end > start) and (end is None or month_start < end):
+                overlapping.append(month)
+        return overlapping
+
+    def _engine(self, month: str, mode: str = 'ro'):
+        """Return the cached engine of a partition file
+
+        Args:
+            month: Partition month
+            mode: SQLite open mode: 'ro' to read, 'rw' to write an existing
+                file, 'rwc' to create it if missing
+        """
+        with self._lock:
+            engine = self._engines.get((month, mode))
+            if engine is None:
+                engine = create_engine(f"sqlite:///file:{self.path_for(month)}?mode={mode}&uri=true")
+                self._engines[(month, mode)] = engine
+            return engine
+
+    @contextmanager
+    def sessions(self, months: Iterable[str], write: bool = False) -> Iterator[List[Tuple[str, Session]]]:
+        """Open sessions on partition files
+
+        ORM objects loaded through them are only usable inside the block.
+        Months whose file has been purged in the meantime are left out.
+
+        Args:
+            months: Partition months to open
+            write: Open the files for writing rather than read-only
+
+        Yields:
+            List of (month, session) pairs in the order given
+        """
+        opened = []
+        try:
+            for month in months:
+                if not os.path.exists(self.path_for(month)):
+                    continue
+                opened.append((month, Session(bind=self._engine(month, 'rw' if write else 'ro'))))
+            yield opened
+        finally:
+            for _, session in opened:
+                session.close()
+
+    def hot_cutoff(self, now: Optional[datetime.datetime] = None) -> datetime.datetime:
+        """Months ending before this instant are sealed"""
+        now = now or datetime.datetime.utcnow()
+        return now - datetime.timedelta(days=self.hot_days)
+
+    def seal_closed_months(self) -> List[str]:
+        """Move every month past the hot window out of the main table
+
+        Must be called inside an application context.
+
+        Returns:
+            Months that had rows moved
+        """
+        from models import db, Transaction
+
+        if not self.enabled:
+            return []
+
+        table = Transaction.__table__
+        cutoff = self.hot_cutoff()
+        oldest = db.session.query(func.min(table.c.timestamp)).scalar()
+        sealed = []
+        while oldest is not None:
+            month = month_of(oldest)
+            start, end = month_range(month)
+            if end > cutoff:
+                break
+            moved = self.seal_month(month)
+            if moved:
+                sealed.append(month)
+            oldest = db.session.query(func.min(table.c.timestamp)).filter(table.c.timestamp >= end).scalar()
+        return sealed
+
+    def seal_month(self, month: str) -> int:
+        """Copy one month's rows into its partition file and remove them from the main table
+
+        Rows are moved in batches, each copied and committed to the
+        partition before it is deleted from the main table, so an
+        interrupted seal is completed by the next one. Rows that arrive
+        late for a sealed month are moved the same way.
+
+        Returns:
+            Number of rows moved
+        """
+        from models import db, Transaction
+
+        table = Transaction.__table__
+        start, end = month_range(month)
+        engine = self._engine(month, 'rwc')
+        table.create(engine, checkfirst=True)
+
+        moved = 0
+        while True:
+            rows = db.session.execute(
+                select(table)
+                .where(table.c.timestamp >= start, table.c.timestamp < end)
+                .order_by(table.c.timestamp, table.c.id)
+                .limit(self.batch_size)
+            ).mappings().all()
+            if not rows:
+                break
+
+            # A row can already be in the partition if a previous seal was
+            # interrupted between the copy and the delete
+            with engine.begin() as connection:
+                connection.execute(insert(table).prefix_with('OR IGNORE'), [dict(row) for row in rows])
+            try:
+                db.session.execute(delete(table).where(table.c.id.in_([row['id'] for row in rows])))
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                raise
+            moved += len(rows)
+
+        if moved:
+            logger.info(f"Sealed {moved} transactions into partition {month}")
+            get_audit_log().emit('PARTITION:SEAL', month=month, transactions=moved)
+        return moved
+
+    def purge_expired(self, retention_days: int) -> List[str]:
+        """Delete partitions whose whole month is older than the retention period
+
+        Must be called inside an application context. The integrity tree
+        buckets of purged days are dropped with them.
+
+        Returns:
+            Months purged
+        """
+        from integrity import get_integrity_tree
+
+        if not self.enabled:
+            return []
+
+        cutoff = datetime.datetime.utcnow() - datetime.timedelta(days=max(retention_days, self.hot_days))
+        purged = []
+        for month in self.months():
+            start, end = month_range(month)
+            if end > cutoff:
+                continue
+
+            self.remove(month)
+            get_integrity_tree().drop_buckets(start, end)
+
+            purged.append(month)
+            logger.info(f"Purged transaction partition {month}")
+            get_audit_log().emit('PARTITION:PURGE', month=month, retention_days=retention_days)
+        return purged
+
+    def remove(self, month: str) -> None:
+        """Close and delete one month's partition file"""
+        with self._lock:
+            engines = [self._engines.pop(key) for key in list(self._engines) if key[0] == month]
+        for engine in engines:
+            engine.dispose()
+        try:
+            os.remove(self.path_for(month))
+        except FileNotFoundError:
+            pass
+
+    def existing_ids(self, ids_by_month: Dict[str, List[str]]) -> set:
+        """IDs among the given ones already sealed into their month's partition"""
+        from models import Transaction
+
+        sealed = set(self.months())
+        found = set()
+        with self.sessions([month for month in ids_by_month if month in sealed]) as sessions:
+            for month, session in sessions:
+                found.update(row[0] for row in session.query(Transaction.id)
+                             .filter(Transaction.id.in_(ids_by_month[month])))
+        return found
+
+    def newest_timestamp(self) -> Optional[datetime.datetime]:
+        """Timestamp of the newest sealed transaction"""
+        from models import Transaction
+
+        with self.sessions(self.months()[:1]) as sessions:
+            for _, session in sessions:
+                return session.query(func.max(Transaction.timestamp)).scalar()
+        return None
+
+    def get_stats(self) -> List[Dict[str, object]]:
+        """Return the size of every partition, newest first"""
+        stats = []
+        for month in self.months():
+            try:
+                stats.append({'month': month, 'bytes': os.path.getsize(self.path_for(month))})
+            except FileNotFoundError:
+                continue
+        return stats
+
+
+# Create an instance of the partition manager
+transaction_partitions = TransactionPartitions()
+
+
+def get_transaction_partitions() -> TransactionPartitions:
+    """Return the partition manager instance"""
+    return transaction_partitions
@@ -0,0 +1,212 @@
+"""
+HTTP client for the transaction processor API.
+
+Provides a shared, pooled requests.Session configured from the admin
+settings, guarded by a circuit breaker so that an unavailable processor
+fails fast instead of tying up callers for the full request timeout.
+"""
+
+import time
+import logging
+import threading
+from enum import Enum
+from typing import Optional, Tuple, Any
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from admin import get_admin_module
+from metrics import get_request_metrics
+
+# Configure logger
+logger = logging.getLogger('processor_client')
+
+
+class CircuitState(str, Enum):
+    """States of the circuit breaker"""
+    CLOSED = "closed"          # Requests flow normally
+    OPEN = "open"              # Requests are rejected without being sent
+    HALF_OPEN = "half_open"    # A single probe request is allowed through
+
+
+class CircuitOpenError(Exception):
+    """Raised when a request is rejected because the circuit is open"""
+    pass
+
+
+class CircuitBreaker:
+    """Consecutive-failure circuit breaker with half-open probing"""
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30):
+        """Initialize the circuit breaker
+
+        Args:
+            failure_threshold: Consecutive failures before the circuit opens
+            reset_timeout: Seconds to wait before allowing a probe request
+        """
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self._state = CircuitState.CLOSED
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> CircuitState:
+        """Current state, moving from open to half-open once the timeout expires"""
+        with self._lock:
+            if self._state == CircuitState.OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+                self._state = CircuitState.HALF_OPEN
+                self._probe_in_flight = False
+            return self._state
+
+    def allow_request(self) -> bool:
+        """Return True if a request may be sent now"""
+        state = self.state
+        if state == CircuitState.CLOSED:
+            return True
+        if state == CircuitState.OPEN:
+            return False
+
+        # Half-open: let exactly one probe through
+        with self._lock:
+            if self._probe_in_flight:
+                return False
+            self._probe_in_flight = True
+            return True
+
+    def record_success(self) -> None:
+        """Close the circuit after a successful request"""
+        with self._lock:
+            if self._state != CircuitState.CLOSED:
+                logger.info("Circuit closed: transaction processor is reachable again")
+            self._state = CircuitState.CLOSED
+            self.failures = 0
+            self._probe_in_flight = False
+
+    def record_failure(self) -> None:
+        """Count a failure, opening the circuit when the threshold is reached"""
+        with self._lock:
+            self.failures += 1
+            self._probe_in_flight = False
+
+            if self._state == CircuitState.HALF_OPEN or self.failures >= self.failure_threshold:
+                if self._state != CircuitState.OPEN:
+                    logger.warning(f"Circuit opened after {self.failures} consecutive failures")
+                self._state = CircuitState.OPEN
+                self._opened_at = time.monotonic()
+
+
+class ProcessorClient:
+    """Pooled HTTP client for the transaction processor API"""
+
+    def __init__(self):
+        """Initialize the client; the session is built on first use"""
+        self.breaker = CircuitBreaker()
+        self._session: Optional[requests.Session] = None
+        self._config: Optional[Tuple] = None
+        self._lock = threading.Lock()
+
+    def _current_config(self) -> Tuple[str, int, int, int, int]:
+        """Read the connection configuration from the admin settings"""
+        settings = get_admin_module().get_settings()
+        return (
+            settings.transaction_processor_url.rstrip('/'),
+            settings.processor_timeout,
+            settings.processor_pool_size,
+            settings.circuit_failure_threshold,
+            settings.circuit_reset_seconds,
+        )
+
+    def _get_session(self) -> Tuple[requests.Session, str, int]:
+        """Return the shared session, rebuilding it if the settings changed
+
+        Returns:
+            Tuple of (session, API base URL, timeout in seconds)
+        """
+        config = self._current_config()
+
+        with self._lock:
+            if self._session is None or config != self._config:
+                base_url, timeout, pool_size, failure_threshold, reset_seconds = config
+
+                if self._session is not None:
+                    self._session.close()
+
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0)
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                session.headers['Accept'] = 'application/json'
+
+                self.breaker.failure_threshold = failure_threshold
+                self.breaker.reset_timeout = reset_seconds
+
+                self._session = session
+                self._config = config
+                logger.info(f"Processor client configured for {base_url} (pool size {pool_size})")
+
+            return self._session, f"{self._config[0]}/api", self._config[1]
+
+    def get(self, path: str, **kwargs) -> requests.Response:
+        """Send a GET request to a processor API path
+
+        Args:
+            path: Path relative to the API root, e.g. "/status"
+            **kwargs: Extra arguments passed to requests
+
+        Raises:
+            CircuitOpenError: If the circuit breaker rejects the request
+            requests.RequestException: If the request fails
+        """
+        # Built before asking the breaker, so a failure here cannot leave a half-open probe outstanding
+        session, api_url, timeout = self._get_session()
+        kwargs.setdefault('timeout', timeout)
+
+        if not self.breaker.allow_request():
+            raise CircuitOpenError("Transaction processor circuit is open")
+
+        started = time.perf_counter()
+        try:
+            response = session.get(f"{api_url}{path}", **kwargs)
+        except requests.RequestException:
+            self.breaker.record_failure()
+            raise
+        finally:
+            get_request_metrics().observe_upstream(path, time.perf_counter() - started)
+
+        if response.status_code >= 500:
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+
+        return response
+
+    def after_fork(self) -> None:
+        """Abandon the parent's pooled connections in a forked worker
+
+        The session is dropped rather than closed, since its sockets are
+        still the parent's; the worker builds its own on first use.
+        """
+        self._session = None
+        self._config = None
+        self._lock = threading.Lock()
+        self.breaker._lock = threading.Lock()
+
+    def close(self) -> None:
+        """Close the pooled session"""
+        with self._lock:
+            if self._session is not None:
+                self._session.close()
+                self._session = None
+                self._config = None
+
+
+# Create an instance of the processor client
+processor_client = ProcessorClient()
+
+
+def get_processor_client() -> ProcessorClient:
+    """Return the processor client instance"""
+    return processor_client
@@ -0,0 +1,240 @@
+"""
+SQL query profiler for the SillyPostilion web portal.
+
+When enabled in the admin settings, every statement is timed through
+SQLAlchemy engine events and grouped by its normalized SQL template per
+unit of work: a request, named after its endpoint, or a background job
+such as the processor sync cycle. A unit that runs the same template
+more than the configured number of times is reported as a likely N+1
+pattern, the usual sign of a per-row query in a loop. Statements slower
+than the configured threshold are logged with their query plan.
+
+Findings are kept in memory per process and shown on the admin Queries
+page. Parameters are never recorded, as they may contain card data.
+"""
+
+import re
+import time
+import logging
+import datetime
+import threading
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional, Tuple
+
+from flask import request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from admin import get_admin_module
+
+# Configure logger
+logger = logging.getLogger('query_profiler')
+
+# Findings kept for the admin page
+MAX_FINDINGS = 50
+
+# Distinct (unit, template) pairs summarized; further ones are not tracked
+MAX_TEMPLATES = 500
+
+_WHITESPACE = re.compile(r'\s+')
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_LITERAL = re.compile(r'\b\d+(?:\.\d+)?\b')
+_PLACEHOLDER = re.compile(r'%\(\w+\)s|%s')
+_PLACEHOLDER_LIST = re.compile(r'\(\s*\?(?:\s*,\s*\?)+\s*\)')
+
+
+def normalize_sql(statement: str) -> str:
+    """Reduce a statement to its template
+
+    Literals and bound parameters become ?, and IN lists and VALUES
+    tuples of any length become a single (?, ...), so a query run once
+    per row in a loop maps to one template.
+    """
+    sql = _WHITESPACE.sub(' ', statement).strip()
+    sql = _STRING_LITERAL.sub('?', sql)
+    sql = _PLACEHOLDER.sub('?', sql)
+    sql = _NUMBER_LITERAL.sub('?', sql)
+    return _PLACEHOLDER_LIST.sub('(?, ...)', sql)
+
+
+class QueryProfiler:
+    """Times SQL statements and reports N+1 patterns and slow queries"""
+
+    def __init__(self, app=None):
+        """Initialize the profiler
+
+        Args:
+            app: Flask application to bind to
+        """
+        self.app = None
+        self.enabled = False
+        self.repeat_threshold = 10
+        self.slow_query_seconds = 0.2
+        self._settings_version = None
+        self._units = threading.local()
+        self._summary: Dict[Tuple[str, str], Dict[str, Any]] = {}
+        self.repeated: deque = deque(maxlen=MAX_FINDINGS)
+        self.slow: deque = deque(maxlen=MAX_FINDINGS)
+        self._lock = threading.Lock()
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Bind the profiler to the Flask app."""
+        self.app = app
+        app.extensions['query_profiler'] = self
+
+        app.before_request(self._start_request)
+        app.teardown_request(self._finish_request)
+
+        if not event.contains(Engine, 'before_cursor_execute', self._before_cursor_execute):
+            event.listen(Engine, 'before_cursor_execute', self._before_cursor_execute)
+            event.listen(Engine, 'after_cursor_execute', self._after_cursor_execute)
+
+    def after_fork(self) -> None:
+        """Replace the lock and drop the master's findings in a forked worker"""
+        self._lock = threading.Lock()
+        self._units = threading.local()
+        self.reset()
+
+    def apply_settings(self) -> None:
+        """Configure the profiler from the admin settings when they change"""
+        settings = get_admin_module().get_settings()
+        if settings.updated_at == self._settings_version:
+            return
+
+        self.enabled = settings.query_profiler_enabled
+        self.repeat_threshold = max(2, settings.query_repeat_threshold)
+        self.slow_query_seconds = max(1, settings.slow_query_ms) / 1000
+        self._settings_version = settings.updated_at
+
+    def reset(self) -> None:
+        """Discard the summary and findings"""
+        with self._lock:
+            self._summary = {}
+            self.repeated.clear()
+            self.slow.clear()
+
+    def start_unit(self, name: str) -> None:
+        """Start profiling a unit of work on this thread"""
+        self.apply_settings()
+        self._units.current = {'name': name, 'templates': {}} if self.enabled else None
+
+    def finish_unit(self) -> None:
+        """Summarize the unit of work running on this thread"""
+        unit = getattr(self._units, 'current', None)
+        self._units.current = None
+        if not unit or not unit['templates']:
+            return
+
+        name = unit['name']
+        with self._lock:
+            for template, (count, seconds) in unit['templates'].items():
+                key = (name, template)
+                stats = self._summary.get(key)
+                if stats is None:
+                    if len(self._summary) >= MAX_TEMPLATES:
+                        continue
+                    stats = self._summary[key] = {'unit': name, 'sql': template, 'units': 0,
+                                                  'count': 0, 'seconds': 0.0, 'maxPerUnit': 0}
+                stats['units'] += 1
+                stats['count'] += count
+                stats['seconds'] += seconds
+                stats['maxPerUnit'] = max(stats['maxPerUnit'], count)
+
+                if count > self.repeat_threshold:
+                    self.repeated.appendleft({
+                        'at': datetime.datetime.now(), 'unit': name, 'sql': template,
+                        'count': count, 'ms': round(seconds * 1000, 1)
+                    })
+                    logger.warning(f"{name} ran the same statement {count} times "
+                                   f"({seconds * 1000:.1f} ms): {template}")
+
+    @contextmanager
+    def profile(self, name: str):
+        """Profile a unit of work outside a request, e.g. a background job
+
+        Args:
+            name: Name the unit's statements are grouped under
+        """
+        self.start_unit(name)
+        try:
+            yield
+        finally:
+            self.finish_unit()
+
+    def _start_request(self) -> None:
+        self.start_unit(request.endpoint or 'unmatched')
+
+    def _finish_request(self, exception=None) -> None:
+        self.finish_unit()
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        if self.enabled:
+            context._profiler_started = time.perf_counter()
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        started = getattr(context, '_profiler_started', None)
+        if started is None:
+            return
+        seconds = time.perf_counter() - started
+
+        unit = getattr(self._units, 'current', None)
+        template = normalize_sql(statement)
+        if unit is not None:
+            count, total = unit['templates'].get(template, (0, 0.0))
+            unit['templates'][template] = (count + 1, total + seconds)
+
+        if seconds >= self.slow_query_seconds:
+            plan = None if executemany else self._explain(conn, statement, parameters)
+            name = unit['name'] if unit is not None else 'background'
+            with self._lock:
+                self.slow.appendleft({
+                    'at': datetime.datetime.now(), 'unit': name, 'sql': template,
+                    'ms': round(seconds * 1000, 1), 'plan': plan
+                })
+            logger.warning(f"Slow query in {name} ({seconds * 1000:.1f} ms): {template}")
+
+    @staticmethod
+    def _explain(conn, statement: str, parameters) -> Optional[List[str]]:
+        """Query plan of a read statement, or None
+
+        Runs on a separate DBAPI cursor of the same connection so the
+        caller's cursor and result are untouched. EXPLAIN without ANALYZE
+        does not run the statement.
+        """
+        if not statement.lstrip().upper().startswith(('SELECT', 'WITH')):
+            return None
+
+        prefix = 'EXPLAIN QUERY PLAN ' if conn.dialect.name == 'sqlite' else 'EXPLAIN '
+        try:
+            cursor = conn.connection.cursor()
+            try:
+                cursor.execute(prefix + statement, parameters)
+                return [' '.join(str(value) for value in row) for row in cursor.fetchall()]
+            finally:
+                cursor.close()
+        except Exception as e:
+            logger.debug(f"Could not explain slow query: {str(e)}")
+            return None
+
+    def get_summary(self, limit: int = 50) -> List[Dict[str, Any]]:
+        """Statement templates by total time, most expensive first"""
+        with self._lock:
+            rows = [dict(stats) for stats in self._summary.values()]
+        rows.sort(key=lambda stats: stats['seconds'], reverse=True)
+        for stats in rows:
+            stats['ms'] = round(stats['seconds'] * 1000, 1)
+            stats['avgPerUnit'] = round(stats['count'] / stats['units'], 1)
+        return rows[:limit]
+
+
+# Create an instance of the query profiler
+query_profiler = QueryProfiler()
+
+
+def get_query_profiler() -> QueryProfiler:
+    """Return the query profiler instance"""
+    return query_profiler
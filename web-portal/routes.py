@@ -1,15 +1,51 @@
-import requests
+import json
+import base64
+import hashlib
 import logging
-from datetime import datetime
-from flask import render_template, jsonify, request, redirect, url_for
+from datetime import datetime, timedelta, timezone
+from flask import render_template, jsonify, request, redirect, url_for, Response, stream_with_context
 from flask_login import login_required, current_user
-from models import Transaction, SystemStatus, db
+from sqlalchemy import func, or_, and_, select
+from sqlalchemy.orm import undefer
+from models import Transaction, TransactionRow, SystemStatus, db
+from caching import TTLCache
+from access_stats import get_access_stats
+from sync import get_processor_sync
+from stream import get_update_broadcaster
+from security import get_security_manager
+from integrity import get_integrity_tree
+from partitions import get_transaction_partitions, month_of, month_range
+from archive import get_transaction_archive
 
 # Configure logging
 logger = logging.getLogger(__name__)
 
-# Transaction processor API endpoint
-TRANSACTION_PROCESSOR_API = "http://localhost:8000/api"
+# Longest window accepted by /api/metrics
+MAX_METRICS_HOURS = 168
+
+# Page sizes for /api/transactions; no request can pull the whole table
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+# Decoded detail payloads, kept briefly so repeated clicks on the same
+# transaction do not repeat the database read and decryption
+transaction_detail_cache = TTLCache(maxsize=256, ttl=30)
+
+# Relative date filters, in days back from the start of today
+DATE_RANGES = {
+    'today': (0, None),
+    'yesterday': (1, 0),
+    'week': (6, None),
+    'month': (29, None)
+}
+
+# Message classes keyed by the first two MTI digits
+MTI_CLASSES = {
+    '01': 'auth',
+    '02': 'financial',
+    '04': 'reversal',
+    '08': 'network'
+}
 
 def register_routes(app):
     """Register all routes with the Flask app"""
@@ -41,122 +77,238 @@ def register_routes(app):
     @app.route('/api/transactions')
     @login_required
     def get_transactions():
-        """Get transaction data from the transaction processor"""
-        limit = request.args.get('limit', 50, type=int)
+        """Get a filtered page of transactions from the local cache"""
+        limit = min(max(request.args.get('limit', DEFAULT_PAGE_SIZE, type=int), 1), MAX_PAGE_SIZE)
+        cursor = request.args.get('cursor') or None
+        filters = {
+            key: request.args.get(key, '').strip()
+            for key in ('mti', 'response', 'date', 'search')
+            if request.args.get(key, '').strip()
+        }
         
         try:
-            # Attempt to fetch from transaction processor
-            response = requests.get(f"{TRANSACTION_PROCESSOR_API}/transactions?limit={limit}", timeout=5)
-            
-            if response.status_code == 200:
-                transactions = response.json()
-                
-                # Update the local cache
-                update_transaction_cache(transactions)
-                
-                return jsonify(transactions)
-            else:
-                logger.warning(f"Failed to get transactions from processor: {response.status_code}")
-                # Fall back to cached data
-                cached_transactions = get_cached_transactions(limit)
-                return jsonify(cached_transactions)
+            fields = parse_fields(request.args.get('fields', '').strip())
+            cached_transactions, next_cursor = get_cached_transactions(limit, filters, cursor, fields)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
         
-        except Exception as e:
-            logger.error(f"Error fetching transactions: {str(e)}")
-            # Fall back to cached data
-            cached_transactions = get_cached_transactions(limit)
-            return jsonify(cached_transactions)
+        metadata = {
+            'limit': limit,
+            'count': len(cached_transactions),
+            'cursor': cursor,
+            'nextCursor': next_cursor,
+            'hasMore': next_cursor is not None,
+            'filters': filters,
+            'fields': list(fields)
+        }
+        
+        # Cached rows never change once written, so the page is identified
+        # by its IDs; per-row access statistics are left out of the ETag
+        return conditional_json(
+            {'transactions': cached_transactions, 'metadata': metadata},
+            'transactions',
+            etag_data=[[txn['id'] for txn in cached_transactions], metadata]
+        )
+    
+    @app.route('/api/transactions/<transaction_id>')
+    @login_required
+    def get_transaction(transaction_id):
+        """Get a single cached transaction, including its raw message"""
+        transaction = get_cached_transaction(transaction_id)
+        if transaction is None:
+            return jsonify({'error': 'Transaction not found'}), 404
+        
+        # Cached rows never change once written
+        return conditional_json(transaction, 'transactions', etag_data=transaction_id)
     
     @app.route('/api/status')
     @login_required
     def get_status():
-        """Get system status from the transaction processor"""
-        try:
-            # Attempt to fetch from transaction processor
-            response = requests.get(f"{TRANSACTION_PROCESSOR_API}/status", timeout=5)
-            
-            if response.status_code == 200:
-                status_data = response.json()
-                
-                # Update the local cache
-                update_status_cache(status_data)
-                
-                return jsonify(status_data)
-            else:
-                logger.warning(f"Failed to get status from processor: {response.status_code}")
-                # Fall back to cached data
-                cached_status = get_cached_status()
-                return jsonify(cached_status)
+        """Get system status from the local cache"""
+        freshness = get_processor_sync().freshness('status')
         
-        except Exception as e:
-            logger.error(f"Error fetching system status: {str(e)}")
-            # Fall back to cached data
-            cached_status = get_cached_status()
-            return jsonify(cached_status)
+        cached_status = get_cached_status()
+        cached_status['stale'] = freshness['stale']
+        cached_status['syncedAt'] = freshness['syncedAt']
+        cached_status['offlineMode'] = freshness['offlineMode']
+        cached_status['processorCircuit'] = freshness['circuit']
+        
+        # syncedAt and the access counter advance without the status itself
+        # changing; both are still sent in the body
+        stable = {key: value for key, value in cached_status.items() if key not in ('syncedAt', 'access_count')}
+        return conditional_json(cached_status, 'status', etag_data=stable)
     
     @app.route('/api/stats')
     @login_required
     def get_stats():
-        """Get transaction statistics from the transaction processor"""
-        try:
-            # Attempt to fetch from transaction processor
-            response = requests.get(f"{TRANSACTION_PROCESSOR_API}/stats", timeout=5)
-            
-            if response.status_code == 200:
-                stats_data = response.json()
-                return jsonify(stats_data)
-            else:
-                logger.warning(f"Failed to get stats from processor: {response.status_code}")
-                # Return empty stats
-                return jsonify({})
+        """Get the transaction statistics last synced from the processor"""
+        stats_data = get_processor_sync().get_stats()
+        return conditional_json(stats_data, 'stats')
+
+
+    @app.route('/api/metrics')
+    @login_required
+    def get_metrics():
+        """Get pre-aggregated transaction counts for the system status page"""
+        hours = min(max(request.args.get('hours', 24, type=int), 1), MAX_METRICS_HOURS)
         
-        except Exception as e:
-            logger.error(f"Error fetching transaction stats: {str(e)}")
-            # Return empty stats
-            return jsonify({})
+        metrics = get_transaction_metrics(hours)
+        # The window start moves with the clock; the counts identify the data
+        stable = {key: value for key, value in metrics.items() if key != 'since'}
+        return conditional_json(metrics, 'transactions', etag_data=stable)
+    
+    @app.route('/api/stream')
+    @login_required
+    def stream_updates():
+        """Push status, transaction and statistics updates as Server-Sent Events"""
+        broadcaster = get_update_broadcaster()
+        if not broadcaster.has_capacity:
+            # Every stream holds a worker thread; the client polls instead
+            response = jsonify({'error': 'Too many live update streams, poll the API instead'})
+            response.status_code = 503
+            response.headers['Retry-After'] = str(broadcaster.max_connection_seconds)
+            return response
+        
+        return Response(
+            stream_with_context(broadcaster.stream()),
+            mimetype='text/event-stream',
+            headers={
+                'Cache-Control': 'no-cache',
+                'X-Accel-Buffering': 'no'
+            }
+        )
+
+
+def conditional_json(payload, resource, etag_data=None):
+    """Build a JSON response that revalidates with a weak ETag
+    
+    Args:
+        payload: Data to serialize
+        resource: Cached resource name used for the freshness headers
+        etag_data: Data the ETag is computed from, when the payload carries
+            fields that change without the underlying data changing.
+            Defaults to the payload itself.
+    
+    Returns:
+        The response, or an empty 304 if the client's copy is current
+    """
+    response = jsonify(payload)
+    
+    if etag_data is None:
+        etag_data = payload
+    digest = hashlib.sha1(json.dumps(etag_data, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+    
+    response.set_etag(digest, weak=True)
+    response.headers['Cache-Control'] = 'no-cache'
+    add_freshness_headers(response, resource)
+    return response.make_conditional(request)
+
+
+def add_freshness_headers(response, resource):
+    """Tell the client how old the cached copy of a resource is"""
+    freshness = get_processor_sync().freshness(resource)
+    
+    response.headers['X-Cache-Stale'] = 'true' if freshness['stale'] else 'false'
+    if freshness['syncedAt']:
+        response.headers['X-Cache-Synced-At'] = freshness['syncedAt']
+    if freshness['ageSeconds'] is not None:
+        response.headers['X-Cache-Age'] = str(freshness['ageSeconds'])
+    if freshness['offlineMode']:
+        response.headers['X-Cache-Offline'] = 'true'
+    return response
 
 
 def update_transaction_cache(transactions):
-    """Update the local cache with transaction data from the processor"""
+    """Update the local cache with transaction data from the processor
+    
+    Returns:
+        List of the processor records that were not cached before
+    
+    Raises:
+        Exception: If the batch could not be committed; the session is
+            rolled back, and the caller must fetch the batch again
+    """
+    added = []
     try:
+        # Look up which of the incoming IDs are already cached in one query
+        incoming_ids = [txn_data.get('id') for txn_data in transactions if txn_data.get('id')]
+        known_ids = set()
+        if incoming_ids:
+            known_ids = {
+                row[0] for row in
+                db.session.query(Transaction.id).filter(Transaction.id.in_(incoming_ids)).all()
+            }
+        
+        records = []
         for txn_data in transactions:
-            # Check if transaction exists in cache
-            txn = Transaction.query.get(txn_data.get('id'))
+            txn_id = txn_data.get('id')
             
-            if txn is None:
-                # Create new transaction in cache
-                txn = Transaction(
-                    id=txn_data.get('id'),
-                    mti=txn_data.get('mti'),
-                    processing_code=txn_data.get('processingCode'),
-                    amount=txn_data.get('amount'),
-                    transmission_datetime=txn_data.get('transmissionDateTime'),
-                    stan=txn_data.get('stan'),
-                    rrn=txn_data.get('rrn'),
-                    response_code=txn_data.get('responseCode'),
-                    terminal_id=txn_data.get('terminalId'),
-                    merchant_id=txn_data.get('merchantId'),
-                    direction=txn_data.get('direction'),
-                    raw_message=txn_data.get('rawMessage')
-                )
+            if txn_id and txn_id not in known_ids:
+                known_ids.add(txn_id)
+                record = {
+                    'id': txn_id,
+                    'mti': txn_data.get('mti'),
+                    'processing_code': txn_data.get('processingCode'),
+                    'amount': txn_data.get('amount'),
+                    'transmission_datetime': txn_data.get('transmissionDateTime'),
+                    'stan': txn_data.get('stan'),
+                    'rrn': txn_data.get('rrn'),
+                    'response_code': txn_data.get('responseCode'),
+                    'terminal_id': txn_data.get('terminalId'),
+                    'merchant_id': txn_data.get('merchantId'),
+                    'direction': txn_data.get('direction'),
+                    'raw_message': txn_data.get('rawMessage')
+                }
                 
                 # Parse timestamp if available
                 if 'timestamp' in txn_data and txn_data['timestamp']:
                     try:
-                        txn.timestamp = datetime.fromisoformat(txn_data['timestamp'].replace('Z', '+00:00'))
+                        timestamp = datetime.fromisoformat(txn_data['timestamp'].replace('Z', '+00:00'))
+                        # Stored naive in UTC, as read back from the database
+                        if timestamp.tzinfo is not None:
+                            timestamp = timestamp.astimezone(timezone.utc).replace(tzinfo=None)
+                        record['timestamp'] = timestamp
                     except ValueError:
                         pass
                 
-                db.session.add(txn)
+                records.append(record)
+                added.append(txn_data)
+        
+        # Rows for months already sealed into partitions or archived are looked up there
+        cutoff = get_transaction_partitions().hot_cutoff()
+        ids_by_month = {}
+        for record in records:
+            if record.get('timestamp') and record['timestamp'] < cutoff:
+                ids_by_month.setdefault(month_of(record['timestamp']), []).append(record['id'])
+        if ids_by_month:
+            sealed_ids = get_transaction_partitions().existing_ids(ids_by_month)
+            sealed_ids |= get_transaction_archive().existing_ids(
+                [txn_id for ids in ids_by_month.values() for txn_id in ids])
+            added = [txn_data for txn_data in added if txn_data.get('id') not in sealed_ids]
+            records = [record for record in records if record['id'] not in sealed_ids]
         
-        db.session.commit()
+        # Create new transactions in cache, encrypting each column as a batch,
+        # and add them to the integrity tree in the same database transaction
+        new_transactions = Transaction.build_many(records)
+        integrity_tree = get_integrity_tree()
+        with integrity_tree.appending():
+            db.session.add_all(new_transactions)
+            integrity_tree.append(new_transactions)
+            db.session.commit()
     except Exception as e:
         logger.error(f"Error updating transaction cache: {str(e)}")
         db.session.rollback()
+        raise
+    
+    return added
 
 
 def update_status_cache(status_data):
-    """Update the local cache with system status data from the processor"""
+    """Update the local cache with system status data from the processor
+    
+    Returns:
+        The cached SystemStatus record, or None if the update failed
+    """
     try:
         # Get or create status record
         status = SystemStatus.query.get(1)
@@ -165,37 +317,374 @@ def update_status_cache(status_data):
             status = SystemStatus(id=1)
             db.session.add(status)
         
-        # Update fields
-        status.status = status_data.get('status')
-        status.transactions_processed = status_data.get('transactionsProcessed', 0)
+        fields = {
+            'status': status_data.get('status'),
+            'transactions_processed': status_data.get('transactionsProcessed', 0)
+        }
         
         # Parse timestamps if available
-        if 'startTime' in status_data and status_data['startTime']:
-            try:
-                status.start_time = datetime.fromisoformat(status_data['startTime'].replace('Z', '+00:00'))
-            except ValueError:
-                pass
-        
-        if 'lastUpdated' in status_data and status_data['lastUpdated']:
-            try:
-                status.last_updated = datetime.fromisoformat(status_data['lastUpdated'].replace('Z', '+00:00'))
-            except ValueError:
-                pass
-        
-        db.session.commit()
+        for field, key in (('start_time', 'startTime'), ('last_updated', 'lastUpdated')):
+            if key in status_data and status_data[key]:
+                try:
+                    parsed = datetime.fromisoformat(status_data[key].replace('Z', '+00:00'))
+                except ValueError:
+                    continue
+                # Stored naive in UTC, so compare like with like
+                if parsed.tzinfo is not None:
+                    parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+                fields[field] = parsed
+        
+        # Only write when something actually changed
+        changed = False
+        for field, value in fields.items():
+            if getattr(status, field) != value:
+                setattr(status, field, value)
+                changed = True
+        
+        if changed:
+            db.session.commit()
+        return status
     except Exception as e:
         logger.error(f"Error updating status cache: {str(e)}")
         db.session.rollback()
+        return None
 
 
-def get_cached_transactions(limit):
-    """Get cached transaction data"""
+def encode_cursor(txn):
+    """Build an opaque keyset cursor pointing just past a transaction
+    
+    A transaction without a timestamp is encoded with a null timestamp;
+    such rows sort after all others.
+    """
+    position = [txn.timestamp.isoformat() if txn.timestamp else None, txn.id]
+    return base64.urlsafe_b64encode(json.dumps(position).encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor):
+    """Decode a keyset cursor into (timestamp, id)
+    
+    A null timestamp decodes to datetime.min, where rows without a
+    timestamp sort.
+    
+    Raises:
+        ValueError: If the cursor is malformed
+    """
     try:
-        transactions = Transaction.query.order_by(Transaction.timestamp.desc()).limit(limit).all()
-        return [txn.to_dict() for txn in transactions]
+        timestamp, txn_id = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+        if not isinstance(txn_id, str) or not txn_id:
+            raise ValueError("Invalid cursor")
+        return (datetime.fromisoformat(timestamp) if timestamp is not None else datetime.min), txn_id
+    except Exception:
+        raise ValueError("Invalid cursor")
+
+
+def transaction_date_range(filters):
+    """Resolve the date filter into a timestamp range
+    
+    Returns:
+        Tuple of (start, end); either is None when unbounded
+    
+    Raises:
+        ValueError: If the date filter cannot be parsed
+    """
+    date = filters.get('date')
+    if not date or date == 'all':
+        return None, None
+    
+    today = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+    if date in DATE_RANGES:
+        start_days, end_days = DATE_RANGES[date]
+        start = today - timedelta(days=start_days)
+        end = today - timedelta(days=end_days) if end_days is not None else None
+        return start, end
+    
+    try:
+        start = datetime.strptime(date, '%Y-%m-%d')
+    except ValueError:
+        raise ValueError(f"Invalid date filter: {date}")
+    return start, start + timedelta(days=1)
+
+
+def apply_transaction_filters(query, filters):
+    """Apply list filters using only the plaintext, indexed columns
+    
+    Supported filters:
+    - mti: two-digit message class (e.g. "02") or a full four-digit MTI
+    - response: a response code, or "declined" for anything but "00",
+      including no response code
+    - date: today, yesterday, week, month, all, or an ISO date (YYYY-MM-DD)
+    - search: exact transaction ID, STAN, RRN, terminal ID or merchant ID
+    
+    Raises:
+        ValueError: If a filter value cannot be parsed
+    """
+    mti = filters.get('mti')
+    if mti:
+        if len(mti) == 2 and mti.isdigit():
+            # Range on the prefix so the index can be used; "99" has no two-digit successor
+            query = query.filter(Transaction.mti >= mti)
+            if mti != '99':
+                query = query.filter(Transaction.mti < f"{int(mti) + 1:02d}")
+        else:
+            query = query.filter(Transaction.mti == mti)
+    
+    response = filters.get('response')
+    if response == 'declined':
+        # Rows without a response code were not approved either
+        query = query.filter(or_(Transaction.response_code != '00', Transaction.response_code.is_(None)))
+    elif response:
+        query = query.filter(Transaction.response_code == response)
+    
+    start, end = transaction_date_range(filters)
+    if start is not None:
+        query = query.filter(Transaction.timestamp >= start)
+    if end is not None:
+        query = query.filter(Transaction.timestamp < end)
+    
+    search = filters.get('search')
+    if search:
+        # Terminal and merchant IDs are encrypted; match them on their blind
+        # indexes under every key, as rows may predate a key rotation
+        security_manager = get_security_manager()
+        query = query.filter(or_(
+            Transaction.id == search,
+            Transaction.stan == search,
+            Transaction.rrn == search,
+            Transaction.terminal_id_bidx.in_(security_manager.blind_indexes(search, 'terminal_id')),
+            Transaction.merchant_id_bidx.in_(security_manager.blind_indexes(search, 'merchant_id'))
+        ))
+    
+    return query
+
+
+def archive_criteria(filters):
+    """Translate list filters into archive lookup criteria
+    
+    The archive is only searched for lookups: a search value or a date
+    range. Plain browsing stops at the partitions.
+    
+    Returns:
+        Criteria dict for TransactionArchive.matches_segment and find, or
+        None if the archive is not searched
+    
+    Raises:
+        ValueError: If a filter value cannot be parsed
+    """
+    start, end = transaction_date_range(filters)
+    search = filters.get('search')
+    if not search and start is None and end is None:
+        return None
+    
+    criteria = {'start': start, 'end': end, 'mti': filters.get('mti'), 'response': filters.get('response')}
+    if search:
+        security_manager = get_security_manager()
+        criteria['search'] = {
+            'id': {search},
+            'stan': {search},
+            'rrn': {search},
+            'terminal_id_bidx': set(security_manager.blind_indexes(search, 'terminal_id')),
+            'merchant_id_bidx': set(security_manager.blind_indexes(search, 'merchant_id'))
+        }
+    return criteria
+
+
+def parse_fields(value):
+    """Parse a comma-separated sparse fieldset for the transaction list
+    
+    Returns:
+        Tuple of API field names, always including the ID; the default list
+        fields when value is empty
+    
+    Raises:
+        ValueError: If an unknown field is requested
+    """
+    if not value:
+        return Transaction.LIST_FIELDS
+    
+    fields = [name.strip() for name in value.split(',') if name.strip()]
+    unknown = [name for name in fields if name not in Transaction.API_FIELDS]
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(unknown)}")
+    
+    if 'id' not in fields:
+        fields.insert(0, 'id')
+    return tuple(dict.fromkeys(fields))
+
+
+def get_cached_transactions(limit, filters=None, cursor=None, fields=None):
+    """Get a page of cached transactions, newest first
+    
+    Pages are addressed with keyset cursors on (timestamp, id) rather than
+    OFFSET, so every page costs the same regardless of depth. Only the
+    columns behind the requested fields are selected, into untracked
+    TransactionRow objects rather than ORM instances, and only the
+    requested encrypted fields are decrypted. Rows come from the main table and from
+    the sealed monthly partitions that overlap the date range and cursor,
+    and for searches and date lookups also from the archive segments whose
+    metadata does not exclude them.
+    
+    Args:
+        limit: Page size
+        filters: List filters, see apply_transaction_filters
+        cursor: Keyset cursor from a previous page
+        fields: API field names to return; defaults to the list fields
+    
+    Returns:
+        Tuple of (list of transaction dicts, cursor for the next page or None)
+    
+    Raises:
+        ValueError: If the cursor or a filter is invalid
+    """
+    fields = fields or Transaction.LIST_FIELDS
+    filters = filters or {}
+    position = decode_cursor(cursor) if cursor else None
+    start, end = transaction_date_range(filters)
+    if position is not None:
+        # Nothing after the cursor position can be on this page
+        cursor_end = position[0] + timedelta(microseconds=1)
+        end = min(end, cursor_end) if end is not None else cursor_end
+    
+    columns = Transaction.select_columns(fields)
+    column_names = [column.name for column in columns]
+    
+    def page_query():
+        query = apply_transaction_filters(select(*columns), filters)
+        if position is not None and position[0] == datetime.min:
+            # Inside the trailing rows without a timestamp
+            query = query.filter(Transaction.timestamp.is_(None), Transaction.id < position[1])
+        elif position is not None:
+            timestamp, txn_id = position
+            query = query.filter(or_(
+                Transaction.timestamp < timestamp,
+                and_(Transaction.timestamp == timestamp, Transaction.id < txn_id),
+                Transaction.timestamp.is_(None)
+            ))
+        # Explicit, since PostgreSQL sorts NULLs first in a descending order and SQLite last
+        return query.order_by(Transaction.timestamp.desc().nullslast(), Transaction.id.desc()).limit(limit + 1)
+    
+    def newest_first(txn):
+        return txn.timestamp or datetime.min, txn.id
+    
+    partitions = get_transaction_partitions()
+    with partitions.sessions(partitions.months_overlapping(start, end)) as sessions:
+        try:
+            transactions = TransactionRow.from_rows(db.session.execute(page_query()))
+            
+            # Sealed months are disjoint and newest first; older ones are only
+            # read while the page could still take rows from them
+            for month, session in sessions:
+                if len(transactions) > limit and newest_first(transactions[limit])[0] >= month_range(month)[1]:
+                    break
+                transactions = sorted(transactions + TransactionRow.from_rows(session.execute(page_query())),
+                                      key=newest_first, reverse=True)[:limit + 1]
+            
+            criteria = archive_criteria(filters)
+            if criteria is not None:
+                archive = get_transaction_archive()
+                for segment in archive.segments(archive.months()):
+                    if len(transactions) > limit and newest_first(transactions[limit])[0] > segment.max_timestamp:
+                        break
+                    if archive.matches_segment(segment, criteria, position):
+                        found = [TransactionRow({name: row[name] for name in column_names})
+                                 for row in archive.find_rows(segment, criteria, limit + 1, position)]
+                        transactions = sorted(transactions + found, key=newest_first, reverse=True)[:limit + 1]
+        except Exception as e:
+            logger.error(f"Error getting cached transactions: {str(e)}")
+            return [], None
+        
+        next_cursor = encode_cursor(transactions[limit - 1]) if len(transactions) > limit else None
+        transactions = transactions[:limit]
+        
+        encrypted = [Transaction.API_FIELDS[name] for name in fields
+                     if Transaction.API_FIELDS[name] in Transaction.ENCRYPTED_FIELDS]
+        TransactionRow.decrypt_many(transactions, encrypted)
+        return [txn.to_dict(fields) for txn in transactions], next_cursor
+
+
+def get_cached_transaction(transaction_id):
+    """Get one cached transaction by ID with its raw message decrypted
+    
+    Decoded payloads are served from a short-lived LRU cache; a hit is still
+    counted in the access statistics.
+    
+    Returns:
+        Transaction dict, or None if it is not cached
+    """
+    transaction = transaction_detail_cache.get(transaction_id)
+    if transaction is not None:
+        get_access_stats().record(Transaction, transaction_id)
+        return transaction
+    
+    try:
+        txn = db.session.get(Transaction, transaction_id, options=[undefer(Transaction._raw_message)])
+        if txn is not None:
+            transaction = txn.to_dict()
+        else:
+            # Not in the main table; look in the sealed months, newest first
+            partitions = get_transaction_partitions()
+            with partitions.sessions(partitions.months()) as sessions:
+                for _, session in sessions:
+                    txn = session.get(Transaction, transaction_id, options=[undefer(Transaction._raw_message)])
+                    if txn is not None:
+                        transaction = txn.to_dict()
+                        break
+                else:
+                    # Finally in the archive
+                    txn = get_transaction_archive().get(transaction_id)
+                    if txn is None:
+                        return None
+                    transaction = txn.to_dict()
+    except Exception as e:
+        logger.error(f"Error getting cached transaction {transaction_id}: {str(e)}")
+        return None
+    
+    transaction_detail_cache.set(transaction_id, transaction)
+    return transaction
+
+
+def _hour_bucket(column):
+    """SQL expression truncating a timestamp column to the hour"""
+    if db.engine.dialect.name == 'postgresql':
+        return func.to_char(func.date_trunc('hour', column), 'YYYY-MM-DD"T"HH24:00')
+    return func.strftime('%Y-%m-%dT%H:00', column)
+
+
+def get_transaction_metrics(hours):
+    """Count cached transactions by MTI class, response code and hour
+    
+    Aggregation runs in the database over unencrypted columns, so no row
+    is loaded or decrypted.
+    """
+    since = datetime.utcnow() - timedelta(hours=hours)
+    in_window = Transaction.timestamp >= since
+    
+    metrics = {
+        'windowHours': hours,
+        'since': since.isoformat() + 'Z',
+        'total': 0,
+        'byType': {name: 0 for name in list(MTI_CLASSES.values()) + ['other']},
+        'byResponseCode': {},
+        'byHour': {}
+    }
+    
+    try:
+        mti_class = func.substr(Transaction.mti, 1, 2)
+        for prefix, count in db.session.query(mti_class, func.count()).filter(in_window).group_by(mti_class):
+            metrics['byType'][MTI_CLASSES.get(prefix, 'other')] += count
+            metrics['total'] += count
+        
+        for code, count in db.session.query(Transaction.response_code, func.count()) \
+                .filter(in_window).group_by(Transaction.response_code):
+            metrics['byResponseCode'][code or 'none'] = count
+        
+        bucket = _hour_bucket(Transaction.timestamp)
+        for hour, count in db.session.query(bucket, func.count()).filter(in_window) \
+                .group_by(bucket).order_by(bucket):
+            metrics['byHour'][hour] = count
     except Exception as e:
-        logger.error(f"Error getting cached transactions: {str(e)}")
-        return []
+        logger.error(f"Error computing transaction metrics: {str(e)}")
+    
+    return metrics
 
 
 def get_cached_status():
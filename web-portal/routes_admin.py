@@ -8,11 +8,18 @@ to manage endpoints, HSM keys, and system settings.
 import logging
 import datetime
 from uuid import uuid4
-from flask import Blueprint, render_template, redirect, url_for, request, flash, jsonify, current_app
+from flask import Blueprint, render_template, redirect, url_for, request, flash, jsonify, current_app, send_file, abort
 from flask_login import login_required, current_user
 
 from admin import get_admin_module, EndpointType, EndpointProtocol, AuthMethod, Endpoint
 from hsm import HSMKeyType, get_hsm_manager
+from security import get_security_manager
+from field_migration import get_field_migrator
+from archive import get_transaction_archive
+from integrity import get_integrity_tree
+from query_profiler import get_query_profiler
+from sampling_profiler import get_sampling_profiler
+from compression import get_response_compressor
 
 # Create blueprint
 admin_bp = Blueprint('admin', __name__, url_prefix='/admin')
@@ -20,6 +27,52 @@ admin_bp = Blueprint('admin', __name__, url_prefix='/admin')
 # Setup logger
 logger = logging.getLogger('admin_routes')
 
+# Numeric settings: form field -> (default, minimum, maximum, label)
+NUMERIC_SETTINGS = {
+    'processor_timeout': (5, 1, 60, 'Request timeout'),
+    'processor_pool_size': (10, 1, 100, 'Connection pool size'),
+    'circuit_failure_threshold': (5, 1, 50, 'Circuit breaker threshold'),
+    'circuit_reset_seconds': (30, 1, 600, 'Circuit reset'),
+    'session_timeout': (30, 5, 240, 'Session timeout'),
+    'max_failed_logins': (5, 3, 10, 'Max failed login attempts'),
+    'password_expiry_days': (90, 30, 365, 'Password expiry'),
+    'audit_retention_days': (365, 30, 3650, 'Audit log retention'),
+    'audit_rotate_mb': (50, 1, 1024, 'Audit log rotation size'),
+    'audit_rotate_hours': (24, 1, 720, 'Audit log rotation interval'),
+    'sync_interval_seconds': (10, 1, 300, 'Sync interval'),
+    'decrypt_cache_ttl_seconds': (60, 1, 3600, 'Decryption cache TTL'),
+    'decrypt_cache_max_mb': (16, 1, 1024, 'Decryption cache size'),
+    'reencryption_rows_per_second': (500, 0, 100000, 'Re-encryption rate'),
+    'transaction_retention_days': (365, 30, 3650, 'Transaction retention'),
+    'archive_after_days': (90, 30, 3650, 'Archive after'),
+    'query_repeat_threshold': (10, 2, 10000, 'Repeated query threshold'),
+    'slow_query_ms': (200, 1, 60000, 'Slow query threshold'),
+    'profile_sample_percent': (1, 0, 100, 'Profiled requests'),
+    'profile_slow_ms': (0, 0, 600000, 'Profile requests slower than'),
+    'profile_max_files': (200, 1, 10000, 'Profiles kept')
+}
+
+
+def parse_numeric_settings(form):
+    """Parse and range-check the numeric settings of the settings form
+
+    Returns:
+        Tuple of (dict of parsed values, list of error messages)
+    """
+    values, errors = {}, []
+    for name, (default, minimum, maximum, label) in NUMERIC_SETTINGS.items():
+        raw = form.get(name, '').strip()
+        try:
+            value = int(raw) if raw else default
+        except ValueError:
+            errors.append(f"{label} must be a whole number")
+            continue
+        if not minimum <= value <= maximum:
+            errors.append(f"{label} must be between {minimum} and {maximum}")
+            continue
+        values[name] = value
+    return values, errors
+
 @admin_bp.route('/')
 @login_required
 def index():
@@ -30,7 +83,11 @@ def index():
         'admin/index.html',
         settings=admin_module.get_settings(),
         hsm_keys=admin_module.get_hsm_keys(include_expired=False),
-        endpoints=admin_module.get_endpoints()
+        endpoints=admin_module.get_endpoints(),
+        decrypt_cache=get_security_manager().plaintext_cache.get_stats(),
+        reencryption=get_field_migrator().get_status(),
+        archive=get_transaction_archive().get_stats(),
+        compression=get_response_compressor().get_stats()
     )
 
 # Endpoint Management Routes
@@ -181,8 +238,6 @@ def edit_endpoint(endpoint_id):
                 'path': request.form.get('path', ''),
                 'auth_method': auth_method,
                 'auth_credentials': auth_credentials,
-                'timeout': int(request.form.get('timeout', 30)),
-                'retry_attempts': int(request.form.get('retry_attempts', 3)),
                 'ssl_verify': 'ssl_verify' in request.form,
                 'enabled': 'enabled' in request.form
             }
@@ -482,36 +537,41 @@ def settings():
     admin_module = get_admin_module()
     
     if request.method == 'POST':
-        try:
-            # Parse form data
-            updates = {
-                'transaction_processor_url': request.form.get('transaction_processor_url'),
-                'log_level': request.form.get('log_level'),
-                'session_timeout': int(request.form.get('session_timeout', 30)),
-                'max_failed_logins': int(request.form.get('max_failed_logins', 5)),
-                'password_expiry_days': int(request.form.get('password_expiry_days', 90)),
-                'audit_retention_days': int(request.form.get('audit_retention_days', 365)),
-                'enable_pin_verification': 'enable_pin_verification' in request.form,
-                'enable_mac_verification': 'enable_mac_verification' in request.form,
-                'offline_mode': 'offline_mode' in request.form,
-                'maintenance_mode': 'maintenance_mode' in request.form
-            }
-            
-            # Update settings
-            if admin_module.update_settings(updates):
-                flash('Settings updated successfully', 'success')
-                
-                # Apply log level change
-                log_level = getattr(logging, updates['log_level'])
-                logging.getLogger().setLevel(log_level)
-                
-                return redirect(url_for('admin.settings'))
-            else:
-                flash('Failed to update settings', 'danger')
+        numeric, errors = parse_numeric_settings(request.form)
+        for error in errors:
+            flash(error, 'danger')
+        
+        if not errors:
+            try:
+                # Parse form data
+                updates = {
+                    'transaction_processor_url': request.form.get('transaction_processor_url'),
+                    'log_level': request.form.get('log_level'),
+                    'enable_pin_verification': 'enable_pin_verification' in request.form,
+                    'enable_mac_verification': 'enable_mac_verification' in request.form,
+                    'offline_mode': 'offline_mode' in request.form,
+                    'maintenance_mode': 'maintenance_mode' in request.form,
+                    'decrypt_cache_enabled': 'decrypt_cache_enabled' in request.form,
+                    'query_profiler_enabled': 'query_profiler_enabled' in request.form,
+                    'sampling_profiler_enabled': 'sampling_profiler_enabled' in request.form,
+                    **numeric
+                }
                 
-        except Exception as e:
-            logger.error(f"Error updating settings: {str(e)}")
-            flash(f"Error updating settings: {str(e)}", 'danger')
+                # Update settings
+                if admin_module.update_settings(updates):
+                    flash('Settings updated successfully', 'success')
+                    
+                    # Apply log level change
+                    log_level = getattr(logging, updates['log_level'])
+                    logging.getLogger().setLevel(log_level)
+                    
+                    return redirect(url_for('admin.settings'))
+                else:
+                    flash('Failed to update settings', 'danger')
+                    
+            except Exception as e:
+                logger.error(f"Error updating settings: {str(e)}")
+                flash(f"Error updating settings: {str(e)}", 'danger')
     
     return render_template(
         'admin/settings.html',
@@ -541,6 +601,127 @@ def toggle_maintenance_mode():
     
     return redirect(url_for('admin.settings'))
 
+# Integrity Routes
+@admin_bp.route('/integrity')
+@login_required
+def integrity():
+    """Transaction integrity tree status"""
+    from models import MerkleBucket
+    
+    integrity_tree = get_integrity_tree()
+    
+    return render_template(
+        'admin/integrity.html',
+        root=integrity_tree.root(),
+        buckets=MerkleBucket.query.order_by(MerkleBucket.bucket.desc()).all(),
+        untracked=integrity_tree.untracked_query().count(),
+        report=integrity_tree.last_report
+    )
+
+@admin_bp.route('/integrity/verify', methods=['POST'])
+@login_required
+def verify_integrity():
+    """Verify the integrity trees against the cached transactions"""
+    try:
+        report = get_integrity_tree().verify(full=request.form.get('full') == '1')
+        if report['ok']:
+            flash(f"Verified {report['verified']} buckets, {report['skipped']} unchanged", 'success')
+        else:
+            flash(f"Integrity check failed for {len(report['failed'])} buckets", 'danger')
+    except Exception as e:
+        logger.error(f"Error verifying integrity: {str(e)}")
+        flash(f"Error verifying integrity: {str(e)}", 'danger')
+    
+    return redirect(url_for('admin.integrity'))
+
+@admin_bp.route('/integrity/backfill', methods=['POST'])
+@login_required
+def backfill_integrity():
+    """Add transactions cached before the integrity tree to it"""
+    try:
+        added = get_integrity_tree().add_untracked()
+        flash(f"Added {added} transactions to the integrity tree", 'success')
+    except Exception as e:
+        logger.error(f"Error adding transactions to the integrity tree: {str(e)}")
+        flash(f"Error adding transactions to the integrity tree: {str(e)}", 'danger')
+    
+    return redirect(url_for('admin.integrity'))
+
+@admin_bp.route('/integrity/root')
+@login_required
+def integrity_root():
+    """Current root hash over all integrity trees"""
+    return jsonify(get_integrity_tree().root())
+
+@admin_bp.route('/integrity/proof/<transaction_id>')
+@login_required
+def integrity_proof(transaction_id):
+    """Inclusion proof for one transaction"""
+    proof = get_integrity_tree().proof(transaction_id)
+    if proof is None:
+        return jsonify({'error': 'Transaction is not in the integrity tree'}), 404
+    return jsonify(proof)
+
+# Query Profiler Routes
+@admin_bp.route('/queries')
+@login_required
+def queries():
+    """SQL query profile of this worker process"""
+    profiler = get_query_profiler()
+    profiler.apply_settings()
+    
+    return render_template(
+        'admin/queries.html',
+        profiler=profiler,
+        summary=profiler.get_summary(),
+        repeated=list(profiler.repeated),
+        slow=list(profiler.slow)
+    )
+
+@admin_bp.route('/queries/reset', methods=['POST'])
+@login_required
+def reset_queries():
+    """Discard the collected query profile"""
+    get_query_profiler().reset()
+    flash('Query profile cleared', 'success')
+    return redirect(url_for('admin.queries'))
+
+# Sampling Profiler Routes
+@admin_bp.route('/profiles')
+@login_required
+def profiles():
+    """Request profiles written by the sampling profiler"""
+    profiler = get_sampling_profiler()
+    profiler.apply_settings()
+    
+    return render_template(
+        'admin/profiles.html',
+        profiler=profiler,
+        profiles=profiler.list_profiles()
+    )
+
+@admin_bp.route('/profiles/<name>')
+@login_required
+def download_profile(name):
+    """Download one profile in the collapsed stack format"""
+    path = get_sampling_profiler().profile_path(name)
+    if path is None:
+        abort(404)
+    return send_file(path, mimetype='text/plain', as_attachment=True, download_name=name)
+
+@admin_bp.route('/profiles/clear', methods=['POST'])
+@login_required
+def clear_profiles():
+    """Delete every profile file"""
+    try:
+        deleted = get_sampling_profiler().clear()
+        flash(f"Deleted {deleted} profiles", 'success')
+    except Exception as e:
+        logger.error(f"Error deleting profiles: {str(e)}")
+        flash(f"Error deleting profiles: {str(e)}", 'danger')
+    
+    return redirect(url_for('admin.profiles'))
+
 # Other Admin Routes
 @admin_bp.route('/user-management')
 @login_required
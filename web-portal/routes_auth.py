@@ -12,6 +12,7 @@ from flask_login import login_user, logout_user, login_required, current_user
 from werkzeug.security import generate_password_hash, check_password_hash
 
 from models import User, db
+from security import get_security_manager
 
 # Configure logging
 logger = logging.getLogger(__name__)
@@ -73,6 +74,9 @@ def logout():
     """Handle user logout"""
     username = current_user.username
     logout_user()
+    
+    # Drop decrypted values cached while the session was active
+    get_security_manager().plaintext_cache.wipe()
     flash('You have been logged out', 'info')
     logger.info(f"User '{username}' logged out")
     return redirect(url_for('auth.login'))
@@ -0,0 +1,248 @@
+"""
+Statistical request profiler for the SillyPostilion web portal.
+
+When enabled in the admin settings, a share of requests, and optionally
+every request slower than a threshold, is profiled by sampling: one
+background thread reads the current stack of each profiled request
+thread every few milliseconds, so the request itself runs uninstrumented.
+Each profile is written in the collapsed stack format, one
+"frame;frame;frame count" line per distinct stack, which flamegraph.pl,
+speedscope and similar tools turn into flame graphs.
+
+Profiles are written to a directory shared by all workers and kept as a
+ring of the most recent files.
+"""
+
+import os
+import re
+import sys
+import time
+import random
+import logging
+import datetime
+import threading
+from collections import Counter
+from typing import Any, Dict, List, Optional
+
+from flask import g, request
+
+from admin import get_admin_module
+
+# Configure logger
+logger = logging.getLogger('sampling_profiler')
+
+# Seconds between stack samples of a profiled request
+SAMPLE_INTERVAL = 0.005
+
+PROFILE_SUFFIX = '.collapsed'
+
+# <timestamp>-<pid>-<duration>ms-<endpoint>.collapsed
+PROFILE_NAME = re.compile(r'^(\d{8}-\d{6}-\d{6})-(\d+)-(\d+)ms-([\w.-]+)\.collapsed$')
+
+
+class SamplingProfiler:
+    """Samples the stacks of selected requests into collapsed stack files"""
+
+    def __init__(self, app=None):
+        """Initialize the profiler
+
+        Args:
+            app: Flask application to bind to
+        """
+        self.app = None
+        self.directory = None
+        self.enabled = False
+        self.sample_percent = 1
+        self.slow_seconds = 0.0
+        self.max_files = 200
+        self._settings_version = None
+        self._labels: Dict[Any, str] = {}
+        self._active: Dict[int, Counter] = {}
+        self._thread: Optional[threading.Thread] = None
+        self._wakeup = threading.Event()
+        self._lock = threading.Lock()
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Bind the profiler to the Flask app.
+
+        Profiles are written to PROFILE_DIR, by default the profiles
+        directory in the instance folder. The sampling thread is started
+        with the first profiled request.
+        """
+        self.app = app
+        self.directory = app.config.get('PROFILE_DIR', os.path.join(app.instance_path, 'profiles'))
+        app.extensions['sampling_profiler'] = self
+
+        app.before_request(self._start_request)
+        app.teardown_request(self._finish_request)
+
+    def after_fork(self) -> None:
+        """Forget the master's sampling thread and replace its locks"""
+        self._thread = None
+        self._active = {}
+        self._wakeup = threading.Event()
+        self._lock = threading.Lock()
+
+    def apply_settings(self) -> None:
+        """Configure the profiler from the admin settings when they change"""
+        settings = get_admin_module().get_settings()
+        if settings.updated_at == self._settings_version:
+            return
+
+        self.enabled = settings.sampling_profiler_enabled
+        self.sample_percent = min(100, max(0, settings.profile_sample_percent))
+        self.slow_seconds = max(0, settings.profile_slow_ms) / 1000
+        self.max_files = max(1, settings.profile_max_files)
+        self._settings_version = settings.updated_at
+
+    def _start(self) -> None:
+        """Start the sampling thread if it is not already running"""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._thread = threading.Thread(target=self._run, name='sampling-profiler', daemon=True)
+        self._thread.start()
+
+    def _start_request(self) -> None:
+        """Profile the request if it is in the sampled share or may turn out slow"""
+        self.apply_settings()
+        if not self.enabled:
+            return
+
+        sampled = random.random() * 100 < self.sample_percent
+        if not sampled and not self.slow_seconds:
+            return
+
+        g.profile_started = time.perf_counter()
+        g.profile_sampled = sampled
+        with self._lock:
+            self._active[threading.get_ident()] = Counter()
+            self._start()
+        self._wakeup.set()
+
+    def _finish_request(self, exception=None) -> None:
+        """Write the request's profile if it was sampled or slow"""
+        started = g.pop('profile_started', None)
+        if started is None:
+            return
+
+        with self._lock:
+            stacks = self._active.pop(threading.get_ident(), None)
+        elapsed = time.perf_counter() - started
+        if not stacks:
+            return
+        if g.pop('profile_sampled', False) or elapsed >= self.slow_seconds:
+            try:
+                self._write(request.endpoint or 'unmatched', elapsed, stacks)
+            except OSError as e:
+                logger.error(f"Error writing profile: {str(e)}")
+
+    def _run(self) -> None:
+        """Sampling loop: sleeps while no request is being profiled"""
+        while True:
+            with self._lock:
+                idle = not self._active
+                if idle:
+                    self._wakeup.clear()
+            if idle:
+                self._wakeup.wait()
+                continue
+
+            frames = sys._current_frames()
+            with self._lock:
+                for ident, stacks in self._active.items():
+                    frame = frames.get(ident)
+                    if frame is not None:
+                        stacks[self._collapse(frame)] += 1
+            del frames
+            time.sleep(SAMPLE_INTERVAL)
+
+    def _collapse(self, frame) -> str:
+        """Stack of a frame as semicolon-separated labels, outermost first"""
+        labels = []
+        while frame is not None:
+            code = frame.f_code
+            label = self._labels.get(code)
+            if label is None:
+                label = f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+                label = self._labels[code] = label.replace(';', ':')
+            labels.append(label)
+            frame = frame.f_back
+        return ';'.join(reversed(labels))
+
+    def _write(self, endpoint: str, elapsed: float, stacks: Counter) -> None:
+        """Write a profile and drop the oldest files beyond the ring size"""
+        os.makedirs(self.directory, exist_ok=True)
+        stamp = datetime.datetime.now().strftime('%Y%m%d-%H%M%S-%f')
+        safe_endpoint = re.sub(r'[^\w.-]', '_', endpoint)
+        name = f"{stamp}-{os.getpid()}-{round(elapsed * 1000)}ms-{safe_endpoint}{PROFILE_SUFFIX}"
+
+        path = os.path.join(self.directory, name)
+        with open(path + '.tmp', 'w') as f:
+            for stack, count in stacks.most_common():
+                f.write(f"{stack} {count}\n")
+        os.replace(path + '.tmp', path)
+        logger.info(f"Wrote profile {name} ({sum(stacks.values())} samples)")
+
+        for old in self._profile_names()[:-self.max_files]:
+            try:
+                os.remove(os.path.join(self.directory, old))
+            except FileNotFoundError:
+                pass
+
+    def _profile_names(self) -> List[str]:
+        """Profile file names, oldest first"""
+        if not self.directory or not os.path.isdir(self.directory):
+            return []
+        return sorted(name for name in os.listdir(self.directory) if PROFILE_NAME.match(name))
+
+    def list_profiles(self) -> List[Dict[str, Any]]:
+        """Profiles on disk, newest first"""
+        profiles = []
+        for name in reversed(self._profile_names()):
+            stamp, pid, duration, endpoint = PROFILE_NAME.match(name).groups()
+            try:
+                size = os.path.getsize(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                continue
+            profiles.append({
+                'name': name,
+                'at': datetime.datetime.strptime(stamp, '%Y%m%d-%H%M%S-%f'),
+                'pid': int(pid),
+                'ms': int(duration),
+                'endpoint': endpoint,
+                'size': size
+            })
+        return profiles
+
+    def profile_path(self, name: str) -> Optional[str]:
+        """Path of a profile file, or None for names that are not profiles"""
+        if not PROFILE_NAME.match(name) or name not in self._profile_names():
+            return None
+        return os.path.join(self.directory, name)
+
+    def clear(self) -> int:
+        """Delete every profile file
+
+        Returns:
+            Number of files deleted
+        """
+        deleted = 0
+        for name in self._profile_names():
+            try:
+                os.remove(os.path.join(self.directory, name))
+                deleted += 1
+            except FileNotFoundError:
+                pass
+        return deleted
+
+
+# Create an instance of the sampling profiler
+sampling_profiler = SamplingProfiler()
+
+
+def get_sampling_profiler() -> SamplingProfiler:
+    """Return the sampling profiler instance"""
+    return sampling_profiler
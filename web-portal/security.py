@@ -8,26 +8,64 @@ import logging
 import json
 import datetime
 import uuid
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
 from base64 import b64encode, b64decode
 from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
 from cryptography.hazmat.primitives import hashes, hmac
 from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
-from cryptography.fernet import Fernet
-from flask import request, session, current_app, g
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from cryptography.fernet import Fernet, MultiFernet
+from flask import request, session, current_app, g, has_request_context
+from audit import get_audit_log
+from caching import PlaintextCache
+from metrics import timed
 
 # Configure logger
 logger = logging.getLogger('security')
-handler = logging.FileHandler('security.log')
+handler = logging.FileHandler('security.log', delay=True)
 handler.setFormatter(logging.Formatter('%(asctime)s [%(levelname)s] %(message)s'))
 logger.addHandler(handler)
 logger.setLevel(logging.INFO)
 
-# Audit logger 
-audit_logger = logging.getLogger('audit')
-audit_handler = logging.FileHandler('audit.log')
-audit_handler.setFormatter(logging.Formatter('%(asctime)s [AUDIT] %(message)s'))
-audit_logger.addHandler(audit_handler)
-audit_logger.setLevel(logging.INFO)
+# Audit records go through the queued audit pipeline
+audit_log = get_audit_log()
+
+def _decode_auto(data):
+    """Decode a plaintext of unknown type: JSON if it parses, else a string."""
+    try:
+        return json.loads(data)
+    except ValueError:
+        return data.decode('utf-8')
+
+
+# Field codecs: (encode to bytes, decode from bytes)
+FIELD_CODECS = {
+    'str': (lambda value: str(value).encode('utf-8'), lambda data: data.decode('utf-8')),
+    'json': (lambda value: json.dumps(value).encode('utf-8'), json.loads),
+    'bytes': (lambda value: value, lambda data: data),
+    'auto': (lambda value: str(value).encode('utf-8'), _decode_auto),
+}
+
+# AES-GCM field envelope: version byte, 4-byte key id, 12-byte nonce, ciphertext
+ENVELOPE_VERSION = 1
+GCM_NONCE_SIZE = 12
+
+# Length of blind index digests; 16 bytes are stored as 32 hex characters
+BLIND_INDEX_BYTES = 16
+
+# Legacy values are base64 of a Fernet token, which always starts with "gAAAAA"
+LEGACY_CIPHERTEXT_PREFIX = 'Z0FBQUFB'
+
+# The first six base64 characters of an envelope encode the version byte and
+# most of the key id, so they tell which key a stored value was sealed with
+ENVELOPE_PREFIX_CHARS = 6
+
+# Batches carrying at least this many bytes are encrypted/decrypted on the
+# worker pool; below it AES-GCM is cheaper than the hand-off to a thread
+PARALLEL_BATCH_BYTES = 1024 * 1024
+
 
 class SecurityManager:
     """Manages security features including encryption and audit logging."""
@@ -35,13 +73,24 @@ class SecurityManager:
     def __init__(self, app=None):
         self.app = app
         
-        # Generate/load encryption key
-        self.encryption_key = os.environ.get('ENCRYPTION_KEY')
-        if not self.encryption_key:
+        # Load the keyring: ENCRYPTION_KEYS lists keys newest first, and the
+        # first one encrypts; ENCRYPTION_KEY alone is a single-key ring
+        keys = [key.strip() for key in os.environ.get('ENCRYPTION_KEYS', '').split(',') if key.strip()]
+        if not keys and os.environ.get('ENCRYPTION_KEY'):
+            keys = [os.environ['ENCRYPTION_KEY']]
+        if not keys:
             # Generate a key if not provided
-            self.encryption_key = Fernet.generate_key().decode('utf-8')
+            keys = [Fernet.generate_key().decode('utf-8')]
             logger.warning("No encryption key provided. Generated a temporary one.")
         
+        self.encryption_keys = keys
+        self.encryption_key = keys[0]
+        self._keyring = None
+        self._keyring_source = None
+        self.plaintext_cache = PlaintextCache()
+        self._cache_settings_version = None
+        self._executor = None
+        
         if app is not None:
             self.init_app(app)
     
@@ -52,49 +101,79 @@ class SecurityManager:
         # Register before_request to log all requests
         app.before_request(self._log_request)
         
-        # Register teardown_request to log responses
-        app.teardown_request(self._log_response)
+        # Register after_request to log responses with their status, and
+        # teardown_request to log unhandled exceptions
+        app.after_request(self._log_response)
+        app.teardown_request(self._log_exception)
+        
+        # Keep the plaintext cache in step with the admin settings
+        app.before_request(self.apply_cache_settings)
         
         # Add security manager to app context
         app.extensions['security_manager'] = self
     
+    def after_fork(self):
+        """Drop the crypto worker pool in a forked worker; its threads stayed in the parent."""
+        self._executor = None
+    
+    def apply_cache_settings(self):
+        """Configure the plaintext cache from the admin settings when they change."""
+        from admin import get_admin_module
+        
+        settings = get_admin_module().get_settings()
+        if settings.updated_at == self._cache_settings_version:
+            return
+        
+        self.plaintext_cache.configure(
+            enabled=settings.decrypt_cache_enabled,
+            ttl=settings.decrypt_cache_ttl_seconds,
+            max_bytes=settings.decrypt_cache_max_mb * 1024 * 1024
+        )
+        self._cache_settings_version = settings.updated_at
+    
     def _log_request(self):
         """Log information about the incoming request."""
         g.request_id = str(uuid.uuid4())
         g.request_start_time = datetime.datetime.now()
         
-        client_ip = request.remote_addr
-        path = request.path
-        method = request.method
-        user_agent = request.user_agent.string
-        
-        audit_logger.info(
-            f"REQUEST | ID: {g.request_id} | IP: {client_ip} | "
-            f"{method} {path} | User-Agent: {user_agent}"
+        audit_log.emit(
+            'REQUEST',
+            request_id=g.request_id,
+            ip=request.remote_addr,
+            method=request.method,
+            path=request.path,
+            user_agent=request.user_agent.string
         )
     
-    def _log_response(self, exception=None):
+    def _log_response(self, response):
         """Log information about the outgoing response."""
         if hasattr(g, 'request_id') and hasattr(g, 'request_start_time'):
             duration = datetime.datetime.now() - g.request_start_time
-            from flask import request
-            # In teardown_request the response might not be available, so use a default
-            status_code = 500 if exception else 200
-            
-            audit_logger.info(
-                f"RESPONSE | ID: {g.request_id} | "
-                f"Status: {status_code} | Duration: {duration.total_seconds():.3f}s"
+            audit_log.emit(
+                'RESPONSE',
+                request_id=g.request_id,
+                status=response.status_code,
+                duration=round(duration.total_seconds(), 3)
             )
-            
-            if exception:
-                audit_logger.error(
-                    f"EXCEPTION | ID: {g.request_id} | {str(exception)}"
-                )
+        return response
+    
+    def _log_exception(self, exception=None):
+        """Log an exception that ended the request."""
+        if exception and hasattr(g, 'request_id'):
+            audit_log.emit('EXCEPTION', level='ERROR', request_id=g.request_id, error=str(exception))
     
     def log_security_event(self, event_type, details):
-        """Log a security-related event."""
-        user_id = session.get('user_id', 'anonymous')
-        client_ip = request.remote_addr if request else 'internal'
+        """Log a security-related event.
+        
+        Safe to call without a request context, e.g. from the sync thread
+        or the crypto pool; such events are attributed to the system.
+        """
+        if has_request_context():
+            user_id = session.get('user_id', 'anonymous')
+            client_ip = request.remote_addr
+        else:
+            user_id = 'system'
+            client_ip = 'internal'
         
         event = {
             'timestamp': datetime.datetime.now().isoformat(),
@@ -104,48 +183,238 @@ class SecurityManager:
             'details': details
         }
         
-        audit_logger.info(f"SECURITY EVENT | {json.dumps(event)}")
+        audit_log.emit('SECURITY_EVENT', **event)
         return event
     
-    def encrypt_data(self, data):
-        """Encrypt sensitive data."""
+    def set_encryption_keys(self, keys):
+        """Replace the keyring.
+        
+        Args:
+            keys: Encryption keys, newest first; the first one encrypts and
+                every one of them can still decrypt
+        """
+        if not keys:
+            raise ValueError("At least one encryption key is required")
+        self.encryption_keys = list(keys)
+        self.encryption_key = self.encryption_keys[0]
+    
+    def _get_keyring(self):
+        """Return the cached ciphers derived from every key in the keyring.
+        
+        AES-GCM field keys and blind index keys are derived from each
+        encryption key with HKDF, so no additional secret has to be
+        configured. The plaintext cache is wiped whenever the keyring changes.
+        
+        Returns:
+            Dict with the AES-GCM cipher per key id, the primary key id,
+            blind index keys (primary first) and a MultiFernet for legacy values
+        """
+        source = tuple(key.encode('utf-8') if isinstance(key, str) else key for key in self.encryption_keys)
+        keyring = self._keyring
+        if keyring is not None and self._keyring_source == source:
+            return keyring
+        
+        if keyring is not None:
+            self.plaintext_cache.wipe()
+        
+        ciphers = {}
+        key_ids = []
+        blind_index_keys = []
+        fernets = []
+        for key in source:
+            field_key = HKDF(algorithm=hashes.SHA256(), length=32, salt=None,
+                             info=b'sillypostilion-field-encryption').derive(key)
+            digest = hashes.Hash(hashes.SHA256())
+            digest.update(field_key)
+            key_id = digest.finalize()[:4]
+            ciphers.setdefault(key_id, AESGCM(field_key))
+            key_ids.append(key_id)
+            blind_index_keys.append(HKDF(algorithm=hashes.SHA256(), length=32, salt=None,
+                                         info=b'sillypostilion-blind-index').derive(key))
+            try:
+                fernets.append(Fernet(key))
+            except ValueError:
+                # Only keys in Fernet format can have sealed legacy values
+                pass
+        
+        keyring = {
+            'ciphers': ciphers,
+            'key_ids': key_ids,
+            'primary': key_ids[0],
+            'blind_index_keys': blind_index_keys,
+            'fernet': MultiFernet(fernets) if fernets else None
+        }
+        self._keyring = keyring
+        self._keyring_source = source
+        return keyring
+    
+    def key_ids(self):
+        """Return the hex ids of the keyring, primary first."""
+        return [key_id.hex() for key_id in self._get_keyring()['key_ids']]
+    
+    def envelope_prefix(self):
+        """Return the base64 prefix shared by values encrypted with the primary key."""
+        header = bytes([ENVELOPE_VERSION]) + self._get_keyring()['primary']
+        return b64encode(header).decode('ascii')[:ENVELOPE_PREFIX_CHARS]
+    
+    def needs_reencryption(self, encrypted_data):
+        """Whether a stored value is not yet encrypted with the primary key."""
+        return bool(encrypted_data) and not encrypted_data.startswith(self.envelope_prefix())
+    
+    @timed('crypto')
+    def encrypt_data(self, data, codec=None):
+        """Encrypt sensitive data.
+        
+        The result is a single base64 encoding of a versioned AES-GCM
+        envelope: version byte, 4-byte key id, 12-byte nonce, ciphertext.
+        
+        Args:
+            data: Value to encrypt
+            codec: Name of the field codec ('str', 'json' or 'bytes'). When
+                omitted it is chosen from the type of the value.
+        """
         if not data:
             return None
             
         try:
-            if isinstance(data, dict) or isinstance(data, list):
-                data = json.dumps(data)
+            if codec is None:
+                codec = 'json' if isinstance(data, (dict, list)) else 'bytes' if isinstance(data, bytes) else 'str'
+            encode, _ = FIELD_CODECS[codec]
             
-            if not isinstance(data, bytes):
-                data = str(data).encode('utf-8')
-            
-            f = Fernet(self.encryption_key.encode('utf-8') if isinstance(self.encryption_key, str) else self.encryption_key)
-            encrypted = f.encrypt(data)
-            return b64encode(encrypted).decode('utf-8')
+            keyring = self._get_keyring()
+            key_id = keyring['primary']
+            aesgcm = keyring['ciphers'][key_id]
+            nonce = os.urandom(GCM_NONCE_SIZE)
+            envelope = bytes([ENVELOPE_VERSION]) + key_id + nonce + aesgcm.encrypt(nonce, encode(data), None)
+            return b64encode(envelope).decode('ascii')
         except Exception as e:
             logger.error(f"Encryption error: {str(e)}")
             self.log_security_event('encryption_error', {'error': str(e)})
             return None
     
-    def decrypt_data(self, encrypted_data):
-        """Decrypt encrypted data."""
+    @timed('crypto')
+    def decrypt_data(self, encrypted_data, codec='auto'):
+        """Decrypt encrypted data.
+        
+        Accepts AES-GCM envelopes sealed with any key in the keyring and
+        legacy double-base64 Fernet tokens. When the plaintext cache is enabled, values are looked up there by
+        ciphertext digest first.
+        
+        Args:
+            encrypted_data: Value produced by encrypt_data
+            codec: Name of the field codec the value was encrypted with.
+                'auto' tries JSON first and falls back to a string.
+        """
         if not encrypted_data:
             return None
             
         try:
-            f = Fernet(self.encryption_key.encode('utf-8') if isinstance(self.encryption_key, str) else self.encryption_key)
-            decrypted = f.decrypt(b64decode(encrypted_data))
+            digest = None
+            decrypted = None
+            if self.plaintext_cache.enabled:
+                digest = hashlib.sha256(encrypted_data.encode('ascii')).digest()
+                decrypted = self.plaintext_cache.get(digest)
             
-            # Try to parse as JSON if possible
-            try:
-                return json.loads(decrypted)
-            except:
-                return decrypted.decode('utf-8')
+            if decrypted is None:
+                raw = b64decode(encrypted_data)
+                keyring = self._get_keyring()
+                
+                if raw[:1] == bytes([ENVELOPE_VERSION]):
+                    aesgcm = keyring['ciphers'].get(raw[1:5])
+                    if aesgcm is None:
+                        raise ValueError("Ciphertext was encrypted with an unknown key")
+                    nonce = raw[5:5 + GCM_NONCE_SIZE]
+                    decrypted = aesgcm.decrypt(nonce, raw[5 + GCM_NONCE_SIZE:], None)
+                else:
+                    if keyring['fernet'] is None:
+                        raise ValueError("No key in the keyring can decrypt legacy values")
+                    decrypted = keyring['fernet'].decrypt(raw)
+                
+                if digest is not None:
+                    self.plaintext_cache.set(digest, decrypted)
+            
+            _, decode = FIELD_CODECS[codec]
+            return decode(decrypted)
         except Exception as e:
             logger.error(f"Decryption error: {str(e)}")
             self.log_security_event('decryption_error', {'error': str(e)})
             return None
     
+    @timed('crypto')
+    def blind_index(self, value, field):
+        """Compute a searchable blind index for an encrypted field value.
+        
+        A keyed HMAC of the normalized value, truncated to
+        BLIND_INDEX_BYTES. Equal plaintexts give equal indexes, so equality
+        search is an indexed lookup; the field name keeps indexes of
+        different columns unrelated, and truncation makes collisions between
+        distinct values possible, which limits what the index reveals.
+        
+        Indexes are computed with the primary key.
+        
+        Args:
+            value: Plaintext value
+            field: Name of the column the value belongs to
+        """
+        if not value:
+            return None
+        return self._blind_index(self._get_keyring()['blind_index_keys'][0], value, field)
+    
+    @timed('crypto')
+    def blind_indexes(self, value, field):
+        """Compute the blind index of a value under every key in the keyring.
+        
+        Rows not yet re-encrypted after a key rotation still carry indexes
+        made with an older key, so searches match any of these.
+        """
+        if not value:
+            return []
+        return list(dict.fromkeys(self._blind_index(key, value, field)
+                                  for key in self._get_keyring()['blind_index_keys']))
+    
+    @staticmethod
+    def _blind_index(key, value, field):
+        """HMAC a normalized value with one blind index key."""
+        mac = hmac.HMAC(key, hashes.SHA256())
+        mac.update(f"{field}:{str(value).strip().upper()}".encode('utf-8'))
+        return mac.finalize()[:BLIND_INDEX_BYTES].hex()
+    
+    @staticmethod
+    def is_legacy_ciphertext(encrypted_data):
+        """Whether a value is a legacy Fernet ciphertext awaiting migration."""
+        return bool(encrypted_data) and encrypted_data.startswith(LEGACY_CIPHERTEXT_PREFIX)
+    
+    @timed('crypto')
+    def encrypt_many(self, values, codec=None):
+        """Encrypt a list of values, in parallel for large payloads.
+        
+        Returns:
+            List of encrypted values in the same order
+        """
+        return self._map(lambda value: self.encrypt_data(value, codec), values)
+    
+    @timed('crypto')
+    def decrypt_many(self, values, codec='auto'):
+        """Decrypt a list of values, in parallel for large payloads.
+        
+        Returns:
+            List of decrypted values in the same order
+        """
+        return self._map(lambda value: self.decrypt_data(value, codec), values)
+    
+    def _map(self, func, values):
+        """Apply func to values, using the worker pool above the size threshold."""
+        values = list(values)
+        workers = min(4, os.cpu_count() or 1)
+        total_bytes = sum(len(value) for value in values if isinstance(value, (str, bytes)))
+        if workers == 1 or total_bytes < PARALLEL_BATCH_BYTES:
+            return [func(value) for value in values]
+        
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='crypto')
+        chunk = max(1, len(values) // (workers * 4))
+        return list(self._executor.map(func, values, chunksize=chunk))
+    
     def hash_data(self, data):
         """Create a hash of data."""
         if not data:
@@ -2,25 +2,67 @@
  * Dashboard-specific JavaScript for SillyPostilion Web Portal
  */
 
+// Latest data shown on the dashboard, patched by live updates
+let currentStatus = {};
+let recentTransactions = [];
+let pollTimers = [];
+
+// Columns shown in the recent transactions table
+const LIST_FIELDS = 'id,mti,transmissionDatetime,amount,terminalId,responseCode,timestamp';
+
 document.addEventListener('DOMContentLoaded', function() {
     // Fetch all required data on page load
     fetchSystemStatus();
     fetchRecentTransactions();
     fetchTransactionStats();
     
-    // Set up refresh intervals
-    setInterval(fetchSystemStatus, 10000);  // Update status every 10 seconds
-    setInterval(fetchRecentTransactions, 15000);  // Update transactions every 15 seconds
-    setInterval(fetchTransactionStats, 30000);  // Update stats every 30 seconds
+    // Receive updates over the stream, polling only when it is unavailable
+    startLiveUpdates({
+        onStatus: delta => {
+            currentStatus = Object.assign({}, currentStatus, delta);
+            updateSystemStatusDisplay(currentStatus);
+        },
+        onTransactions: transactions => {
+            recentTransactions = transactions.concat(recentTransactions).slice(0, 5);
+            updateRecentTransactionsDisplay(recentTransactions);
+        },
+        onStats: data => updateTransactionStatsChart(data),
+        onConnected: stopPolling,
+        onFallback: startPolling
+    });
 });
 
+/**
+ * Start polling the API for updates
+ */
+function startPolling() {
+    if (pollTimers.length > 0) return;
+    
+    pollTimers = [
+        setInterval(fetchSystemStatus, 10000),  // Update status every 10 seconds
+        setInterval(fetchRecentTransactions, 15000),  // Update transactions every 15 seconds
+        setInterval(fetchTransactionStats, 30000)  // Update stats every 30 seconds
+    ];
+}
+
+/**
+ * Stop polling once live updates are flowing
+ */
+function stopPolling() {
+    pollTimers.forEach(timer => clearInterval(timer));
+    pollTimers = [];
+}
+
 /**
  * Fetch system status from the API
  */
 function fetchSystemStatus() {
     fetch('/api/status')
         .then(response => response.json())
-        .then(data => updateSystemStatusDisplay(data))
+        .then(data => {
+            currentStatus = data;
+            updateSystemStatusDisplay(data);
+        })
         .catch(error => {
             console.error('Error fetching system status:', error);
             // Update navbar status to offline
@@ -37,9 +79,12 @@ function fetchRecentTransactions() {
     document.getElementById('empty-transactions').style.display = 'none';
     document.getElementById('transactions-table-container').style.display = 'none';
     
-    fetch('/api/transactions?limit=5')
+    fetch(`/api/transactions?limit=5&fields=${LIST_FIELDS}`)
         .then(response => response.json())
-        .then(data => updateRecentTransactionsDisplay(data))
+        .then(data => {
+            recentTransactions = data.transactions || [];
+            updateRecentTransactionsDisplay(recentTransactions);
+        })
         .catch(error => {
             console.error('Error fetching transactions:', error);
             document.getElementById('loading-transactions').style.display = 'none';
@@ -77,12 +122,17 @@ function updateSystemStatusDisplay(data) {
     
     // Build system status card content
     const startTime = data.startTime ? new Date(data.startTime).toLocaleString() : 'N/A';
+    const syncedAt = data.syncedAt ? new Date(data.syncedAt).toLocaleString() : 'Never';
+    const staleBadge = data.offlineMode ?
+        '<span class="badge bg-secondary ms-1">Offline mode</span>' :
+        (data.stale ? '<span class="badge bg-warning ms-1">Stale</span>' : '');
     const statusHtml = `
         <div class="row">
             <div class="col-md-6">
                 <h3><span class="badge ${statusClass}">${data.status || 'UNKNOWN'}</span></h3>
                 <p class="mb-1"><strong>Start Time:</strong> ${startTime}</p>
                 <p class="mb-1"><strong>Transactions Processed:</strong> ${data.transactionsProcessed || 0}</p>
+                <p class="mb-1"><strong>Last Synced:</strong> ${syncedAt} ${staleBadge}</p>
             </div>
             <div class="col-md-6 d-flex align-items-center justify-content-center">
                 <div class="text-center">
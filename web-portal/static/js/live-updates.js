@@ -0,0 +1,62 @@
+/**
+ * Live update channel for SillyPostilion Web Portal
+ *
+ * Subscribes to the /api/stream Server-Sent Events feed and dispatches
+ * status, transaction and statistics deltas to page handlers. When the
+ * browser has no EventSource support or the stream cannot be established,
+ * the page is told to fall back to polling.
+ */
+
+function startLiveUpdates(handlers) {
+    const maxFailures = 3;
+    let failures = 0;
+    let live = false;
+
+    // No SSE support: poll instead
+    if (!window.EventSource) {
+        if (handlers.onFallback) handlers.onFallback();
+        return null;
+    }
+
+    const source = new EventSource('/api/stream');
+
+    source.addEventListener('open', function() {
+        failures = 0;
+        if (!live) {
+            live = true;
+            if (handlers.onConnected) handlers.onConnected();
+        }
+    });
+
+    source.addEventListener('error', function() {
+        failures++;
+
+        // Switch to polling while the stream is down; EventSource keeps
+        // retrying in the background and onConnected stops polling again
+        if (live) {
+            live = false;
+            if (handlers.onFallback) handlers.onFallback();
+        } else if (failures === maxFailures || source.readyState === EventSource.CLOSED) {
+            if (handlers.onFallback) handlers.onFallback();
+        }
+    });
+
+    ['status', 'transactions', 'stats'].forEach(eventName => {
+        source.addEventListener(eventName, function(event) {
+            const handlerName = 'on' + eventName.charAt(0).toUpperCase() + eventName.slice(1);
+            if (!handlers[handlerName]) return;
+
+            try {
+                handlers[handlerName](JSON.parse(event.data));
+            } catch (error) {
+                console.error(`Error handling ${eventName} update:`, error);
+            }
+        });
+    });
+
+    window.addEventListener('beforeunload', function() {
+        source.close();
+    });
+
+    return source;
+}
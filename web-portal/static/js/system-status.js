@@ -2,6 +2,11 @@
  * System Status page JavaScript for SillyPostilion Web Portal
  */
 
+// Latest status shown on the page, patched by live updates
+let currentStatus = {};
+let pollTimers = [];
+let metricsRefreshPending = false;
+
 document.addEventListener('DOMContentLoaded', function() {
     // Load initial data
     loadSystemStatus();
@@ -19,12 +24,64 @@ document.addEventListener('DOMContentLoaded', function() {
     });
     
     // Set up refresh intervals
-    setInterval(loadSystemStatus, 10000); // Every 10 seconds
-    setInterval(loadTransactionMetrics, 15000); // Every 15 seconds
     setInterval(loadSystemLogs, 30000); // Every 30 seconds
-    setInterval(initTransactionVolumeChart, 60000); // Every minute
+    
+    // Receive updates over the stream, polling only when it is unavailable
+    startLiveUpdates({
+        onStatus: delta => {
+            currentStatus = Object.assign({}, currentStatus, delta);
+            renderSystemStatus(currentStatus);
+        },
+        onTransactions: () => scheduleMetricsRefresh(),
+        onStats: data => renderTransactionVolumeChart(data),
+        onConnected: stopPolling,
+        onFallback: startPolling
+    });
 });
 
+/**
+ * Start polling the API for updates
+ */
+function startPolling() {
+    if (pollTimers.length > 0) return;
+    
+    pollTimers = [
+        setInterval(loadSystemStatus, 10000), // Every 10 seconds
+        setInterval(loadTransactionMetrics, 15000), // Every 15 seconds
+        setInterval(initTransactionVolumeChart, 60000) // Every minute
+    ];
+}
+
+/**
+ * Stop polling once live updates are flowing
+ */
+function stopPolling() {
+    pollTimers.forEach(timer => clearInterval(timer));
+    pollTimers = [];
+}
+
+/**
+ * Reload transaction metrics at most once every 15 seconds
+ */
+function scheduleMetricsRefresh() {
+    if (metricsRefreshPending) return;
+    
+    metricsRefreshPending = true;
+    setTimeout(function() {
+        metricsRefreshPending = false;
+        loadTransactionMetrics();
+    }, 15000);
+}
+
+/**
+ * Render all status-driven sections of the page
+ */
+function renderSystemStatus(data) {
+    updateSystemOverview(data);
+    updateSystemHealth(data);
+    updateSidebarStatus(data);
+}
+
 /**
  * Load system status information
  */
@@ -39,9 +96,8 @@ function loadSystemStatus() {
         .then(response => response.json())
         .then(data => {
             loadingElement.style.display = 'none';
-            updateSystemOverview(data);
-            updateSystemHealth(data);
-            updateSidebarStatus(data);
+            currentStatus = data;
+            renderSystemStatus(data);
         })
         .catch(error => {
             console.error('Error fetching system status:', error);
@@ -58,29 +114,15 @@ function loadSystemStatus() {
  * Load transaction metrics
  */
 function loadTransactionMetrics() {
-    fetch('/api/transactions?limit=500')
+    fetch('/api/metrics')
         .then(response => response.json())
         .then(data => {
-            // Count transactions by type
-            let authCount = 0;
-            let financialCount = 0;
-            let reversalCount = 0;
-            let networkCount = 0;
-            
-            data.forEach(txn => {
-                if (txn.mti) {
-                    const mtiFirstTwo = txn.mti.substring(0, 2);
-                    if (mtiFirstTwo === '01') {
-                        authCount++;
-                    } else if (mtiFirstTwo === '02') {
-                        financialCount++;
-                    } else if (mtiFirstTwo === '04') {
-                        reversalCount++;
-                    } else if (mtiFirstTwo === '08') {
-                        networkCount++;
-                    }
-                }
-            });
+            // Counts by transaction type, aggregated on the server
+            const byType = data.byType || {};
+            const authCount = byType.auth || 0;
+            const financialCount = byType.financial || 0;
+            const reversalCount = byType.reversal || 0;
+            const networkCount = byType.network || 0;
             
             // Calculate total for percentages
             const total = authCount + financialCount + reversalCount + networkCount;
@@ -122,6 +164,10 @@ function updateSystemOverview(data) {
     // Format timestamps
     const startTime = data.startTime ? new Date(data.startTime).toLocaleString() : 'N/A';
     const lastUpdated = data.lastUpdated ? new Date(data.lastUpdated).toLocaleString() : 'N/A';
+    const syncedAt = data.syncedAt ? new Date(data.syncedAt).toLocaleString() : 'Never';
+    const staleBadge = data.offlineMode ?
+        '<span class="badge bg-secondary ms-1">Offline mode</span>' :
+        (data.stale ? '<span class="badge bg-warning ms-1">Stale</span>' : '');
     
     // Calculate uptime
     let uptime = 'N/A';
@@ -157,6 +203,7 @@ function updateSystemOverview(data) {
                 <p class="mb-1"><strong>Start Time:</strong> ${startTime}</p>
                 <p class="mb-1"><strong>Uptime:</strong> ${uptime}</p>
                 <p class="mb-1"><strong>Last Updated:</strong> ${lastUpdated}</p>
+                <p class="mb-1"><strong>Last Synced:</strong> ${syncedAt} ${staleBadge}</p>
             </div>
             <div class="col-md-6">
                 <div class="d-flex align-items-center justify-content-center h-100">
@@ -319,77 +366,82 @@ function loadSystemLogs() {
 function initTransactionVolumeChart() {
     fetch('/api/stats')
         .then(response => response.json())
-        .then(data => {
-            // Prepare chart data
-            const hours = [];
-            const counts = [];
-            
-            // Generate all hours (0-23) with zero counts
-            for (let i = 0; i < 24; i++) {
-                hours.push(i.toString());
-                counts.push(0);
+        .then(data => renderTransactionVolumeChart(data))
+        .catch(error => {
+            console.error('Error fetching transaction stats:', error);
+        });
+}
+
+/**
+ * Draw the transaction volume chart from hourly counts
+ */
+function renderTransactionVolumeChart(data) {
+    // Prepare chart data
+    const hours = [];
+    const counts = [];
+    
+    // Generate all hours (0-23) with zero counts
+    for (let i = 0; i < 24; i++) {
+        hours.push(i.toString());
+        counts.push(0);
+    }
+    
+    // Update with actual counts from data
+    if (data) {
+        Object.entries(data).forEach(([hour, count]) => {
+            if (!isNaN(parseInt(hour)) && parseInt(hour) >= 0 && parseInt(hour) < 24) {
+                counts[parseInt(hour)] = count;
             }
-            
-            // Update with actual counts from data
-            if (data) {
-                Object.entries(data).forEach(([hour, count]) => {
-                    if (!isNaN(parseInt(hour)) && parseInt(hour) >= 0 && parseInt(hour) < 24) {
-                        counts[parseInt(hour)] = count;
+        });
+    }
+    
+    // Get canvas context
+    const ctx = document.getElementById('hourly-transaction-chart').getContext('2d');
+    
+    // Check if chart already exists
+    const chartInstance = Chart.getChart(ctx);
+    if (chartInstance) {
+        // Update existing chart
+        chartInstance.data.labels = hours.map(h => `${h}:00`);
+        chartInstance.data.datasets[0].data = counts;
+        chartInstance.update();
+    } else {
+        // Create new chart
+        new Chart(ctx, {
+            type: 'line',
+            data: {
+                labels: hours.map(h => `${h}:00`),
+                datasets: [{
+                    label: 'Transactions',
+                    data: counts,
+                    backgroundColor: 'rgba(75, 192, 192, 0.2)',
+                    borderColor: 'rgba(75, 192, 192, 1)',
+                    borderWidth: 2,
+                    pointBackgroundColor: 'rgba(75, 192, 192, 1)',
+                    tension: 0.4,
+                    fill: true
+                }]
+            },
+            options: {
+                responsive: true,
+                scales: {
+                    y: {
+                        beginAtZero: true,
+                        ticks: {
+                            precision: 0
+                        }
                     }
-                });
-            }
-            
-            // Get canvas context
-            const ctx = document.getElementById('hourly-transaction-chart').getContext('2d');
-            
-            // Check if chart already exists
-            const chartInstance = Chart.getChart(ctx);
-            if (chartInstance) {
-                // Update existing chart
-                chartInstance.data.labels = hours.map(h => `${h}:00`);
-                chartInstance.data.datasets[0].data = counts;
-                chartInstance.update();
-            } else {
-                // Create new chart
-                new Chart(ctx, {
-                    type: 'line',
-                    data: {
-                        labels: hours.map(h => `${h}:00`),
-                        datasets: [{
-                            label: 'Transactions',
-                            data: counts,
-                            backgroundColor: 'rgba(75, 192, 192, 0.2)',
-                            borderColor: 'rgba(75, 192, 192, 1)',
-                            borderWidth: 2,
-                            pointBackgroundColor: 'rgba(75, 192, 192, 1)',
-                            tension: 0.4,
-                            fill: true
-                        }]
+                },
+                plugins: {
+                    title: {
+                        display: true,
+                        text: 'Transaction Volume by Hour'
                     },
-                    options: {
-                        responsive: true,
-                        scales: {
-                            y: {
-                                beginAtZero: true,
-                                ticks: {
-                                    precision: 0
-                                }
-                            }
-                        },
-                        plugins: {
-                            title: {
-                                display: true,
-                                text: 'Transaction Volume by Hour'
-                            },
-                            legend: {
-                                display: false
-                            }
-                        }
+                    legend: {
+                        display: false
                     }
-                });
+                }
             }
-        })
-        .catch(error => {
-            console.error('Error fetching transaction stats:', error);
         });
+    }
 }
@@ -3,35 +3,82 @@
  */
 
 document.addEventListener('DOMContentLoaded', function() {
-    // Initialize variables for pagination
+    // Keyset pagination state: cursors of the pages before the current one
+    let cursorStack = [];
+    let currentCursor = null;
+    let nextCursor = null;
     let currentPage = 1;
-    const defaultLimit = 50;
-    let totalPages = 1;
+    
+    // Columns shown in the transactions table
+    const LIST_FIELDS = 'id,mti,transmissionDatetime,amount,terminalId,responseCode,timestamp';
     
     // Set up event listeners
     document.getElementById('refresh-transactions').addEventListener('click', function() {
-        fetchTransactions();
+        loadFirstPage();
     });
     
     document.getElementById('transaction-limit').addEventListener('change', function() {
-        fetchTransactions();
+        loadFirstPage();
     });
     
     document.getElementById('apply-filters').addEventListener('click', function() {
-        fetchTransactions();
+        loadFirstPage();
     });
     
     // Initial load of transactions
-    fetchTransactions();
+    loadFirstPage();
     
-    // Set up refresh interval
-    setInterval(fetchTransactions, 30000);  // Refresh every 30 seconds
+    // Refresh the first page when new transactions are streamed in,
+    // polling only when the stream is unavailable
+    let pollTimer = null;
+    startLiveUpdates({
+        onTransactions: () => {
+            if (currentPage === 1) fetchTransactions(null);
+        },
+        onConnected: () => {
+            clearInterval(pollTimer);
+            pollTimer = null;
+        },
+        onFallback: () => {
+            if (!pollTimer) {
+                pollTimer = setInterval(function() {
+                    if (currentPage === 1) fetchTransactions(null);
+                }, 30000);  // Refresh every 30 seconds
+            }
+        }
+    });
     
     /**
-     * Fetch transactions from the API
+     * Load the first page, discarding pagination history
      */
-    function fetchTransactions(page = 1) {
-        currentPage = page;
+    function loadFirstPage() {
+        cursorStack = [];
+        fetchTransactions(null);
+    }
+    
+    /**
+     * Load the page after the current one
+     */
+    function loadNextPage() {
+        if (!nextCursor) return;
+        cursorStack.push(currentCursor);
+        fetchTransactions(nextCursor);
+    }
+    
+    /**
+     * Load the page before the current one
+     */
+    function loadPreviousPage() {
+        if (cursorStack.length === 0) return;
+        fetchTransactions(cursorStack.pop());
+    }
+    
+    /**
+     * Fetch a page of transactions from the API
+     */
+    function fetchTransactions(cursor) {
+        currentCursor = cursor;
+        currentPage = cursorStack.length + 1;
         
         // Show loading state
         document.getElementById('loading-transactions').style.display = 'block';
@@ -48,7 +95,8 @@ document.addEventListener('DOMContentLoaded', function() {
         // Build query parameters
         let params = new URLSearchParams();
         params.append('limit', limit);
-        params.append('page', currentPage);
+        params.append('fields', LIST_FIELDS);
+        if (cursor) params.append('cursor', cursor);
         
         if (mtiFilter) params.append('mti', mtiFilter);
         if (responseFilter) params.append('response', responseFilter);
@@ -74,19 +122,9 @@ document.addEventListener('DOMContentLoaded', function() {
     function displayTransactions(data) {
         document.getElementById('loading-transactions').style.display = 'none';
         
-        let transactions = [];
-        let metadata = {};
-        
-        // If data is an array, it's just transactions without metadata
-        if (Array.isArray(data)) {
-            transactions = data;
-            totalPages = 1;
-        } else if (data && typeof data === 'object') {
-            // If data has transactions and metadata properties
-            transactions = data.transactions || [];
-            metadata = data.metadata || {};
-            totalPages = metadata.totalPages || 1;
-        }
+        const transactions = (data && data.transactions) || [];
+        const metadata = (data && data.metadata) || {};
+        nextCursor = metadata.nextCursor || null;
         
         // Show empty state if no transactions
         if (!transactions || transactions.length === 0) {
@@ -164,13 +202,13 @@ document.addEventListener('DOMContentLoaded', function() {
         document.getElementById('transactions-table-container').style.display = 'block';
         
         // Update pagination
-        updatePagination(totalPages, currentPage);
+        updatePagination();
     }
     
     /**
      * Update pagination controls
      */
-    function updatePagination(totalPages, currentPage) {
+    function updatePagination() {
         const paginationElement = document.getElementById('transaction-pagination');
         if (!paginationElement) return;
         
@@ -179,46 +217,36 @@ document.addEventListener('DOMContentLoaded', function() {
         
         // Previous button
         const prevItem = document.createElement('li');
-        prevItem.className = `page-item ${currentPage === 1 ? 'disabled' : ''}`;
+        prevItem.className = `page-item ${cursorStack.length === 0 ? 'disabled' : ''}`;
         prevItem.innerHTML = `
-            <a class="page-link" href="#" aria-label="Previous" 
-               ${currentPage > 1 ? `onclick="fetchTransactions(${currentPage - 1}); return false;"` : ''}>
+            <a class="page-link" href="#" aria-label="Previous">
                 <span aria-hidden="true">&laquo;</span>
             </a>
         `;
+        prevItem.querySelector('a').addEventListener('click', function(event) {
+            event.preventDefault();
+            loadPreviousPage();
+        });
         paginationList.appendChild(prevItem);
         
-        // Page numbers
-        const maxPages = 5; // Maximum number of page links to show
-        let startPage = Math.max(1, currentPage - Math.floor(maxPages / 2));
-        let endPage = Math.min(totalPages, startPage + maxPages - 1);
-        
-        // Adjust if we're near the end
-        if (endPage - startPage + 1 < maxPages && startPage > 1) {
-            startPage = Math.max(1, endPage - maxPages + 1);
-        }
-        
-        for (let i = startPage; i <= endPage; i++) {
-            const pageItem = document.createElement('li');
-            pageItem.className = `page-item ${i === currentPage ? 'active' : ''}`;
-            pageItem.innerHTML = `
-                <a class="page-link" href="#" 
-                   ${i !== currentPage ? `onclick="fetchTransactions(${i}); return false;"` : ''}>
-                    ${i}
-                </a>
-            `;
-            paginationList.appendChild(pageItem);
-        }
+        // Current page indicator
+        const pageItem = document.createElement('li');
+        pageItem.className = 'page-item active';
+        pageItem.innerHTML = `<span class="page-link">${currentPage}</span>`;
+        paginationList.appendChild(pageItem);
         
         // Next button
         const nextItem = document.createElement('li');
-        nextItem.className = `page-item ${currentPage === totalPages ? 'disabled' : ''}`;
+        nextItem.className = `page-item ${nextCursor ? '' : 'disabled'}`;
         nextItem.innerHTML = `
-            <a class="page-link" href="#" aria-label="Next" 
-               ${currentPage < totalPages ? `onclick="fetchTransactions(${currentPage + 1}); return false;"` : ''}>
+            <a class="page-link" href="#" aria-label="Next">
                 <span aria-hidden="true">&raquo;</span>
             </a>
         `;
+        nextItem.querySelector('a').addEventListener('click', function(event) {
+            event.preventDefault();
+            loadNextPage();
+        });
         paginationList.appendChild(nextItem);
     }
     
@@ -0,0 +1,141 @@
+"""
+Server-Sent Events fan-out for SillyPostilion.
+
+The processor sync worker publishes small update events (new transactions,
+changed status fields, refreshed statistics) to a single broadcaster. Every
+browser subscribed to /api/stream receives the same feed instead of polling
+the API on its own timers.
+
+Each open stream holds a worker thread, so the number of streams per
+process is capped below the thread count; browsers turned away fall back
+to polling.
+"""
+
+import json
+import queue
+import time
+import logging
+import threading
+from typing import Any, Iterator, List
+
+# Configure logger
+logger = logging.getLogger('stream')
+
+
+class UpdateBroadcaster:
+    """Fans out update events to all connected SSE subscribers"""
+
+    def __init__(self, max_queue: int = 100, heartbeat_seconds: int = 15,
+                 max_connection_seconds: int = 300, retry_ms: int = 5000,
+                 max_subscribers: int = 16):
+        """Initialize the broadcaster
+
+        Args:
+            max_queue: Events buffered per subscriber before it is dropped
+            heartbeat_seconds: Interval between keep-alive comments
+            max_connection_seconds: Lifetime of a stream before the client is
+                asked to reconnect, so long-lived connections are recycled
+            retry_ms: Reconnection delay advertised to the browser
+            max_subscribers: Open streams allowed in this process
+        """
+        self.max_queue = max_queue
+        self.max_subscribers = max_subscribers
+        self.heartbeat_seconds = heartbeat_seconds
+        self.max_connection_seconds = max_connection_seconds
+        self.retry_ms = retry_ms
+        self._subscribers: List[queue.Queue] = []
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        """Read the stream limit from STREAM_MAX_SUBSCRIBERS.
+
+        Keep it well below the worker's thread count, so requests other
+        than streams are still served when it is reached.
+        """
+        self.max_subscribers = app.config.get('STREAM_MAX_SUBSCRIBERS', self.max_subscribers)
+        app.extensions['update_broadcaster'] = self
+
+    def after_fork(self) -> None:
+        """Drop the parent's subscribers in a forked worker"""
+        self._subscribers = []
+        self._lock = threading.Lock()
+
+    @property
+    def subscriber_count(self) -> int:
+        """Number of currently connected subscribers"""
+        with self._lock:
+            return len(self._subscribers)
+
+    @property
+    def has_capacity(self) -> bool:
+        """Whether another stream may be opened in this process
+
+        Checked before a stream starts; concurrent checks may let a few
+        more streams in than the limit.
+        """
+        return self.subscriber_count < self.max_subscribers
+
+    def subscribe(self) -> queue.Queue:
+        """Register a new subscriber and return its event queue"""
+        subscriber = queue.Queue(maxsize=self.max_queue)
+        with self._lock:
+            self._subscribers.append(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber: queue.Queue) -> None:
+        """Remove a subscriber"""
+        with self._lock:
+            if subscriber in self._subscribers:
+                self._subscribers.remove(subscriber)
+
+    def publish(self, event: str, data: Any) -> None:
+        """Send an event to every subscriber
+
+        The payload is serialized once and shared. A subscriber whose queue
+        is full is disconnected; its browser reconnects and resynchronizes.
+        """
+        message = f"event: {event}\ndata: {json.dumps(data, separators=(',', ':'))}\n\n"
+
+        with self._lock:
+            subscribers = list(self._subscribers)
+
+        for subscriber in subscribers:
+            try:
+                subscriber.put_nowait(message)
+            except queue.Full:
+                logger.warning("Dropping slow stream subscriber")
+                self.unsubscribe(subscriber)
+                try:
+                    subscriber.put_nowait(None)
+                except queue.Full:
+                    pass
+
+    def stream(self) -> Iterator[str]:
+        """Yield SSE-formatted messages for one subscriber"""
+        subscriber = self.subscribe()
+        deadline = time.monotonic() + self.max_connection_seconds
+
+        try:
+            yield f"retry: {self.retry_ms}\n\n"
+
+            while time.monotonic() < deadline:
+                try:
+                    message = subscriber.get(timeout=self.heartbeat_seconds)
+                except queue.Empty:
+                    yield ": keep-alive\n\n"
+                    continue
+
+                if message is None:
+                    break
+                yield message
+        finally:
+            self.unsubscribe(subscriber)
+
+
+# Create an instance of the update broadcaster
+update_broadcaster = UpdateBroadcaster()
+
+
+def get_update_broadcaster() -> UpdateBroadcaster:
+    """Return the update broadcaster instance"""
+    return update_broadcaster
@@ -0,0 +1,452 @@
+"""
+Processor synchronisation service for SillyPostilion.
+
+Polls the transaction processor on its own schedule from a background
+thread and writes the results into the local cache. API routes serve
+straight from the cache and use the freshness information recorded here
+to tell the browser how old the data is.
+
+Only one process syncs: the one holding the sync lock file. After every
+cycle it writes its freshness information, the processor statistics and
+the live update events it published to a shared state file. The other
+gunicorn workers follow that file, so their routes report the same
+freshness and their stream subscribers get the same events. When the
+syncing process exits, another worker takes the lock over.
+"""
+
+import os
+import json
+import fcntl
+import logging
+import threading
+import datetime
+from collections import deque
+from typing import Optional, Dict, Any, List
+
+from sqlalchemy import func
+
+from admin import get_admin_module, CONFIG_DIR
+from processor_client import get_processor_client, CircuitOpenError
+from query_profiler import get_query_profiler
+from stream import get_update_broadcaster
+
+# Configure logger
+logger = logging.getLogger('sync')
+
+LOCK_FILE = os.path.join(CONFIG_DIR, 'sync.lock')
+STATE_FILE = os.path.join(CONFIG_DIR, 'sync_state.json')
+
+# Published events kept in the state file for the following workers
+STATE_EVENT_LIMIT = 100
+
+# Seconds between reads of the state file by a following worker
+FOLLOW_INTERVAL = 1
+
+
+def parse_timestamp(value: Optional[str]) -> Optional[datetime.datetime]:
+    """Parse a processor timestamp as naive UTC, or None if it is missing or malformed"""
+    if not value:
+        return None
+    try:
+        parsed = datetime.datetime.fromisoformat(value.replace('Z', '+00:00'))
+    except ValueError:
+        return None
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return parsed
+
+
+class ProcessorSync:
+    """Background worker that mirrors processor data into the local cache"""
+
+    def __init__(self, app=None, transaction_limit: int = 100, max_batches: int = 10):
+        """Initialize the sync service
+
+        Args:
+            app: Flask application to bind to
+            transaction_limit: Number of transactions fetched per request
+            max_batches: Requests per cycle when catching up on a backlog
+        """
+        self.app = None
+        self.transaction_limit = transaction_limit
+        self.max_batches = max_batches
+        self.high_water: Optional[str] = None
+        self.high_water_id: Optional[str] = None
+        self._etags: Dict[str, str] = {}
+        self.stats: Dict[str, Any] = {}
+        self.last_success: Dict[str, datetime.datetime] = {}
+        self.last_error: Dict[str, str] = {}
+        self._status_snapshot: Dict[str, Any] = {}
+        self._published_status: Dict[str, Any] = {}
+        self.leader = False
+        self._circuit: Optional[str] = None
+        self._events: deque = deque(maxlen=STATE_EVENT_LIMIT)
+        self._event_seq = 0
+        self._state_mtime: Optional[float] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stop_event = threading.Event()
+        self._lock = threading.Lock()
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Bind the sync service to the Flask app.
+
+        The worker thread is started lazily on the first request so that
+        it is created inside the serving process rather than at import.
+        """
+        self.app = app
+        app.extensions['processor_sync'] = self
+
+        if app.config.get('PROCESSOR_SYNC_ENABLED', True):
+            app.before_request(self.start)
+
+    @property
+    def running(self) -> bool:
+        """Whether the worker thread is alive"""
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self) -> None:
+        """Start the worker thread if it is not already running"""
+        if self.running:
+            return
+
+        with self._lock:
+            if self.running:
+                return
+
+            self._stop_event.clear()
+            self._thread = threading.Thread(target=self._run, name='processor-sync', daemon=True)
+            self._thread.start()
+            logger.info("Processor sync worker started")
+
+    def stop(self, timeout: Optional[float] = None) -> None:
+        """Signal the worker thread to stop and wait for it"""
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+            logger.info("Processor sync worker stopped")
+
+    def after_fork(self) -> None:
+        """Forget the parent's worker thread so a forked worker starts its own"""
+        self.leader = False
+        self._state_mtime = None
+        self._thread = None
+        self._stop_event = threading.Event()
+        self._lock = threading.Lock()
+
+    def _run(self) -> None:
+        """Worker loop: sync while holding the lock, otherwise follow the shared state"""
+        os.makedirs(CONFIG_DIR, exist_ok=True)
+        lock_file = open(LOCK_FILE, 'w')
+        try:
+            while not self._stop_event.is_set():
+                if not self.leader and self._try_lock(lock_file):
+                    self.leader = True
+                    logger.info(f"Processor sync running in process {os.getpid()}")
+
+                interval = FOLLOW_INTERVAL
+                try:
+                    with self.app.app_context():
+                        if self.leader:
+                            admin_module = get_admin_module()
+                            admin_module.refresh_settings()
+                            interval = max(1, admin_module.get_settings().sync_interval_seconds)
+                            with get_query_profiler().profile('sync'):
+                                self.sync_once()
+                            self._publish_status()
+                            self._save_state()
+                        else:
+                            self._follow_state()
+                except Exception as e:
+                    logger.error(f"Processor sync cycle failed: {str(e)}")
+
+                self._stop_event.wait(interval)
+        finally:
+            # Closing the file releases the lock for another worker
+            lock_file.close()
+            self.leader = False
+
+    @staticmethod
+    def _try_lock(lock_file) -> bool:
+        """Take the cross-process sync lock without blocking"""
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return True
+        except OSError:
+            return False
+
+    def _publish(self, event: str, data: Any) -> None:
+        """Publish a live update here and record it for the following workers"""
+        get_update_broadcaster().publish(event, data)
+        self._event_seq += 1
+        self._events.append({'seq': self._event_seq, 'event': event, 'data': data})
+
+    def _save_state(self) -> None:
+        """Write freshness, statistics and recent events for the following workers"""
+        state = {
+            'pid': os.getpid(),
+            'seq': self._event_seq,
+            'events': list(self._events),
+            'stats': self.stats,
+            'status': self._status_snapshot,
+            'circuit': get_processor_client().breaker.state.value,
+            'lastSuccess': {resource: at.isoformat() for resource, at in self.last_success.items()},
+            'lastError': self.last_error
+        }
+        with open(STATE_FILE + '.tmp', 'w') as f:
+            json.dump(state, f, default=str)
+        os.replace(STATE_FILE + '.tmp', STATE_FILE)
+
+    def _follow_state(self) -> None:
+        """Adopt the syncing process's state and replay the events published since the last read"""
+        try:
+            mtime = os.path.getmtime(STATE_FILE)
+            if mtime == self._state_mtime:
+                return
+            with open(STATE_FILE, 'r') as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return
+
+        if self._state_mtime is not None and state['seq'] >= self._event_seq:
+            broadcaster = get_update_broadcaster()
+            for event in state['events']:
+                if event['seq'] > self._event_seq:
+                    broadcaster.publish(event['event'], event['data'])
+        # A syncing process started afresh numbers its events from zero
+        self._event_seq = state['seq']
+        self._events = deque(state['events'], maxlen=STATE_EVENT_LIMIT)
+        self._state_mtime = mtime
+
+        self.stats = state['stats']
+        self._status_snapshot = state['status']
+        self._circuit = state['circuit']
+        self.last_success = {resource: datetime.datetime.fromisoformat(at)
+                             for resource, at in state['lastSuccess'].items()}
+        self.last_error = state['lastError']
+
+    def sync_once(self) -> None:
+        """Fetch every resource from the processor and update the cache.
+
+        Does nothing while the portal is in offline mode, so the routes
+        keep serving whatever is already cached.
+        """
+        if get_admin_module().get_settings().offline_mode:
+            return
+
+        # Imported here to avoid a circular import with routes
+        from routes import update_transaction_cache, update_status_cache
+
+        status_data = self._fetch('status', '/status', conditional=True)
+        if status_data is not None:
+            status = update_status_cache(status_data)
+            if status is not None:
+                self._status_snapshot = {
+                    'status': status.status,
+                    'startTime': status.start_time.isoformat() if status.start_time else None,
+                    'transactionsProcessed': status.transactions_processed,
+                    'lastUpdated': status.last_updated.isoformat() if status.last_updated else None
+                }
+            self._mark_success('status')
+
+        added = self._sync_transactions(update_transaction_cache)
+        if added:
+            self._publish('transactions', [self._transaction_delta(txn) for txn in added])
+
+        stats_data = self._fetch('stats', '/stats', conditional=True)
+        if stats_data is not None:
+            if stats_data != self.stats:
+                self._publish('stats', stats_data)
+            self.stats = stats_data
+            self._mark_success('stats')
+
+    def _sync_transactions(self, update_transaction_cache) -> List[Dict[str, Any]]:
+        """Pull transactions newer than the high-water mark into the cache
+
+        Rows are requested oldest first after the (timestamp, id) of the
+        last row seen, so a cycle only moves what arrived since the previous
+        one, and a run of rows sharing one timestamp is paged through rather
+        than fetched again. The mark only advances once a batch is committed
+        to the cache. Full batches are followed up immediately, up to
+        max_batches per cycle. Before the first batch only the timestamp is
+        known, so rows at exactly that timestamp come back again and are
+        skipped by the cache's ID check.
+
+        Returns:
+            The processor records that were added to the cache
+        """
+        if self.high_water is None:
+            self.high_water = self._cached_high_water()
+
+        added: List[Dict[str, Any]] = []
+        for _ in range(self.max_batches):
+            params = {'limit': self.transaction_limit}
+            if self.high_water:
+                params['since'] = self.high_water
+                if self.high_water_id:
+                    params['sinceId'] = self.high_water_id
+
+            transactions = self._fetch('transactions', '/transactions', params=params)
+            if transactions is None:
+                break
+
+            try:
+                added.extend(update_transaction_cache(transactions))
+            except Exception:
+                # Keep the mark, so the batch is fetched again next cycle
+                break
+            self._mark_success('transactions')
+
+            mark = (self.high_water, self.high_water_id)
+            newest = (parse_timestamp(self.high_water), self.high_water_id or '')
+            for txn in transactions:
+                position = (parse_timestamp(txn.get('timestamp')), txn.get('id') or '')
+                if position[0] is not None and (newest[0] is None or position > newest):
+                    newest = position
+                    mark = (txn['timestamp'], txn.get('id'))
+            advanced = mark != (self.high_water, self.high_water_id)
+            self.high_water, self.high_water_id = mark
+
+            # Without a mark the processor returns only the most recent rows
+            if 'since' not in params or len(transactions) < self.transaction_limit or not advanced:
+                break
+
+        return added
+
+    @staticmethod
+    def _cached_high_water() -> Optional[str]:
+        """Timestamp of the newest cached transaction, if any"""
+        from models import Transaction, db
+        from partitions import get_transaction_partitions
+        from archive import get_transaction_archive
+
+        newest = db.session.query(func.max(Transaction.timestamp)).scalar()
+        if newest is None:
+            # The main table is empty after a quiet spell; sealed and archived months still count
+            newest = get_transaction_partitions().newest_timestamp() or get_transaction_archive().newest_timestamp()
+        return newest.isoformat() if newest else None
+
+    def _publish_status(self) -> None:
+        """Publish the status fields that changed since the last event"""
+        freshness = self.freshness('status')
+        snapshot = dict(
+            self._status_snapshot,
+            stale=freshness['stale'],
+            syncedAt=freshness['syncedAt'],
+            offlineMode=freshness['offlineMode'],
+            processorCircuit=freshness['circuit']
+        )
+
+        delta = {
+            key: value for key, value in snapshot.items()
+            if key not in self._published_status or self._published_status[key] != value
+        }
+        if delta:
+            self._publish('status', delta)
+            self._published_status = snapshot
+
+    @staticmethod
+    def _transaction_delta(txn_data: Dict[str, Any]) -> Dict[str, Any]:
+        """Map a processor record to the list fields used by the dashboard
+
+        The raw message is left out; clients fetch it on demand.
+        """
+        return {
+            'id': txn_data.get('id'),
+            'mti': txn_data.get('mti'),
+            'processingCode': txn_data.get('processingCode'),
+            'amount': txn_data.get('amount'),
+            'transmissionDatetime': txn_data.get('transmissionDateTime'),
+            'stan': txn_data.get('stan'),
+            'rrn': txn_data.get('rrn'),
+            'responseCode': txn_data.get('responseCode'),
+            'terminalId': txn_data.get('terminalId'),
+            'merchantId': txn_data.get('merchantId'),
+            'direction': txn_data.get('direction'),
+            'timestamp': txn_data.get('timestamp')
+        }
+
+    def _fetch(self, resource: str, path: str, params: Optional[Dict[str, Any]] = None,
+               conditional: bool = False) -> Optional[Any]:
+        """GET a processor API path, returning the decoded JSON or None
+
+        Args:
+            resource: Resource name used for freshness tracking
+            path: Path relative to the processor API root
+            params: Query string parameters
+            conditional: Revalidate with the last ETag seen for the path. A
+                304 counts as a successful sync and returns None, leaving
+                the cached copy in place.
+        """
+        headers = {}
+        if conditional and path in self._etags:
+            headers['If-None-Match'] = self._etags[path]
+
+        try:
+            response = get_processor_client().get(path, params=params, headers=headers)
+
+            if response.status_code == 304:
+                self._mark_success(resource)
+                return None
+
+            if response.status_code == 200:
+                if conditional and response.headers.get('ETag'):
+                    self._etags[path] = response.headers['ETag']
+                return response.json()
+
+            self.last_error[resource] = f"HTTP {response.status_code}"
+            logger.warning(f"Failed to get {resource} from processor: {response.status_code}")
+        except CircuitOpenError as e:
+            # Fail fast; the routes keep serving cached data
+            self.last_error[resource] = str(e)
+        except Exception as e:
+            self.last_error[resource] = str(e)
+            logger.error(f"Error fetching {resource} from processor: {str(e)}")
+
+        return None
+
+    def _mark_success(self, resource: str) -> None:
+        """Record a successful sync of a resource"""
+        self.last_success[resource] = datetime.datetime.utcnow()
+        self.last_error.pop(resource, None)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Return the last transaction statistics received from the processor"""
+        return self.stats
+
+    def freshness(self, resource: str) -> Dict[str, Any]:
+        """Describe how fresh the cached copy of a resource is
+
+        Data is considered stale when it has never been synced or when
+        more than three sync intervals have passed since the last success.
+        """
+        settings = get_admin_module().get_settings()
+        synced_at = self.last_success.get(resource)
+        age = None
+        stale = True
+
+        if synced_at is not None:
+            age = (datetime.datetime.utcnow() - synced_at).total_seconds()
+            stale = age > 3 * max(1, settings.sync_interval_seconds)
+
+        return {
+            'syncedAt': synced_at.isoformat() + 'Z' if synced_at else None,
+            'ageSeconds': round(age, 1) if age is not None else None,
+            'stale': stale,
+            'offlineMode': settings.offline_mode,
+            'circuit': get_processor_client().breaker.state.value if self.leader or self._circuit is None
+            else self._circuit,
+            'error': self.last_error.get(resource)
+        }
+
+
+# Create an instance of the sync service
+processor_sync = ProcessorSync()
+
+
+def get_processor_sync() -> ProcessorSync:
+    """Return the processor sync instance"""
+    return processor_sync
@@ -0,0 +1,117 @@
+"""
+Shared fixtures for the web portal tests.
+
+Each test gets its own application on a fresh SQLite database, run from a
+temporary working directory so the config, lock and checkpoint files the
+portal keeps next to it do not leak between tests. Background workers
+that would call the transaction processor or re-encrypt rows on their own
+are turned off; tests drive them directly.
+"""
+
+import os
+import sys
+import tempfile
+
+from cryptography.fernet import Fernet
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('LOG_LEVEL', 'WARNING')
+os.environ.setdefault('ENCRYPTION_KEY', Fernet.generate_key().decode('utf-8'))
+
+# Log files are opened relative to the directory the modules are imported from
+os.chdir(tempfile.mkdtemp(prefix='portal-tests-'))
+
+import pytest  # noqa: E402
+
+
+@pytest.fixture(scope='session', autouse=True)
+def session_state(tmp_path_factory):
+    """Audit file and admin settings for work done outside a test
+
+    The audit writer thread and the exit handlers outlive each test, so
+    they get an absolute audit path and an admin module that is not
+    created in whatever directory the process ends in, and are drained
+    before pytest returns to that directory.
+    """
+    import admin
+    from access_stats import get_access_stats
+    from audit import get_audit_log
+
+    audit_log = get_audit_log()
+    audit_log.path = str(tmp_path_factory.mktemp('audit') / 'audit.log')
+    admin.admin_module = admin.AdminModule()
+    yield
+    # Flush and drain while still in the temporary directory, so the exit
+    # handlers have nothing left to write
+    get_access_stats().stop()
+    audit_log.stop()
+
+
+@pytest.fixture
+def app(tmp_path, monkeypatch):
+    """Application on a fresh database in a temporary working directory"""
+    import admin
+    from app import create_app
+    from extensions import db
+    from security import security_manager
+    from partitions import get_transaction_partitions
+
+    monkeypatch.chdir(tmp_path)
+    # Load the admin settings from this test's config directory
+    monkeypatch.setattr(admin, 'admin_module', None)
+    keys = list(security_manager.encryption_keys)
+
+    app = create_app({
+        'TESTING': True,
+        'WTF_CSRF_ENABLED': False,
+        'SQLALCHEMY_DATABASE_URI': f"sqlite:///{tmp_path / 'cache.db'}",
+        'AUTO_MIGRATE': False,
+        'PROCESSOR_SYNC_ENABLED': False,
+        'FIELD_MIGRATION_ENABLED': False,
+        'PARTITION_DIR': str(tmp_path / 'partitions'),
+        'ARCHIVE_DIR': str(tmp_path / 'archive'),
+        'PROFILE_DIR': str(tmp_path / 'profiles'),
+    })
+    with app.app_context():
+        db.create_all()
+
+    yield app
+
+    with app.app_context():
+        db.session.remove()
+        db.engine.dispose()
+    # Partition engines are cached by month and would outlive this test's files
+    get_transaction_partitions().after_fork()
+    security_manager.set_encryption_keys(keys)
+
+
+@pytest.fixture
+def client(app):
+    """Test client logged in as an administrator"""
+    from extensions import db
+    from models import User
+
+    with app.app_context():
+        db.session.add(User(username='admin', email='admin@example.com', password='secret', is_admin=True))
+        db.session.commit()
+
+    client = app.test_client()
+    response = client.post('/auth/login', data={'username': 'admin', 'password': 'secret'})
+    assert response.status_code == 302
+    return client
+
+
+@pytest.fixture
+def add_transactions(app):
+    """Cache processor records as the sync worker does
+
+    Records are processor JSON dicts; missing fields get defaults.
+    """
+    from routes import update_transaction_cache
+
+    def add(records):
+        defaults = {'mti': '0200', 'processingCode': '000000', 'responseCode': '00', 'direction': 'INBOUND'}
+        with app.app_context():
+            return update_transaction_cache([dict(defaults, **record) for record in records])
+
+    return add
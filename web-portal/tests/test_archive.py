@@ -0,0 +1,82 @@
+"""Archiving sealed months and reading them back"""
+
+import os
+
+from archive import get_transaction_archive
+from integrity import get_integrity_tree
+from partitions import get_transaction_partitions
+
+
+def _add_old_months(add_transactions):
+    add_transactions([
+        {'id': f'T{month}{i:02d}', 'amount': 500 + i, 'terminalId': f'TERM{month}', 'merchantId': 'MERCH01',
+         'timestamp': f'2025-{month:02d}-{10 + i:02d}T10:00:00Z'}
+        for month in (1, 2, 3) for i in range(4)
+    ])
+
+
+def test_archived_months_read_back(app, client, add_transactions):
+    _add_old_months(add_transactions)
+
+    with app.app_context():
+        partitions = get_transaction_partitions()
+        archive = get_transaction_archive()
+        partitions.seal_closed_months()
+
+        assert archive.archive_month('2025-02') == 4
+        assert archive.months() == ['2025-02']
+        assert '2025-02' not in partitions.months()
+
+        txn = archive.get('T201')
+        assert txn.amount == '501'
+        assert txn.terminal_id == 'TERM2'
+        assert get_integrity_tree().verify(full=True)['ok']
+
+    detail = client.get('/api/transactions/T203')
+    assert detail.status_code == 200
+    assert detail.get_json()['merchantId'] == 'MERCH01'
+    found = client.get('/api/transactions', query_string={'search': 'TERM2'}).get_json()
+    assert sorted(txn['id'] for txn in found['transactions']) == ['T200', 'T201', 'T202', 'T203']
+
+
+def test_archiving_waits_for_a_writer_in_another_process(app, add_transactions):
+    import fcntl
+    import threading
+    from archive import LOCK_FILE
+
+    _add_old_months(add_transactions)
+    with app.app_context():
+        get_transaction_partitions().seal_closed_months()
+
+    def archive_month():
+        with app.app_context():
+            get_transaction_archive().archive_month('2025-01')
+
+    os.makedirs(os.path.dirname(LOCK_FILE), exist_ok=True)
+    with open(LOCK_FILE, 'w') as held:
+        # Another worker is re-encrypting the archive
+        fcntl.flock(held, fcntl.LOCK_EX)
+        worker = threading.Thread(target=archive_month)
+        worker.start()
+        worker.join(0.3)
+        assert worker.is_alive()
+        assert get_transaction_archive().months() == []
+
+    worker.join(5)
+    assert get_transaction_archive().months() == ['2025-01']
+
+
+def test_purge_skips_months_another_process_purged(app, add_transactions, monkeypatch):
+    _add_old_months(add_transactions)
+
+    with app.app_context():
+        get_transaction_partitions().seal_closed_months()
+        archive = get_transaction_archive()
+        archive.archive_month('2025-01')
+        archive.archive_month('2025-02')
+        # Another worker purges 2025-01 between the listing and this purge
+        listed = archive.months()
+        monkeypatch.setattr(archive, 'months', lambda: listed)
+        os.remove(archive._manifest_path('2025-01'))
+
+        assert archive.purge_expired(retention_days=30) == ['2025-02']
@@ -0,0 +1,59 @@
+"""Audit file writes and rotation shared between worker processes"""
+
+import glob
+import json
+import multiprocessing
+
+import pytest
+
+from admin import get_admin_module
+from audit import AuditLog
+
+
+@pytest.fixture
+def small_files(tmp_path, monkeypatch):
+    """Rotate after about 2 KB, from a temporary working directory"""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(get_admin_module().get_settings(), 'audit_rotate_mb', 2 / 1024)
+    return str(tmp_path / 'audit.log')
+
+
+def _records(path):
+    records = []
+    for name in glob.glob(f"{path}*"):
+        with open(name, encoding='utf-8') as f:
+            records += [json.loads(line) for line in f]
+    return records
+
+
+def _write_from_process(path, worker, count):
+    audit_log = AuditLog(path)
+    for i in range(count):
+        audit_log._write([{'event': 'TEST', 'worker': worker, 'seq': i}])
+
+
+def test_concurrent_rotation_keeps_every_record(small_files):
+    context = multiprocessing.get_context('fork')
+    workers = [context.Process(target=_write_from_process, args=(small_files, worker, 200)) for worker in range(4)]
+    for process in workers:
+        process.start()
+    for process in workers:
+        process.join()
+
+    records = _records(small_files)
+    assert len(glob.glob(f"{small_files}.*")) > 4
+    assert len(records) == 800
+    assert {(record['worker'], record['seq']) for record in records} == {
+        (worker, i) for worker in range(4) for i in range(200)}
+
+
+def test_writer_reopens_the_file_another_process_rotated(small_files):
+    first, second = AuditLog(small_files), AuditLog(small_files)
+    first._write([{'event': 'FIRST', 'padding': 'x' * 3000}])
+
+    # The second writer finds the file over the limit and rotates it
+    second._write([{'event': 'SECOND'}])
+    first._write([{'event': 'AFTER'}])
+
+    with open(small_files, encoding='utf-8') as f:
+        assert [json.loads(line)['event'] for line in f] == ['SECOND', 'AFTER']
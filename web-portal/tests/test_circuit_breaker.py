@@ -0,0 +1,75 @@
+"""State changes of the processor client's circuit breaker"""
+
+import time
+
+import pytest
+
+from processor_client import CircuitBreaker, CircuitState, ProcessorClient
+
+
+def test_opens_after_consecutive_failures():
+    breaker = CircuitBreaker(failure_threshold=3, reset_timeout=60)
+
+    breaker.record_failure()
+    breaker.record_failure()
+    assert breaker.state == CircuitState.CLOSED
+    assert breaker.allow_request()
+
+    breaker.record_failure()
+    assert breaker.state == CircuitState.OPEN
+    assert not breaker.allow_request()
+
+
+def test_success_resets_the_failure_count():
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=60)
+
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+
+    assert breaker.state == CircuitState.CLOSED
+
+
+def test_half_open_lets_one_probe_through_and_closes_on_success():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.05)
+    breaker.record_failure()
+    assert breaker.state == CircuitState.OPEN
+
+    time.sleep(0.06)
+    assert breaker.state == CircuitState.HALF_OPEN
+    assert breaker.allow_request()
+    assert not breaker.allow_request()
+
+    breaker.record_success()
+    assert breaker.state == CircuitState.CLOSED
+    assert breaker.failures == 0
+    assert breaker.allow_request()
+
+
+def test_failed_probe_opens_the_circuit_again():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.05)
+    breaker.record_failure()
+    time.sleep(0.06)
+    assert breaker.allow_request()
+
+    breaker.record_failure()
+
+    assert breaker.state == CircuitState.OPEN
+    assert not breaker.allow_request()
+
+
+def test_session_failure_does_not_hold_the_half_open_probe(monkeypatch):
+    client = ProcessorClient()
+    client.breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.05)
+    client.breaker.record_failure()
+    time.sleep(0.06)
+
+    def broken_session():
+        raise RuntimeError('settings unavailable')
+
+    monkeypatch.setattr(client, '_get_session', broken_session)
+    with pytest.raises(RuntimeError):
+        client.get('/status')
+
+    assert client.breaker.state == CircuitState.HALF_OPEN
+    assert client.breaker.allow_request()
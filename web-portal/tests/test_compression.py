@@ -0,0 +1,47 @@
+"""Gzip negotiation on the JSON API"""
+
+import gzip
+
+
+def _add_rows(add_transactions, count):
+    add_transactions([
+        {'id': f'T{i:04d}', 'amount': 100 + i, 'terminalId': f'TERM{i:04d}', 'merchantId': 'MERCH01',
+         'timestamp': f'2026-10-01T10:{i // 60:02d}:{i % 60:02d}Z'}
+        for i in range(count)
+    ])
+
+
+def test_large_responses_are_gzipped_for_clients_that_accept_it(client, add_transactions):
+    _add_rows(add_transactions, 50)
+
+    plain = client.get('/api/transactions?limit=50')
+    compressed = client.get('/api/transactions?limit=50', headers={'Accept-Encoding': 'gzip, deflate'})
+
+    assert 'Content-Encoding' not in plain.headers
+    assert 'Accept-Encoding' in plain.headers['Vary']
+    assert compressed.headers['Content-Encoding'] == 'gzip'
+    assert 'Accept-Encoding' in compressed.headers['Vary']
+    assert len(compressed.data) < len(plain.data)
+    assert gzip.decompress(compressed.data) == plain.data
+
+
+def test_gzip_is_skipped_when_refused_or_small(client, add_transactions):
+    _add_rows(add_transactions, 50)
+
+    refused = client.get('/api/transactions?limit=50', headers={'Accept-Encoding': 'gzip;q=0, identity'})
+    small = client.get('/api/transactions/T0001', headers={'Accept-Encoding': 'gzip'})
+
+    assert 'Content-Encoding' not in refused.headers
+    assert small.status_code == 200
+    assert 'Content-Encoding' not in small.headers
+
+
+def test_not_modified_responses_are_not_compressed(client, add_transactions):
+    _add_rows(add_transactions, 50)
+    etag = client.get('/api/transactions?limit=50', headers={'Accept-Encoding': 'gzip'}).headers['ETag']
+
+    response = client.get('/api/transactions?limit=50',
+                          headers={'Accept-Encoding': 'gzip', 'If-None-Match': etag})
+
+    assert response.status_code == 304
+    assert 'Content-Encoding' not in response.headers
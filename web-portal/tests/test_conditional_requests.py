@@ -0,0 +1,34 @@
+"""Weak ETag revalidation of cached API responses"""
+
+
+def _add_rows(add_transactions, count):
+    add_transactions([
+        {'id': f'T{i:04d}', 'amount': 100 + i, 'terminalId': f'TERM{i:04d}', 'merchantId': 'MERCH01',
+         'timestamp': f'2026-10-01T10:{i // 60:02d}:{i % 60:02d}Z'}
+        for i in range(count)
+    ])
+
+
+def test_unchanged_page_revalidates_with_304(client, add_transactions):
+    _add_rows(add_transactions, 5)
+
+    first = client.get('/api/transactions')
+    etag = first.headers['ETag']
+    assert first.status_code == 200
+    assert etag.startswith('W/')
+    assert first.headers['Cache-Control'] == 'no-cache'
+
+    again = client.get('/api/transactions', headers={'If-None-Match': etag})
+    assert again.status_code == 304
+    assert again.data == b''
+
+
+def test_new_rows_change_the_etag(client, add_transactions):
+    _add_rows(add_transactions, 5)
+    etag = client.get('/api/transactions').headers['ETag']
+
+    add_transactions([{'id': 'T9999', 'timestamp': '2026-10-02T10:00:00Z'}])
+
+    response = client.get('/api/transactions', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.headers['ETag'] != etag
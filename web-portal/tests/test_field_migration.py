@@ -0,0 +1,122 @@
+"""Encryption keyring rotation and background re-encryption under a new primary key"""
+
+import json
+
+from cryptography.fernet import Fernet
+
+from field_migration import FieldEncryptionMigrator, CHECKPOINT_FILE
+from security import SecurityManager, security_manager
+
+
+def _manager(*keys):
+    manager = SecurityManager()
+    manager.set_encryption_keys(list(keys))
+    return manager
+
+
+def _sealed_with_primary(app):
+    from models import Transaction
+
+    with app.app_context():
+        return {
+            txn.id: not any(security_manager.needs_reencryption(getattr(txn, f'_{field}'))
+                            for field in ('amount', 'terminal_id', 'merchant_id'))
+            for txn in Transaction.query.order_by(Transaction.id)
+        }
+
+
+def _add_rows(add_transactions):
+    add_transactions([
+        {'id': f'T{i:04d}', 'amount': 100 + i, 'terminalId': f'TERM{i:04d}', 'merchantId': 'MERCH01',
+         'timestamp': f'2026-10-01T10:00:{i:02d}Z'}
+        for i in range(10)
+    ])
+
+
+def _rotate_key():
+    security_manager.set_encryption_keys([Fernet.generate_key().decode('utf-8')] + security_manager.encryption_keys)
+    return security_manager.key_ids()[0]
+
+
+def test_rotated_keyring_decrypts_values_sealed_with_older_keys():
+    old_key, new_key = Fernet.generate_key().decode('utf-8'), Fernet.generate_key().decode('utf-8')
+    encrypted = _manager(old_key).encrypt_data('secret', codec='str')
+
+    rotated = _manager(new_key, old_key)
+
+    assert rotated.decrypt_data(encrypted, codec='str') == 'secret'
+    assert rotated.needs_reencryption(encrypted)
+    assert _manager(new_key).decrypt_data(encrypted, codec='str') is None
+
+
+def test_blind_indexes_cover_every_key_in_the_ring():
+    old_key, new_key = Fernet.generate_key().decode('utf-8'), Fernet.generate_key().decode('utf-8')
+    old_index = _manager(old_key).blind_index('TERM0001', 'terminal_id')
+
+    indexes = _manager(new_key, old_key).blind_indexes('TERM0001', 'terminal_id')
+
+    assert len(indexes) == 2
+    assert indexes[1] == old_index
+
+
+def test_search_finds_rows_indexed_under_an_older_key(client, add_transactions):
+    add_transactions([
+        {'id': 'T0001', 'terminalId': 'TERM0001', 'timestamp': '2026-10-01T10:00:00Z'},
+    ])
+
+    _rotate_key()
+    add_transactions([
+        {'id': 'T0002', 'terminalId': 'TERM0001', 'timestamp': '2026-10-01T10:01:00Z'},
+    ])
+
+    response = client.get('/api/transactions', query_string={'search': 'TERM0001'})
+    assert sorted(txn['id'] for txn in response.get_json()['transactions']) == ['T0001', 'T0002']
+
+
+def test_migration_reencrypts_every_row(app, add_transactions):
+    _add_rows(add_transactions)
+    key_id = _rotate_key()
+    migrator = FieldEncryptionMigrator(app, batch_size=3)
+
+    migrator._run()
+
+    assert all(_sealed_with_primary(app).values())
+    assert migrator.migrated == 10
+    assert migrator.finished
+    with open(CHECKPOINT_FILE) as f:
+        checkpoint = json.load(f)
+    assert checkpoint['key_id'] == key_id and checkpoint['complete']
+
+
+def test_migration_resumes_after_the_checkpoint(app, add_transactions):
+    from models import Transaction
+
+    _add_rows(add_transactions)
+    key_id = _rotate_key()
+    with open(CHECKPOINT_FILE, 'w') as f:
+        json.dump({'key_id': key_id, 'source': 'main', 'last_id': 'T0003',
+                   'migrated': 4, 'skipped': 0, 'complete': False}, f)
+    migrator = FieldEncryptionMigrator(app, batch_size=3)
+
+    migrator._run()
+
+    sealed = _sealed_with_primary(app)
+    # Rows up to the checkpoint are taken as done and left alone
+    assert [txn_id for txn_id, done in sealed.items() if not done] == ['T0000', 'T0001', 'T0002', 'T0003']
+    assert migrator.migrated == 4 + 6
+    with app.app_context():
+        assert [txn.amount for txn in Transaction.query.order_by(Transaction.id)] == [str(100 + i) for i in range(10)]
+
+
+def test_checkpoint_for_another_key_starts_over(app, add_transactions):
+    _add_rows(add_transactions)
+    _rotate_key()
+    with open(CHECKPOINT_FILE, 'w') as f:
+        json.dump({'key_id': 'deadbeef', 'source': 'main', 'last_id': 'T0008',
+                   'migrated': 9, 'skipped': 0, 'complete': False}, f)
+    migrator = FieldEncryptionMigrator(app, batch_size=3)
+
+    migrator._run()
+
+    assert all(_sealed_with_primary(app).values())
+    assert migrator.migrated == 10
@@ -0,0 +1,34 @@
+"""Server-side filters on /api/transactions"""
+
+import pytest
+
+
+def _ids(client, **filters):
+    response = client.get('/api/transactions', query_string=filters)
+    assert response.status_code == 200
+    return sorted(txn['id'] for txn in response.get_json()['transactions'])
+
+
+@pytest.fixture
+def rows(add_transactions):
+    add_transactions([
+        {'id': 'T0001', 'mti': '0200', 'responseCode': '00', 'timestamp': '2026-10-01T10:00:01Z'},
+        {'id': 'T0002', 'mti': '0210', 'responseCode': '05', 'timestamp': '2026-10-01T10:00:02Z'},
+        {'id': 'T0003', 'mti': '0400', 'responseCode': None, 'timestamp': '2026-10-01T10:00:03Z'},
+        {'id': 'T0004', 'mti': '9910', 'responseCode': '00', 'timestamp': '2026-10-01T10:00:04Z'},
+    ])
+
+
+def test_declined_includes_rows_without_a_response_code(client, rows):
+    assert _ids(client, response='declined') == ['T0002', 'T0003']
+    assert _ids(client, response='00') == ['T0001', 'T0004']
+
+
+@pytest.mark.parametrize('mti, expected', [
+    ('02', ['T0001', 'T0002']),
+    ('04', ['T0003']),
+    ('99', ['T0004']),
+    ('0210', ['T0002']),
+])
+def test_mti_prefix_and_exact_filters(client, rows, mti, expected):
+    assert _ids(client, mti=mti) == expected
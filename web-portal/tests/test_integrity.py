@@ -0,0 +1,73 @@
+"""Merkle tree append, verification and inclusion proofs"""
+
+from integrity import get_integrity_tree, verify_proof
+
+
+def _add_rows(add_transactions, count, day='2026-10-01', start=0):
+    # Integer amounts and empty IDs change form on their way through encryption
+    add_transactions([
+        {'id': f'T{i:04d}', 'amount': 100 + i, 'terminalId': '' if i % 3 == 0 else f'TERM{i:04d}',
+         'merchantId': None, 'rawMessage': f'0200{i:012d}', 'timestamp': f'{day}T10:{i // 60:02d}:{i % 60:02d}Z'}
+        for i in range(start, start + count)
+    ])
+
+
+def test_appended_rows_verify_after_reading_them_back(app, add_transactions):
+    _add_rows(add_transactions, 7)
+    _add_rows(add_transactions, 6, start=7)
+    _add_rows(add_transactions, 3, day='2026-10-02', start=13)
+
+    with app.app_context():
+        tree = get_integrity_tree()
+        root = tree.root()
+        report = tree.verify(full=True)
+
+    assert root['buckets'] == 2
+    assert root['transactions'] == 16
+    assert report['ok'], report['failed']
+    assert report['root'] == root['root']
+
+
+def test_verify_skips_unchanged_buckets(app, add_transactions):
+    _add_rows(add_transactions, 5)
+
+    with app.app_context():
+        tree = get_integrity_tree()
+        assert tree.verify()['verified'] == 1
+        assert tree.verify()['skipped'] == 1
+
+
+def test_inclusion_proof_checks_against_bucket_and_overall_root(app, add_transactions):
+    _add_rows(add_transactions, 11)
+    _add_rows(add_transactions, 2, day='2026-10-02', start=11)
+
+    with app.app_context():
+        tree = get_integrity_tree()
+        proof = tree.proof('T0006')
+        root = tree.root()['root']
+        assert tree.proof('T9999') is None
+
+    assert proof['bucket'] == '2026-10-01'
+    assert verify_proof(proof['leaf'], proof['path'], proof['bucketRoot'])
+    assert verify_proof(proof['bucketRoot'], proof['bucketPath'], proof['root'])
+    assert proof['root'] == root
+    assert not verify_proof(proof['leaf'], proof['path'][1:], proof['bucketRoot'])
+
+
+def test_modified_and_deleted_rows_are_reported(app, add_transactions):
+    from extensions import db
+    from models import Transaction
+
+    _add_rows(add_transactions, 6)
+    with app.app_context():
+        table = Transaction.__table__
+        db.session.execute(table.update().where(table.c.id == 'T0002').values(stan='999999'))
+        db.session.execute(table.delete().where(table.c.id == 'T0004'))
+        db.session.commit()
+
+        report = get_integrity_tree().verify(full=True)
+
+    assert not report['ok']
+    failed = report['failed'][0]
+    assert failed['modified'] == ['T0002']
+    assert failed['missing'] == ['T0004']
@@ -0,0 +1,125 @@
+"""Keyset cursor paging of /api/transactions"""
+
+import base64
+import json
+from datetime import datetime
+from types import SimpleNamespace
+
+import pytest
+
+from routes import encode_cursor, decode_cursor
+
+
+def _cursor(value):
+    return base64.urlsafe_b64encode(json.dumps(value).encode('utf-8')).decode('ascii')
+
+
+def _page_through(client, limit, **params):
+    """Follow nextCursor from the first page to the last, returning the IDs in order"""
+    ids, cursor = [], ''
+    while True:
+        response = client.get('/api/transactions', query_string=dict(params, limit=limit, cursor=cursor))
+        assert response.status_code == 200
+        data = response.get_json()
+        ids += [txn['id'] for txn in data['transactions']]
+        cursor = data['metadata']['nextCursor']
+        if cursor is None:
+            return ids
+
+
+def test_cursor_round_trip():
+    txn = SimpleNamespace(timestamp=datetime(2026, 10, 1, 12, 30, 15, 250000), id='T0001')
+
+    assert decode_cursor(encode_cursor(txn)) == (txn.timestamp, 'T0001')
+
+
+def test_null_timestamp_cursor_decodes_to_the_end_of_the_order():
+    txn = SimpleNamespace(timestamp=None, id='T0001')
+
+    assert decode_cursor(encode_cursor(txn)) == (datetime.min, 'T0001')
+
+
+@pytest.mark.parametrize('cursor', [
+    'not base64!',
+    base64.urlsafe_b64encode(b'not json').decode('ascii'),
+    _cursor(['2026-10-01T12:00:00']),
+    _cursor(['yesterday', 'T0001']),
+    _cursor(['2026-10-01T12:00:00', None]),
+    _cursor(['2026-10-01T12:00:00', 42]),
+])
+def test_invalid_cursors_are_rejected(client, cursor):
+    with pytest.raises(ValueError):
+        decode_cursor(cursor)
+
+    response = client.get('/api/transactions', query_string={'cursor': cursor})
+    assert response.status_code == 400
+    assert response.get_json()['error'] == 'Invalid cursor'
+
+
+def test_pages_return_every_row_once_newest_first(client, add_transactions):
+    add_transactions([
+        {'id': f'T{i:04d}', 'timestamp': f'2026-10-{1 + i % 5:02d}T10:00:00Z'}
+        for i in range(23)
+    ])
+
+    ids = _page_through(client, limit=4)
+
+    assert len(ids) == 23
+    assert len(set(ids)) == 23
+    # Newest day first, and within a timestamp by descending ID
+    assert ids[:5] == ['T0019', 'T0014', 'T0009', 'T0004', 'T0018']
+
+
+def test_rows_without_timestamp_are_paged_after_the_others(app, client, add_transactions):
+    from extensions import db
+    from models import Transaction
+
+    add_transactions([
+        {'id': f'T{i:04d}', 'timestamp': f'2026-10-01T10:00:{i:02d}Z'}
+        for i in range(10)
+    ])
+    undated = ['T0001', 'T0004', 'T0007']
+    with app.app_context():
+        table = Transaction.__table__
+        db.session.execute(table.update().where(table.c.id.in_(undated)).values(timestamp=None))
+        db.session.commit()
+
+    ids = _page_through(client, limit=2)
+
+    assert sorted(ids) == [f'T{i:04d}' for i in range(10)]
+    assert ids[-3:] == sorted(undated, reverse=True)
+
+
+@pytest.mark.parametrize('limit', [1, 3, 5])
+def test_mixed_null_and_dated_rows_page_in_order(app, client, add_transactions, limit):
+    from sqlalchemy import event
+    from extensions import db
+    from models import Transaction
+
+    add_transactions([
+        {'id': f'T{i:04d}', 'timestamp': f'2026-10-{1 + i % 3:02d}T10:00:00Z'}
+        for i in range(12)
+    ])
+    # Undated rows on either side of the dated IDs
+    undated = ['T0000', 'T0005', 'T0006', 'T0011']
+    with app.app_context():
+        table = Transaction.__table__
+        db.session.execute(table.update().where(table.c.id.in_(undated)).values(timestamp=None))
+        db.session.commit()
+
+        statements = []
+
+        def record(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        event.listen(db.engine, 'before_cursor_execute', record)
+        try:
+            ids = _page_through(client, limit=limit)
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', record)
+
+    dated = [f'T{i:04d}' for i in range(12) if f'T{i:04d}' not in undated]
+    expected = sorted(dated, key=lambda txn_id: ((int(txn_id[1:]) % 3), txn_id), reverse=True)
+    assert ids == expected + sorted(undated, reverse=True)
+    # The order is spelled out rather than left to the database's NULL placement
+    assert any('NULLS LAST' in statement for statement in statements)
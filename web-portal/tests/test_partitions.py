@@ -0,0 +1,80 @@
+"""Sealing months into partitions and file-level retention"""
+
+import os
+
+from integrity import get_integrity_tree
+from partitions import get_transaction_partitions
+
+
+def _add_old_months(add_transactions):
+    add_transactions([
+        {'id': f'T{month}{i:02d}', 'amount': 500 + i, 'terminalId': f'TERM{month}', 'merchantId': 'MERCH01',
+         'timestamp': f'2025-{month:02d}-{10 + i:02d}T10:00:00Z'}
+        for month in (1, 2, 3) for i in range(4)
+    ])
+
+
+def test_seal_moves_closed_months_out_of_the_main_table(app, client, add_transactions):
+    from extensions import db
+    from models import Transaction
+
+    _add_old_months(add_transactions)
+    add_transactions([{'id': 'TNEW', 'timestamp': '2099-01-01T10:00:00Z'}])
+
+    with app.app_context():
+        partitions = get_transaction_partitions()
+        assert partitions.seal_closed_months() == ['2025-01', '2025-02', '2025-03']
+        assert partitions.months() == ['2025-03', '2025-02', '2025-01']
+        assert db.session.query(Transaction.id).all() == [('TNEW',)]
+        assert get_integrity_tree().verify(full=True)['ok']
+
+    response = client.get('/api/transactions', query_string={'limit': 100})
+    ids = [txn['id'] for txn in response.get_json()['transactions']]
+    assert len(ids) == 13
+    detail = client.get('/api/transactions/T201').get_json()
+    assert detail['terminalId'] == 'TERM2'
+
+
+def test_purge_removes_expired_partitions_and_their_trees(app, add_transactions):
+    _add_old_months(add_transactions)
+
+    with app.app_context():
+        partitions = get_transaction_partitions()
+        partitions.seal_closed_months()
+        path = partitions.path_for('2025-01')
+
+        assert sorted(partitions.purge_expired(retention_days=30)) == ['2025-01', '2025-02', '2025-03']
+        assert partitions.months() == []
+        assert get_integrity_tree().root()['transactions'] == 0
+
+        # A reader after the purge does not bring the file back
+        with partitions.sessions(['2025-01']) as sessions:
+            assert sessions == []
+    assert not os.path.exists(path)
+
+
+def test_maintenance_runs_only_in_the_process_holding_the_lock(app, monkeypatch):
+    import fcntl
+    import threading
+    from partitions import LOCK_FILE, TransactionPartitions
+
+    passes = threading.Event()
+    partitions = TransactionPartitions(check_interval=0.05)
+    partitions.init_app(app)
+    monkeypatch.setattr(partitions, 'seal_closed_months', passes.set)
+    monkeypatch.setattr(partitions, 'purge_expired', lambda retention_days: [])
+
+    os.makedirs(os.path.dirname(LOCK_FILE), exist_ok=True)
+    with open(LOCK_FILE, 'w') as held:
+        # Another worker is maintaining the partitions
+        fcntl.flock(held, fcntl.LOCK_EX)
+        partitions.start()
+        assert not passes.wait(0.3)
+        assert not partitions.maintainer
+
+    # It has exited; this worker takes over
+    try:
+        assert passes.wait(2)
+        assert partitions.maintainer
+    finally:
+        partitions.stop(timeout=2)
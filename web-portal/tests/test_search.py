@@ -0,0 +1,46 @@
+"""Search on encrypted terminal and merchant IDs through their blind indexes"""
+
+from cryptography.fernet import Fernet
+
+from security import SecurityManager
+
+
+def _manager(*keys):
+    manager = SecurityManager()
+    manager.set_encryption_keys(list(keys))
+    return manager
+
+
+def _search(client, term):
+    response = client.get('/api/transactions', query_string={'search': term})
+    assert response.status_code == 200
+    return sorted(txn['id'] for txn in response.get_json()['transactions'])
+
+
+def test_search_matches_encrypted_ids(app, client, add_transactions):
+    from extensions import db
+    from models import Transaction
+
+    add_transactions([
+        {'id': 'T0001', 'terminalId': 'TERM0001', 'merchantId': 'MERCH01', 'timestamp': '2026-10-01T10:00:00Z'},
+        {'id': 'T0002', 'terminalId': 'TERM0002', 'merchantId': 'MERCH01', 'timestamp': '2026-10-01T10:01:00Z'},
+        {'id': 'T0003', 'terminalId': 'TERM0001', 'merchantId': 'MERCH02', 'timestamp': '2026-10-01T10:02:00Z'},
+    ])
+
+    with app.app_context():
+        stored = db.session.get(Transaction, 'T0001')
+        assert stored._terminal_id != 'TERM0001'
+        assert stored.terminal_id == 'TERM0001'
+
+    assert _search(client, 'TERM0001') == ['T0001', 'T0003']
+    assert _search(client, 'term0001') == ['T0001', 'T0003']
+    assert _search(client, 'MERCH01') == ['T0001', 'T0002']
+    assert _search(client, 'TERM9999') == []
+
+
+def test_blind_index_is_normalised_and_separated_by_field():
+    manager = _manager(Fernet.generate_key().decode('utf-8'))
+
+    assert manager.blind_index(' term0001 ', 'terminal_id') == manager.blind_index('TERM0001', 'terminal_id')
+    assert manager.blind_index('TERM0001', 'terminal_id') != manager.blind_index('TERM0001', 'merchant_id')
+    assert manager.blind_index('', 'terminal_id') is None
@@ -0,0 +1,59 @@
+"""AES-GCM field encryption envelopes and legacy Fernet values"""
+
+from base64 import b64decode, b64encode
+
+from cryptography.fernet import Fernet
+
+from security import SecurityManager, ENVELOPE_VERSION
+
+
+def _manager(*keys):
+    manager = SecurityManager()
+    manager.set_encryption_keys(list(keys))
+    return manager
+
+
+def test_envelope_round_trip():
+    key = Fernet.generate_key().decode('utf-8')
+    manager = _manager(key)
+
+    encrypted = manager.encrypt_data('4111111111111111', codec='str')
+
+    raw = b64decode(encrypted)
+    assert raw[0] == ENVELOPE_VERSION
+    assert raw[1:5].hex() == manager.key_ids()[0]
+    assert encrypted.startswith(manager.envelope_prefix())
+    assert not manager.needs_reencryption(encrypted)
+    assert manager.decrypt_data(encrypted, codec='str') == '4111111111111111'
+
+
+def test_envelope_nonce_differs_per_value():
+    manager = _manager(Fernet.generate_key().decode('utf-8'))
+
+    assert manager.encrypt_data('same', codec='str') != manager.encrypt_data('same', codec='str')
+
+
+def test_codecs_round_trip():
+    manager = _manager(Fernet.generate_key().decode('utf-8'))
+
+    assert manager.decrypt_data(manager.encrypt_data({'a': [1, 2]}), codec='json') == {'a': [1, 2]}
+    assert manager.decrypt_data(manager.encrypt_data(b'\x00\xff'), codec='bytes') == b'\x00\xff'
+    assert manager.decrypt_data(manager.encrypt_data(1250, codec='str'), codec='str') == '1250'
+
+
+def test_tampered_envelope_does_not_decrypt():
+    manager = _manager(Fernet.generate_key().decode('utf-8'))
+    raw = bytearray(b64decode(manager.encrypt_data('secret', codec='str')))
+    raw[-1] ^= 1
+
+    assert manager.decrypt_data(b64encode(bytes(raw)).decode('ascii'), codec='str') is None
+
+
+def test_legacy_fernet_values_decrypt_through_the_multifernet():
+    old_key, new_key = Fernet.generate_key(), Fernet.generate_key().decode('utf-8')
+    legacy = b64encode(Fernet(old_key).encrypt(b'TERM0001')).decode('ascii')
+    manager = _manager(new_key, old_key.decode('utf-8'))
+
+    assert manager.is_legacy_ciphertext(legacy)
+    assert manager.needs_reencryption(legacy)
+    assert manager.decrypt_data(legacy, codec='str') == 'TERM0001'
@@ -0,0 +1,103 @@
+"""Background processor sync into the local cache"""
+
+from types import SimpleNamespace
+
+import pytest
+import requests
+
+import sync
+from processor_client import CircuitBreaker
+
+
+class FakeProcessor:
+    """Stands in for the processor client, answering from in-memory records"""
+
+    def __init__(self):
+        self.breaker = CircuitBreaker()
+        self.transactions = []
+        self.requests = []
+        self.down = False
+
+    def get(self, path, params=None, headers=None):
+        params = dict(params or {})
+        self.requests.append((path, params))
+        if self.down:
+            raise requests.ConnectionError('Connection refused')
+
+        if path == '/status':
+            body = {'status': 'RUNNING', 'transactionsProcessed': len(self.transactions)}
+        elif path == '/stats':
+            body = {'total': len(self.transactions)}
+        else:
+            rows = sorted(self.transactions, key=lambda txn: (txn['timestamp'], txn['id']))
+            if 'sinceId' in params:
+                mark = (params['since'], params['sinceId'])
+                body = [txn for txn in rows if (txn['timestamp'], txn['id']) > mark][:params['limit']]
+            elif 'since' in params:
+                body = [txn for txn in rows if txn['timestamp'] >= params['since']][:params['limit']]
+            else:
+                body = rows[-params['limit']:]
+        return SimpleNamespace(status_code=200, headers={}, json=lambda: body)
+
+
+@pytest.fixture
+def processor(app, monkeypatch):
+    """Fake processor behind a fresh sync service"""
+    fake = FakeProcessor()
+    service = sync.ProcessorSync(transaction_limit=5)
+    service.init_app(app)
+    service.leader = True
+    monkeypatch.setattr(sync, 'get_processor_client', lambda: fake)
+    monkeypatch.setattr(sync, 'processor_sync', service)
+    return fake
+
+
+def _record(i, timestamp=None):
+    return {'id': f'T{i:04d}', 'mti': '0200', 'processingCode': '000000', 'responseCode': '00',
+            'direction': 'INBOUND', 'terminalId': 'TERM0001',
+            'timestamp': timestamp or f'2026-10-01T10:00:{i:02d}.000Z'}
+
+
+def _sync(app):
+    with app.app_context():
+        sync.get_processor_sync().sync_once()
+
+
+def test_sync_fills_the_cache_the_routes_serve(app, client, processor):
+    processor.transactions = [_record(i) for i in range(3)]
+
+    _sync(app)
+    response = client.get('/api/transactions')
+
+    assert sorted(txn['id'] for txn in response.get_json()['transactions']) == ['T0000', 'T0001', 'T0002']
+    # The request itself never reaches the processor
+    assert [path for path, _ in processor.requests] == ['/status', '/transactions', '/stats']
+
+
+def test_failed_sync_keeps_the_cached_rows(app, client, processor):
+    processor.transactions = [_record(0)]
+    _sync(app)
+
+    processor.down = True
+    _sync(app)
+
+    response = client.get('/api/transactions')
+    assert [txn['id'] for txn in response.get_json()['transactions']] == ['T0000']
+    assert 'Connection refused' in sync.get_processor_sync().freshness('transactions')['error']
+
+
+def test_rows_sharing_the_high_water_timestamp_are_paged_through(app, client, processor):
+    processor.transactions = [_record(0)]
+    _sync(app)
+
+    # More rows in one millisecond than fit in a batch
+    processor.transactions += [_record(i, '2026-10-01T10:00:05.123Z') for i in range(1, 13)]
+    processor.requests.clear()
+    _sync(app)
+
+    response = client.get('/api/transactions', query_string={'limit': 20})
+    assert len(response.get_json()['transactions']) == 13
+    service = sync.get_processor_sync()
+    assert (service.high_water, service.high_water_id) == ('2026-10-01T10:00:05.123Z', 'T0012')
+    pages = [params for path, params in processor.requests if path == '/transactions']
+    assert [params.get('sinceId') for params in pages] == ['T0000', 'T0005', 'T0010']